@@ -12,17 +12,25 @@ import re
 import shutil
 import time
 
-from ase.io import read
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
 from auto_nep.sysprint import sysprint
+from auto_nep.abacus.abacus_log import convert_log
+from auto_nep.abacus.manifest import ParseManifest
+from auto_nep.utils.convert import PPBasisLookup, write_stru_dataset
+from auto_nep.watcher import TaskWatcher
+from auto_nep.scheduler import get_scheduler, read_job_id, write_job_id
 
 
 class Abacus():
-    def __init__(self, config=None, xyz_path="."):
+    def __init__(self, config=None, xyz_path=".", scheduler=None):
         self.config = config
         self.xyz_path = xyz_path
         self.dataset_roots = []
+        self.scheduler = scheduler if scheduler is not None else get_scheduler((config or {}).get("scheduler"))
+        self.job_ids = {}
+        self.pp_basis = None
 
     def run(self, filename: str):
         self.xyz2abacus()
@@ -36,78 +44,183 @@ class Abacus():
         :param config:
         :return:
         """
-        pp, basis = {}, {}
-
-        for index, element_type in enumerate(self.config['element_type']):
-            pp_flag, basis_flag = False, False  # 标志位
-            # pp_pattern: 以元素类型开头, 以.upf结尾
-            pp_pattern = rf'^{element_type}[._].*upf$'
-            # basis_pattern: 以元素类型开头, 以.orb结尾
-            basis_pattern = rf'^{element_type}[._].*orb$'
-
-            for filename in os.listdir(self.config["abacus"]["pp_path"]):
-                if re.match(pp_pattern, filename):
-                    pp[f'{element_type}'] = filename
-                    pp_flag = True
-                    break
-
-            for filename in os.listdir(self.config["abacus"]["basis_path"]):
-                if re.match(basis_pattern, filename):
-                    basis[f'{element_type}'] = filename
-                    basis_flag = True
-                    break
-
-            if pp_flag is False:
-                sysprint(f'未找到 {element_type} 赝势文件, 请检查 {self.config["abacus"]["pp_path"]}', 'red')
-                exit()
-            if basis_flag is False:
-                sysprint(f'未找到 {element_type} 轨道文件, 请检查 {self.config["abacus"]["basis_path"]}', 'red')
-                exit()
+        lookup = PPBasisLookup(self.config["abacus"]["pp_path"], self.config["abacus"]["basis_path"])
+        try:
+            pp, basis = lookup.get(self.config['element_type'])
+        except FileNotFoundError as e:
+            sysprint(str(e), 'red')
+            exit()
         sysprint(f'赝势文件: {pp}', 'yellow')
         sysprint(f'轨道文件: {basis}', 'yellow')
         return pp, basis
     
-    def xyz2abacus(self):
+    def xyz2abacus(self, n_jobs=None):
         """
-        制作 abacus 训练集
-        :param config: 训练配置
+        制作 abacus 训练集: 一次扫描 xyz, STRU 由进程池写入
+        :param n_jobs: 进程数, None 读取 active.n_jobs
         :return: 数据集路径
         """
         # 自动生成 abacus dataset
         home_path = os.getcwd()
-        atoms = read(self.xyz_path, index=":")
+        if n_jobs is None:
+            n_jobs = (self.config or {}).get("active", {}).get("n_jobs", 1)
         # 寻找赝势文件和轨道文件
-        pp, basis = self.find_pp_basis()
-        sysprint(f'abacus_dataset 训练集大小: {len(atoms)}')
-        for i in range(1, len(atoms) + 1):
-            single_struc = read(self.xyz_path, index=f'{i-1}')
+        if self.pp_basis is None:
+            self.pp_basis = self.find_pp_basis()
+        pp, basis = self.pp_basis
+        start = time.perf_counter()
+        try:
+            roots, _ = write_stru_dataset(os.path.abspath(self.xyz_path), lambda i: home_path + f'/{i}',
+                                          PPBasisLookup(pp=pp, basis=basis), n_jobs)
+        except FileNotFoundError as e:
+            sysprint(str(e), 'red')
+            exit()
+        elapsed = time.perf_counter() - start
+        self.dataset_roots.extend(roots)
+        sysprint(f'abacus_dataset 训练集大小: {len(roots)}, 写入 STRU 用时 {elapsed:.1f} s '
+                 f'({len(roots) / max(elapsed, 1e-9):.0f} 结构/s)')
+
+    def sub_structures(self, structures, start=1):
+        """
+        流式模式: 写入 STRU 后立即提交, 目录编号与之后 xyz2abacus 读取 to_add.xyz 的编号一致
+        :param structures: ase Atoms 列表
+        :param start: 第一个结构的目录编号
+        :return: 结构目录列表
+        """
+        if self.pp_basis is None:
+            self.pp_basis = self.find_pp_basis()
+        pp, basis = self.pp_basis
+        home_path = os.getcwd()
+        roots = []
+        for i, single_struc in enumerate(structures, start):
             os.makedirs(f'./{i}', exist_ok=True)
-            single_struc.write(f'./{i}/STRU', format='abacus', pp=pp,
-                        basis=basis)
-            self.dataset_roots.append(home_path+f'/{i}')
+            single_struc.write(f'./{i}/STRU', format='abacus', pp=pp, basis=basis)
+            roots.append(home_path + f'/{i}')
+        self.dataset_roots.extend(roots)
+        self.sub_abacus(roots)
+        return roots
 
-    def sub_abacus(self):
+    def sub_abacus(self, roots=None):
         """
         提交任务脚本
-        :param config: 配置文件
+        packing = none: 每个结构一个作业
+        packing = bundle: 每 tasks_per_job 个结构打包为一个作业, 依次计算
+        packing = array: 一个作业数组, 每个元素依次计算 tasks_per_job 个结构
+        :param roots: 结构目录, None 为全部 dataset_roots
         :return:
         """
 
         # 提交任务: 收敛标准 time.json文件
         task_num = 0
         home_path = os.getcwd()
-        
-        for root in self.dataset_roots:
+
+        pending = []
+        for root in self.dataset_roots if roots is None else roots:
             if not os.path.exists(root + "/time.json"):
+                # 作业仍在排队或运行, 不重复提交
+                job_id = read_job_id(root)
+                if job_id is not None and self.scheduler.active([job_id]):
+                    self.job_ids[root] = job_id
+                    continue
                 shutil.copy(self.config["abacus"]["abacus_input_path"], root)
+                pending.append(root)
+
+        packing = self.config["abacus"].get("packing", "none")
+        if packing == "none":
+            pbs = os.path.basename(self.config["abacus"]["abacus_pbs_path"])
+            for root in pending:
                 shutil.copy(self.config["abacus"]["abacus_pbs_path"], root)
                 os.chdir(root)
-                os.system('qsub abacus.pbs')
+                self.job_ids[root] = self.scheduler.submit(pbs)
                 task_num += 1
+        elif packing in ("bundle", "array"):
+            task_num = self.sub_packed(pending, packing)
+        else:
+            sysprint(f'packing 只能为 none / bundle / array, 请检查配置文件', 'red')
+            exit()
         # 提交完成后退回主目录
         os.chdir(home_path)
-        sysprint(f'任务提交完成 提交计算任务: {task_num}')
+        sysprint(f'任务提交完成 提交计算任务: {len(pending)} 结构, {task_num} 作业')
+
+    def tasks_per_job(self):
+        """
+        每个作业计算的结构数: tasks_per_job 或 target_walltime / task_walltime (h)
+        """
+        config = self.config["abacus"]
+        if config.get("tasks_per_job"):
+            return max(1, int(config["tasks_per_job"]))
+        return max(1, int(config.get("target_walltime", 24) // config.get("task_walltime", 1)))
 
+    def sub_packed(self, roots, packing):
+        """
+        打包提交: 作业脚本由 abacus.pbs 的表头 (#PBS / #SBATCH) 和计算命令拼成,
+        在每个结构目录中依次执行计算命令, 已有 time.json 的结构跳过
+        :param roots: 待计算的结构目录
+        :param packing: bundle 或 array
+        :return: 提交的作业数
+        """
+        if not roots:
+            return 0
+        n = self.tasks_per_job()
+        groups = [roots[i: i + n] for i in range(0, len(roots), n)]
+        header, body = self.split_pbs(self.config["abacus"]["abacus_pbs_path"])
+        jobs_dir = os.path.abspath("abacus_jobs")
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        def loop(roots_expr):
+            return (f"for root in {roots_expr}; do\n"
+                    f"    cd $root\n"
+                    f"    [ -f time.json ] && continue\n"
+                    # 计算命令不缩进, 保证 heredoc 结束符在行首
+                    + "".join(f"{line}\n" for line in body) +
+                    f"done\n")
+
+        job_ids = []
+        if packing == "bundle":
+            # 按第一个结构目录命名, 流式模式多次提交时不覆盖排队中的脚本
+            for group in groups:
+                script = f"bundle_{os.path.basename(group[0])}.pbs"
+                with open(os.path.join(jobs_dir, script), "w") as f:
+                    f.write("".join(header) + loop(" ".join(group)))
+                job_ids.append(self.scheduler.submit(script, jobs_dir))
+        else:
+            name = os.path.basename(roots[0])
+            tasks_txt = os.path.join(jobs_dir, f"tasks_{name}.txt")
+            with open(tasks_txt, "w") as f:
+                f.write("\n".join(roots) + "\n")
+            with open(os.path.join(jobs_dir, f"array_{name}.pbs"), "w") as f:
+                f.write("".join(header))
+                f.write("INDEX=${PBS_ARRAY_INDEX:-${PBS_ARRAYID:-${SLURM_ARRAY_TASK_ID:-0}}}\n")
+                f.write(loop(f'$(sed -n "$((INDEX * {n} + 1)),$((INDEX * {n} + {n}))p" {tasks_txt})'))
+            job_ids = [self.scheduler.submit(f"array_{name}.pbs", jobs_dir, array=len(groups))] * len(groups)
+
+        # 每个结构目录记录所属作业号, 完成检测和续算按结构进行
+        for group, job_id in zip(groups, job_ids):
+            for root in group:
+                write_job_id(root, job_id)
+                self.job_ids[root] = job_id
+        sysprint(f'{packing} 模式: 每个作业 {n} 结构')
+        return len(set(job_ids))
+
+    @staticmethod
+    def split_pbs(pbs_path):
+        """
+        拆分作业脚本: 开头的注释行 (#!, #PBS, #SBATCH) 为表头, 其余为计算命令
+        去掉 cd $PBS_O_WORKDIR / cd $SLURM_SUBMIT_DIR, 计算命令在各结构目录中执行
+        """
+        with open(pbs_path) as f:
+            lines = f.readlines()
+        header, body = [], []
+        for line in lines:
+            if not body and (line.startswith("#") or not line.strip()):
+                header.append(line)
+                continue
+            stripped = line.strip()
+            if re.match(r"^cd\s+\$\{?(PBS_O_WORKDIR|SLURM_SUBMIT_DIR)\}?\s*$", stripped):
+                continue
+            if stripped:
+                body.append(line.rstrip("\n"))
+        return header, body
 
     def spend_time(self, task_path):
         """
@@ -115,6 +228,9 @@ class Abacus():
         :param task_path: 任务路径
         :return: step time: h m s
         """
+        if not os.path.exists(task_path + "/out.log"):
+            # 打包作业中排队等待的结构
+            return None, "0", "0", "0"
         with open(task_path + "/out.log", encoding='utf-8') as f:
             content = f.read()
             time_pattern = re.compile(r" CU\d+\s+.*\s+(\d+\.\d+)$", re.MULTILINE)
@@ -139,172 +255,69 @@ class Abacus():
         3. 无 out.log 无 time.json 等待中
         :return:
         """
-        start_time = time.perf_counter()
-        total_time = 0  # 计算总耗时 min
-
-        # 处理未计算任务
-        warn_times = 1
-        while True:
-            accomplish = []
-            calculating = []
-            awating = []
-            for root in self.dataset_roots:
-                time_json = root + "/time.json"
-                out_log = root + f'/out.log'
-                if os.path.isfile(time_json):
-                    accomplish.append(root)
-                elif os.path.isfile(out_log):
-                    calculating.append(root)
-                else:
-                    awating.append(root)
-
-            if total_time % 6 == 0:
-                # Current Task 打印模块
-                sysprint("\n-------------------------------- abacus -------------------------------\n"
-                        f'Total task num: {len(self.dataset_roots)}\t'
-                         f'Total time(s): {round(time.perf_counter() - start_time, 2)}\t'
-                         f"  Progress:{len(accomplish)}/{len(self.dataset_roots)}\n"
-                        f"-----------------------------------------------------------------------")
-                for task in calculating:
-                    step, h, m, s = self.spend_time(task)
-                    print(f"Current Task: [{task}] Spend Time: [{h}h {m}m {s}s]\n"
-                          f"Step: [{step}]\n"
-                          f"-----------------------------------------------------------------------")
-
-            if len(accomplish) == len(self.dataset_roots):
-                sysprint("计算完成提取 nep 训练集 train.xyz", 'red')
-                sysprint(f"Mean time(s):{(time.perf_counter() - start_time) / len(accomplish): .2f} s")
-                break
-
-            # if len(calculating) == 0 and len(awating) > 0:
-            #     sysprint(f"Warning {warn_times}: 以下任务未进行计算!", "red")
-            #     for task in awating:
-            #         print(f"{task}")
-            #     warn_times += 1
-            #     if warn_times > self.config["abacus"]["warn_times"]:
-            #         # 警告超过三次 自动退出
-            #         exit()
-
-            total_time += 1
-            time.sleep(10)
-
-    def abacus2nep(self, filename="train.xyz"):
+        task_num = len(self.dataset_roots)
+
+        def progress(watcher):
+            # Current Task 打印模块
+            sysprint("\n-------------------------------- abacus -------------------------------\n"
+                    f'Total task num: {task_num}\t'
+                     f'Total time(s): {round(watcher.elapsed(), 2)}\t'
+                     f"  Progress:{len(watcher.tasks(watcher.DONE))}/{task_num}\n"
+                    f"-----------------------------------------------------------------------")
+            for task in watcher.tasks(watcher.RUNNING):
+                step, h, m, s = self.spend_time(task)
+                print(f"Current Task: [{task}] Spend Time: [{h}h {m}m {s}s]\n"
+                      f"Step: [{step}]\n"
+                      f"-----------------------------------------------------------------------")
+
+        watcher = TaskWatcher(self.dataset_roots, done_file="time.json", running_file="out.log",
+                              scheduler=self.scheduler, job_ids=self.job_ids)
+        for _ in watcher.completions(progress):
+            pass
+        for task in watcher.tasks(watcher.FAILED):
+            sysprint(f"[Warning] abacus 任务 {task} 作业 {self.job_ids[task]} 已结束但未生成 time.json", "red")
+        sysprint("计算完成提取 nep 训练集 train.xyz", 'red')
+        sysprint(f"Mean time(s):{watcher.elapsed() / max(task_num, 1): .2f} s")
+        sysprint(watcher.report())
+
+    def abacus2nep(self, filename="train.xyz", n_jobs=None):
         """
         abacus 训练集 -> nep 训练集
+        日志在进程池中解析, 按日志路径顺序写入 filename
+        解析结果记录在 filename.manifest.json, 再次调用时只解析新增或变化的日志
+        :param filename: 输出文件
+        :param n_jobs: 解析进程数, None 读取 active.n_jobs
         """
         sysprint("正在生成 nep 训练 trian.xyz 文件")
+        if n_jobs is None:
+            n_jobs = (self.config or {}).get("active", {}).get("n_jobs", 1)
 
+        # 目录按名称排序, 输出顺序与文件系统无关
         log_files = []
         for root in self.dataset_roots:
-            for root2, _, files in os.walk(root):
-                for file in files:
+            for root2, dirs, files in os.walk(root):
+                dirs.sort()
+                for file in sorted(files):
                     if file == "running_scf.log":
                         log_files.append(os.path.abspath(os.path.join(root2, file)))
 
-        for log_file in tqdm(log_files):
-            with open(log_file, encoding='utf-8') as f:
-                content = f.read()
-            if "charge density convergence is achieved" not in content:
-                sysprint(f"任务未收敛: {log_file}", "red")
-                continue
-
-            # config_type 训练集位置 windows 和 linux 不同
-            if os.name == "nt":
-                # Windows
-                config_type = log_file.split("\\")[:-2]
-                config_type = "\\".join(config_type)
-            elif os.name == "posix":
-                # Linux
-                config_type = log_file.split("/")[:-2]
-                config_type = "/".join(config_type)
-
-            # 提取原子总数
-            total_atom_number_match = re.search(r"TOTAL ATOM NUMBER = (\d+)", content)
-            if total_atom_number_match:
-                total_atom_number = total_atom_number_match.group(1)
-            else:
-                sysprint(f"{log_file} 能量无法提取!", "red")
-                continue
-
-            # 提取晶格常数
-            lattice_match = re.search(r" Lattice vectors.*(\n.*\n.*\n.*)", content)
-            if lattice_match:
-                lattice = lattice_match.group(1).strip().replace('+', '')
-                lattice = ' '.join([f'{float(l):.10f}' for l in lattice.split()])
-            else:
-                sysprint(f'{log_file} 晶格常数无法提取!', "red")
-                continue
-
-            # 提取能量
-            energy_match = re.search(r"FINAL_ETOT_IS\s+(\S+)", content)
-            if energy_match:
-                energy = float(energy_match.group(1))
+        def convert(todo):
+            if n_jobs == 1:
+                results = map(convert_log, todo)
             else:
-                sysprint(f'{log_file} 能量无法提取!', 'red')
-                continue
-
-            # 提取体积
-            volume_match = re.search(r"Volume \(A\^3\) = (\S+)", content)
-            volume = float(volume_match.group(1).strip())
-
-            # stress 单位转换: kbar -> ev/A^3 正压负拉 -> 负拉正压
-            stress_match = re.search(r"TOTAL-STRESS.*\n.*(\n.*\n.*\n.*)", content)
-            if stress_match:
-                stress = stress_match.group(1).strip()
-                # stress = ' '.join([f'{-float(s) * 0.0062415091:.10f}' for s in stress.split()])
-                virial = ' '.join([f'{volume * float(s) * 0.062415091:.10f}' for s in stress.split()])
-
-            else:
-                sysprint(f'{log_file} 压力无法提取!", "red')
-                continue
-
-            # 位置和力 分数坐标 -> 笛卡尔坐标
-            # 读取 a b c
-            cell_a_match = re.search(r"NORM_A\s+\S+ (.*)", content)
-            cell_b_match = re.search(r"NORM_B\s+\S+ (.*)", content)
-            cell_c_match = re.search(r"NORM_C\s+\S+ (.*)", content)
-
-            cell_a = float(cell_a_match.group(1))
-            cell_b = float(cell_b_match.group(1))
-            cell_c = float(cell_c_match.group(1))
-
-            # 元素类型和坐标转换
-            type_position_match = re.compile(r"taud_([a-z,A-z]+)\w+\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)")
-            type_position = type_position_match.findall(content)
-            type_position = [f'{type}\t{float(x) * cell_a:.10f}\t{float(y) * cell_b:.10f}\t{float(z) * cell_c:.10f}' for
-                             type, x, y, z in type_position]
-            # 力 找到TOTAL-FORCE开头后面,所有这类格式的行
-            force_match = re.compile(
-                r"TOTAL-FORCE \(eV/Angstrom\)\s*"
-                r"------------------------------------------------------------------------------------------\s*"
-                r"((?:\s*\S+\s+-?\d+\.\d+\s+-?\d+\.\d+\s+-?\d+\.\d+\s*\n)*)",
-                re.DOTALL
-            )
-            force = force_match.search(content).group(1)
-            force = list(filter(None, force.split('\n')))
-            # 输出文件
-            with open(filename, 'a', encoding='utf-8') as f:
-                # Stress 表头
-                # f.write(f'{total_atom_number}\n'
-                #         f'Energy={energy:.10f} Lattice=\"{lattice}\" Stress=\"{stress}\"'
-                #         f' Config_type=\"{config_type}\" Properties=species:S:1:pos:R:3:forces:R:3'
-                #         f' Weight=1.0 Pbc=\"T T T\"\n')
-
-                # virial 表头
-                f.write(f'{total_atom_number}\n'
-                        f'Energy={energy:.10f} Lattice=\"{lattice}\" Virial=\"{virial}\"'
-                        f' Config_type=\"{config_type}\" Properties=species:S:1:pos:R:3:forces:R:3'
-                        f' Weight=1.0 Pbc=\"T T T\"\n')
-
-                # 元素种类 位置 力
-                for part1, part2 in zip(type_position, force):
-                    part2 = part2.split(' ')
-                    # 定义正则表达式模式，匹配整数和浮点数
-                    pattern = re.compile(r'^[+-]?\d+(\.\d+)?$')
-                    # 使用列表推导式过滤非数字元素
-                    part2 = [item for item in part2 if pattern.match(item)]
-                    part2 = '\t'.join(part2)
-
-                    part = '\t'.join([part1, part2])
-                    f.write(part + "\n")
+                # 有序生成器: 结果按 todo 顺序返回, 边解析边写入
+                results = Parallel(n_jobs=n_jobs, return_as="generator", batch_size="auto")(
+                    delayed(convert_log)(log_file) for log_file in todo
+                )
+            return tqdm(results, total=len(todo))
+
+        # 只解析新增或内容变化的日志, 其余结构从上次的输出中复制
+        start = time.perf_counter()
+        manifest = ParseManifest(filename)
+        summary, messages = manifest.update(log_files, convert)
+        for message in messages:
+            sysprint(message, "red")
+        sysprint(f"abacus2nep: {summary['frames']} 个结构, {summary['failed']} 个失败, "
+                 f"解析 {summary['parsed']} 个日志, 复用 {summary['cached']} 个, "
+                 f"用时 {time.perf_counter() - start:.1f} s")
         
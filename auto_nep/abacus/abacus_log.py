@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：abacus_log.py
+@Author ：RongYi
+@Date ：2025/6/30 09:40
+@E-mail ：2071914258@qq.com
+"""
+import hashlib
+import os
+import re
+
+import numpy as np
+
+# 各字段先用 str.find 定位标记 (取第一次出现, 与逐个 re.search 一致), 再在该位置用预编译的模式解析
+_CONVERGED = "charge density convergence is achieved"
+_NATOMS = re.compile(r"TOTAL ATOM NUMBER = (\d+)")
+_LATTICE = re.compile(r" Lattice vectors.*(\n.*\n.*\n.*)")
+_ENERGY = re.compile(r"FINAL_ETOT_IS\s+(\S+)")
+_VOLUME = re.compile(r"Volume \(A\^3\) = (\S+)")
+_STRESS = re.compile(r"TOTAL-STRESS.*\n.*(\n.*\n.*\n.*)")
+_NORM = {axis: re.compile(rf"NORM_{axis}\s+\S+ (.*)") for axis in "ABC"}
+_TAUD = re.compile(r"taud_([a-z,A-z]+)\w+\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)")
+_FORCE = re.compile(
+    r"TOTAL-FORCE \(eV/Angstrom\)\s*"
+    r"------------------------------------------------------------------------------------------\s*"
+    r"((?:\s*\S+\s+-?\d+\.\d+\s+-?\d+\.\d+\s+-?\d+\.\d+\s*\n)*)",
+    re.DOTALL
+)
+# 以空格分隔的整数或浮点数 (与按 ' ' 切分后逐个匹配 ^[+-]?\d+(\.\d+)?$ 相同)
+_NUMBER = re.compile(r"(?<![^ \n])[+-]?\d+(?:\.\d+)?(?![^ \n])")
+
+# kbar * A^3 -> eV
+KBAR_A3_TO_EV = 0.062415091
+
+
+def config_type_of(log_file):
+    """
+    config_type: running_scf.log 往上两级的目录
+    """
+    sep = "\\" if os.name == "nt" else "/"
+    return sep.join(log_file.split(sep)[:-2])
+
+
+def parse_log(log_file):
+    """
+    解析 running_scf.log, 每个字段只从其标记处匹配
+    :param log_file: running_scf.log 路径
+    :return: (frame, message) 解析失败时 frame 为 None, message 为原因
+             frame: dict natoms, energy, lattice (3, 3), volume, virial (9,), species (n,),
+                    positions (n, 3) 笛卡尔坐标, forces (n, 3), force_text (n,) 力的原始文本, config_type
+    """
+    with open(log_file, encoding='utf-8') as f:
+        content = f.read()
+    return parse_content(content, log_file)
+
+
+def parse_content(content, log_file):
+    """
+    解析已读入的 running_scf.log 内容, 见 parse_log
+    """
+    if _CONVERGED not in content:
+        return None, f"任务未收敛: {log_file}"
+
+    def search(pattern, marker):
+        """
+        从 marker 第一次出现的位置开始匹配, 不从头扫描整个日志
+        """
+        pos = content.find(marker)
+        while pos >= 0:
+            m = pattern.match(content, pos)
+            if m is not None:
+                return m
+            pos = content.find(marker, pos + 1)
+        return None
+
+    natoms = search(_NATOMS, "TOTAL ATOM NUMBER")
+    if natoms is None:
+        return None, f"{log_file} 能量无法提取!"
+    lattice = search(_LATTICE, " Lattice vectors")
+    if lattice is None:
+        return None, f'{log_file} 晶格常数无法提取!'
+    energy = search(_ENERGY, "FINAL_ETOT_IS")
+    if energy is None:
+        return None, f'{log_file} 能量无法提取!'
+    volume = search(_VOLUME, "Volume (A^3)")
+    if volume is None:
+        return None, f'{log_file} 体积无法提取!'
+    stress = search(_STRESS, "TOTAL-STRESS")
+    if stress is None:
+        return None, f'{log_file} 压力无法提取!'
+    norm = [search(_NORM[axis], f"NORM_{axis}") for axis in "ABC"]
+    if any(m is None for m in norm):
+        return None, f'{log_file} 晶胞长度无法提取!'
+    force = search(_FORCE, "TOTAL-FORCE (eV/Angstrom)")
+    if force is None:
+        return None, f'{log_file} 力无法提取!'
+
+    lattice = np.array(lattice.group(1).replace('+', '').split(), dtype=np.float64).reshape(3, 3)
+    volume = float(volume.group(1).strip())
+    # stress 单位转换: kbar -> eV, 与 volume * s * 0.062415091 逐元素相同
+    virial = volume * np.array(stress.group(1).split(), dtype=np.float64) * KBAR_A3_TO_EV
+
+    # 分数坐标 -> 笛卡尔坐标 (按 a b c 长度缩放)
+    norm = np.array([float(m.group(1)) for m in norm])
+    taud = []
+    pos = content.find("taud_")
+    while pos >= 0:
+        m = _TAUD.match(content, pos)
+        if m is not None:
+            taud.append(m.groups())
+            pos = m.end()
+        else:
+            pos += 1
+        pos = content.find("taud_", pos)
+    species = np.array([t[0] for t in taud], dtype=str)
+    positions = np.array([t[1:] for t in taud], dtype=np.float64).reshape(-1, 3) * norm
+
+    # 力保留原始文本, 输出与日志中的数字逐字一致
+    force_text = _NUMBER.findall(force.group(1))
+    if len(force_text) % 3:
+        # SCF 被中断时力的输出可能不完整
+        return None, f'{log_file} 力数据不完整!'
+    force_text = np.array(force_text, dtype=str).reshape(-1, 3)
+    forces = force_text.astype(np.float64)
+
+    frame = {
+        "natoms": natoms.group(1),
+        "energy": float(energy.group(1)),
+        "lattice": lattice,
+        "volume": volume,
+        "virial": virial,
+        "species": species,
+        "positions": positions,
+        "forces": forces,
+        "force_text": force_text,
+        "config_type": config_type_of(log_file),
+    }
+    return frame, None
+
+
+def format_frame(frame):
+    """
+    nep extxyz 格式 (virial 表头), 元素 位置 力 以 tab 分隔
+    """
+    lattice = ' '.join(f'{v:.10f}' for v in frame["lattice"].ravel().tolist())
+    virial = ' '.join(f'{v:.10f}' for v in frame["virial"].tolist())
+    lines = [
+        f'{frame["natoms"]}\n'
+        f'Energy={frame["energy"]:.10f} Lattice=\"{lattice}\" Virial=\"{virial}\"'
+        f' Config_type=\"{frame["config_type"]}\" Properties=species:S:1:pos:R:3:forces:R:3'
+        f' Weight=1.0 Pbc=\"T T T\"\n'
+    ]
+    for s, (x, y, z), f in zip(frame["species"].tolist(), frame["positions"].tolist(), frame["force_text"].tolist()):
+        lines.append(f'{s}\t{x:.10f}\t{y:.10f}\t{z:.10f}\t' + '\t'.join(f) + '\n')
+    return ''.join(lines)
+
+
+def convert_log(log_file):
+    """
+    解析并格式化一个 running_scf.log, 供进程池调用
+    :return: (text, message, digest) text 为 None 时 message 为失败原因, digest 为日志内容的 sha1
+    """
+    with open(log_file, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    content = raw.decode('utf-8')
+    if '\r' in content:
+        # 与文本模式读取相同的换行转换
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    frame, message = parse_content(content, log_file)
+    if frame is None:
+        return None, message, digest
+    return format_frame(frame), None, digest
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：manifest.py
+@Author ：RongYi
+@Date ：2025/7/1 10:20
+@E-mail ：2071914258@qq.com
+"""
+import hashlib
+import json
+import os
+
+
+def file_digest(path):
+    """
+    文件内容 sha1
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class ParseManifest:
+    """
+    abacus2nep 解析清单, 保存在 {output}.manifest.json
+    logs: {日志路径: {size, mtime, digest, status, offset, length | message}}
+        status 为 ok 时 [offset, offset + length) 是该日志在输出文件中的结构
+        status 为 failed 时 (未收敛或无法提取) 记录原因, 日志不变就不再读取
+    head: 输出文件开头不由清单管理的字节数 (第一次使用清单前已有的内容, 保持原来追加写入的行为)
+    本次没有给出的日志 (例如上一次调用的其他数据集) 保留在清单和输出中, 位于本次日志之前
+    output: 输出文件的 size, mtime, 与实际不符 (被其他程序改动) 时缓存的字节范围作废
+    """
+    VERSION = 1
+
+    def __init__(self, output):
+        self.output = output
+        self.path = f"{output}.manifest.json"
+        self.logs = {}
+        self.head = 0
+        self.load()
+
+    def load(self):
+        output_stat = _stat(self.output)
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = None
+        if data is None or data.get("version") != self.VERSION:
+            self.head = output_stat[0] if output_stat else 0
+            return
+
+        if data.get("output") == output_stat:
+            self.logs = data.get("logs", {})
+            self.head = data.get("head", 0)
+            return
+        # 输出文件已被改动: 现有内容整体保留为 head, 只复用失败记录
+        self.logs = {log: entry for log, entry in data.get("logs", {}).items() if entry["status"] == "failed"}
+        self.head = output_stat[0] if output_stat else 0
+
+    def lookup(self, log_file):
+        """
+        :return: 日志未变化时返回清单条目, 需要重新解析时返回 None
+        """
+        entry = self.logs.get(log_file)
+        if entry is None:
+            return None
+        stat = _stat(log_file)
+        if stat is None or stat[0] != entry["size"]:
+            return None
+        if stat[1] != entry["mtime"]:
+            # 只有时间戳变化 (复制, touch) 时按内容判断
+            if file_digest(log_file) != entry["digest"]:
+                return None
+            entry["mtime"] = stat[1]
+        return entry
+
+    def update(self, log_files, convert):
+        """
+        重新生成输出文件: 未变化的日志复制上次输出中的字节范围, 其余日志由 convert 解析
+        清单中不在 log_files 里的日志按原顺序保留在前面, 与原来追加写入的结果相同
+        先写临时文件再 os.replace, 中断时输出文件和清单保持原样
+        :param log_files: 日志路径, 输出按此顺序
+        :param convert: convert(logs) -> 按 logs 顺序返回 (text, message, digest) 的迭代器
+        :return: 统计 {frames, failed, parsed, cached}, 本次新失败的原因列表
+        """
+        current = set(log_files)
+        # 其他数据集的条目不重新检查, 按在输出文件中的位置排序
+        kept = sorted(((log, entry) for log, entry in self.logs.items() if log not in current),
+                      key=lambda item: item[1].get("offset", -1))
+        cached = {log: self.lookup(log) for log in log_files}
+        todo = [log for log in log_files if cached[log] is None]
+        stats = {log: _stat(log) for log in todo}
+        results = iter(convert(todo))
+
+        summary = {"frames": 0, "failed": 0, "parsed": len(todo), "cached": len(log_files) - len(todo)}
+        messages, logs = [], {}
+        tmp = f"{self.output}.{os.getpid()}.tmp"
+        src = open(self.output, "rb") if os.path.exists(self.output) else None
+        try:
+            with open(tmp, "wb", buffering=1 << 20) as dst:
+                if self.head:
+                    self._copy(src, dst, 0, self.head)
+                for log, entry in kept:
+                    if entry["status"] == "ok":
+                        offset = dst.tell()
+                        self._copy(src, dst, entry["offset"], entry["length"])
+                        entry = dict(entry, offset=offset)
+                    logs[log] = entry
+                for log in log_files:
+                    entry = cached[log]
+                    if entry is None:
+                        text, message, digest = next(results)
+                        size, mtime = stats[log]
+                        entry = {"size": size, "mtime": mtime, "digest": digest}
+                        if text is None:
+                            entry.update(status="failed", message=message)
+                            messages.append(message)
+                        else:
+                            data = text.encode("utf-8")
+                            entry.update(status="ok", offset=dst.tell(), length=len(data))
+                            dst.write(data)
+                    elif entry["status"] == "ok":
+                        offset = dst.tell()
+                        self._copy(src, dst, entry["offset"], entry["length"])
+                        entry = dict(entry, offset=offset)
+                    summary["frames" if entry["status"] == "ok" else "failed"] += 1
+                    logs[log] = entry
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            if src is not None:
+                src.close()
+        os.replace(tmp, self.output)
+        self.logs = logs
+        self.save()
+        return summary, messages
+
+    @staticmethod
+    def _copy(src, dst, offset, length, chunk_size=1 << 24):
+        src.seek(offset)
+        while length > 0:
+            block = src.read(min(chunk_size, length))
+            if not block:
+                raise ValueError(f"{src.name} is shorter than recorded in the manifest")
+            dst.write(block)
+            length -= len(block)
+
+    def save(self):
+        data = {"version": self.VERSION, "output": _stat(self.output), "head": self.head, "logs": self.logs}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
@@ -12,12 +12,19 @@ import re
 import shutil
 import time
 import random
+import numpy as np
 from ase.io import read, write
 from auto_nep.sysprint import sysprint
 from auto_nep.check import check
-from auto_nep.select import select_active, select_extend
+from auto_nep.select import select_active, select_active_incremental, select_extend, StreamSelector
+from auto_nep.select.tools import nep_change
+from auto_nep.select.cache import BProjectionCache
 from auto_nep.abacus import Abacus
-from auto_nep.shift import shift_energy
+from auto_nep.dataset import DatasetStore
+from auto_nep.watcher import TaskWatcher
+from auto_nep.scheduler import get_scheduler, read_job_id
+from auto_nep.utils.xyz_stream import FrameCounter, count_frames, sample_frames
+from auto_nep.shift import shift_energy, ShiftStats
 
 
 class Auto_nep():
@@ -50,8 +57,41 @@ class Auto_nep():
         self.max_structures_per_iteration = self.config["active"]["max_structures_per_iteration"]
         self.max_structures_per_model = self.config["active"]["max_structures_per_model"]
         self.shift_energy = self.config["active"]["shift_energy"]
+        # 增量能量平移: 保存 CᵀC, Cᵀe, 下一次迭代只累加 to_add.xyz
+        self.incremental_shift = self.config["active"].get("incremental_shift", True)
         self.nep = self.config["active"]["nep_path"]
         self.gpumd = self.config["active"]["gpumd_path"]
+        # 增量主动学习集: nep.txt 参数相对变化小于 incremental_tol 时只加入新增结构
+        self.incremental_active_set = self.config["active"].get("incremental_active_set", False)
+        self.incremental_tol = self.config["active"].get("incremental_tol", 0.05)
+        # B projections / gamma 计算进程数
+        self.n_jobs = self.config["active"].get("n_jobs", 1)
+        if self.n_jobs == 0:
+            sysprint("n_jobs 不能为 0 (1 为串行, -1 为所有核) 请检查配置文件", "red")
+            exit()
+        # B projections 写入内存映射文件 (大数据集避免 OOM), 可选 float32 存储
+        self.b_projection_store = self.config["active"].get("b_projection_store", False)
+        self.b_projection_dtype = np.dtype(self.config["active"].get("b_projection_dtype", "float64"))
+        # 主动学习集选择引擎 maxvol / qr / rect
+        self.maxvol_engine = self.config["active"].get("maxvol_engine", "maxvol")
+        # B projections 磁盘缓存 (结构指纹 + nep.txt 摘要), 步骤 3 和 5 以及后续迭代共用
+        self.b_cache = None
+        if self.config["active"].get("b_projection_cache", False):
+            cache_dir = self.config["active"].get("b_projection_cache_dir", self.home_path + "/gpumd-dataset/B_cache")
+            cache_size = self.config["active"].get("b_projection_cache_size", 10)  # GB
+            self.b_cache = BProjectionCache(cache_dir, int(cache_size * 1024 ** 3))
+        # 流式模式: GPUMD 任务完成一个筛选一个, 选中结构立即提交下一次迭代的 SCF
+        self.streaming = self.config["active"].get("streaming", False)
+        # GPUMD 提前结束: extrapolation_dump.xyz 达到 early_stop_factor * max_structures_per_model 结构时取消作业
+        self.early_stop_factor = self.config["active"].get("early_stop_factor", 0)
+        self.gpus_per_job = self.config["active"].get("gpus_per_job", 1)
+        # 作业调度后端 pbs / slurm / local
+        self.scheduler = get_scheduler(self.config.get("scheduler"))
+        # 列式训练集存储: 每次迭代只追加新结构, train.xyz 按需导出, 不再保留每次迭代的副本
+        self.dataset_store = None
+        if self.config["active"].get("dataset_store", False):
+            store_dir = self.config["active"].get("dataset_store_dir", self.home_path + "/gpumd-dataset/dataset_store")
+            self.dataset_store = DatasetStore(store_dir)
 
     def print(self, content, color="white"):
         sysprint(content, color)
@@ -89,6 +129,8 @@ class Auto_nep():
         self.run_scf(iter_num)
         self.run_nep(iter_num)
         self.select_active_set(iter_num)
+        if self.streaming:
+            return self.run_stream(iter_num)
         self.run_gpumd(iter_num)
         if os.path.getsize("./4-gpumd/large_gamma.xyz") == 0:
             return 0
@@ -117,9 +159,11 @@ class Auto_nep():
         if iter_num == 0:
             os.system(f"cat {self.init_train_xyz} > ./train.xyz")
         else:
-            abacus = Abacus(self.config, f"../../iter_{iter_num-1}/5-select_structures/to_add.xyz")
+            abacus = Abacus(self.config, f"../../iter_{iter_num-1}/5-select_structures/to_add.xyz", self.scheduler)
             abacus.run("to_add.xyz")
-            os.remove("ase_sort.dat")
+            # STRU 由子进程写入时 ase_sort.dat 不一定在当前目录
+            if os.path.exists("ase_sort.dat"):
+                os.remove("ase_sort.dat")
         with open("./DONE", "w") as f:
             f.close()
         os.chdir("..")
@@ -138,8 +182,8 @@ class Auto_nep():
             # 能量平移生成平移过后的 train.xyz
             self.print("[Step1] 能量平移")
             if iter_num == 0:
-                os.system(f"cat {self.init_train_xyz} > v0-no-shifted.xyz")
-                shift_energy(f"v0-no-shifted.xyz", "train.xyz")
+                self.merge_train_xyz(0, lambda i: f"v{i}-no-shifted.xyz")
+                self.shift_train_xyz(0)
                 os.system(f"cat {self.init_nep_txt} > nep.txt")
                 os.system(f"cat {self.nep_restart} > nep.restart")
                 with open("DONE", "w") as f:
@@ -147,13 +191,12 @@ class Auto_nep():
                 os.chdir("..")
                 return None
             else:
-                os.system(f"cat ../../iter_{iter_num-1}/2-nep/v{iter_num-1}-no-shifted.xyz"
-                          f" ../1-scf/to_add.xyz > v{iter_num}-no-shifted.xyz")
-                shift_energy(f"v{iter_num}-no-shifted.xyz", "train.xyz")  # train.xyz
+                self.merge_train_xyz(iter_num, lambda i: f"v{i}-no-shifted.xyz")
+                self.shift_train_xyz(iter_num)  # train.xyz
         else:
             # 不平移
             if iter_num == 0:
-                os.system(f"cat {self.init_train_xyz} > train.xyz")
+                self.merge_train_xyz(0, lambda i: "train.xyz")
                 os.system(f"cat {self.init_nep_txt} > nep.txt")
                 os.system(f"cat {self.nep_restart} > nep.restart")
                 with open("DONE", "w") as f:
@@ -161,8 +204,7 @@ class Auto_nep():
                 os.chdir("..")
                 return None
             else:
-                os.system(f"cat ../../iter_{iter_num - 1}/2-nep/train.xyz"
-                          f" ../1-scf/to_add.xyz > train.xyz")  # train.xyz
+                self.merge_train_xyz(iter_num, lambda i: "train.xyz")  # train.xyz
 
         # 平移只影响 train.xyz 产生
         os.system(f"cat ../../iter_{iter_num - 1}/2-nep/nep.txt > nep.txt")  # nep.txt
@@ -170,28 +212,84 @@ class Auto_nep():
         os.system(f"cat {self.nep_in} > nep.in")  # nep.in
         os.system(f"cat {self.nep_pbs} > nep.pbs")  # nep.pbs
         self.print("[Step2] nep-train")
-        os.system("qsub nep.pbs")  # 提交任务
+        job_id = self.scheduler.submit("nep.pbs")  # 提交任务
 
         # 任务完成检测 pbs 脚本完成后会生成 DONE 文件
-        time1 = time.perf_counter()
-        flag = True
-        times = 0
-        while flag:
-            for root, _, files in os.walk("./"):
-                if "DONE" in files:
-                    flag = False
-                else:
-                    if times % 60 == 0:
-                        spend_time = time.perf_counter() - time1
-                        h = spend_time // 3600
-                        m = (spend_time // 60) % 60
-                        s = spend_time % 60
-                        self.print(f"[nep-v{iter_num}] Train spend time: {h:.0f}h {m:.0f}m {s:.0f}s")
-                        time.sleep(10)
-                        times += 1
-                    times += 1
+        def progress(watcher):
+            spend_time = watcher.elapsed()
+            h = spend_time // 3600
+            m = (spend_time // 60) % 60
+            s = spend_time % 60
+            self.print(f"[nep-v{iter_num}] Train spend time: {h:.0f}h {m:.0f}m {s:.0f}s")
+
+        watcher = TaskWatcher(["."], done_file="DONE", running_file=None,
+                              scheduler=self.scheduler, job_ids={".": job_id})
+        for _ in watcher.completions(progress):
+            pass
+        self.print(watcher.report())
+        if watcher.tasks(watcher.FAILED):
+            self.print(f"[nep-v{iter_num}] 训练作业 {job_id} 已结束但未生成 DONE, 请检查 2-nep", "red")
+            exit()
         os.chdir("..")
 
+    def merge_train_xyz(self, iter_num, name):
+        """
+        上一次迭代的训练集 + 本次 SCF 新增结构 (../1-scf/to_add.xyz), 第 0 次迭代为 init_train_xyz
+        使用 dataset_store 时只把新增结构追加到存储, 再流式导出, 之前迭代导出的文件删除
+        :param iter_num: 迭代次数
+        :param name: name(i) 第 i 次迭代 2-nep 中的文件名
+        :return: None
+        """
+        prev = f"../../iter_{iter_num - 1}/2-nep/{name(iter_num - 1)}"
+        if self.dataset_store is None:
+            if iter_num == 0:
+                os.system(f"cat {self.init_train_xyz} > {name(0)}")
+            else:
+                os.system(f"cat {prev} ../1-scf/to_add.xyz > {name(iter_num)}")
+            return
+
+        store = self.dataset_store
+        # 续算: 本次迭代的结构可能已经加入 (部分加入), 先删除再加入
+        store.truncate(iter_num)
+        if iter_num > 0 and len(store) == 0 and os.path.exists(prev):
+            # 中途开启 dataset_store: 以上一次迭代的训练集为起点
+            store.append_xyz(prev, iter_num - 1)
+        source = self.init_train_xyz if iter_num == 0 else "../1-scf/to_add.xyz"
+        added = store.append_xyz(source, iter_num) if os.path.exists(source) else 0
+        count = store.export_xyz(name(iter_num))
+        self.print(f"[dataset] 加入 {added} 结构, 共 {count} 结构 ({store.root})")
+        if iter_num > 0:
+            for path in {prev, f"../../iter_{iter_num - 1}/2-nep/train.xyz"}:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def shift_train_xyz(self, iter_num):
+        """
+        能量平移 v{iter_num}-no-shifted.xyz -> train.xyz
+        incremental_shift 时加载上一次迭代的统计量 shift_stats.npz, 只读取 ../1-scf/to_add.xyz 累加
+        :param iter_num: 迭代次数
+        :return: None
+        """
+        xyz = f"v{iter_num}-no-shifted.xyz"
+        prev = f"../../iter_{iter_num - 1}/2-nep/shift_stats.npz"
+        stats = None
+        if self.incremental_shift and iter_num > 0 and os.path.exists(prev):
+            stats = ShiftStats.load(prev)
+        if stats is not None and stats.r is None:
+            # 旧版本的统计量没有 R, 重新统计
+            stats = None
+        if stats is not None:
+            added = stats.update("../1-scf/to_add.xyz") if os.path.exists("../1-scf/to_add.xyz") else 0
+            if stats.n_frames == count_frames(xyz):
+                self.print(f"[增量模式] 能量平移统计量加入 {added} 结构, 共 {stats.n_frames} 结构")
+            else:
+                # 训练集被修改过, 与统计量不一致
+                self.print(f"[增量模式] 统计量 {stats.n_frames} 结构与 {xyz} 不一致, 重新统计", "yellow")
+                stats = None
+        stats = shift_energy(xyz, "train.xyz", stats)
+        if self.incremental_shift:
+            stats.save("shift_stats.npz")
+
     def select_active_set(self, iter_num):
         self.print(f"[nep-v{iter_num}] 3-select active set")
         os.makedirs("3-select_active_set", exist_ok=True)
@@ -202,22 +300,43 @@ class Auto_nep():
             os.chdir("..")
             return None
 
-        shutil.copy("../2-nep/train.xyz", "./")
         shutil.copy("../2-nep/nep.txt", "./")
-        select_active("./train.xyz", "./nep.txt", os.getcwd())
-        os.remove("./train.xyz")
+        prev_active = f"../../iter_{iter_num - 1}/3-select_active_set/select_active.xyz"
+        prev_nep = f"../../iter_{iter_num - 1}/2-nep/nep.txt"
+        incremental = False
+        if self.incremental_active_set and iter_num > 0 \
+                and os.path.exists(prev_active) and os.path.exists("../1-scf/to_add.xyz"):
+            change = nep_change(prev_nep, "./nep.txt")
+            if change < self.incremental_tol:
+                self.print(f"[增量模式] nep.txt 参数变化 {change:.4f} < {self.incremental_tol}")
+                incremental = True
+            else:
+                self.print(f"[增量模式] nep.txt 参数变化 {change:.4f} >= {self.incremental_tol} 重新计算主动学习集")
+
+        store_dir = os.getcwd() + "/B_store" if self.b_projection_store else None
+        if incremental:
+            select_active_incremental(prev_active, "../1-scf/to_add.xyz", "./nep.txt", os.getcwd(), self.b_cache,
+                                      self.n_jobs, store_dir, self.b_projection_dtype, self.maxvol_engine)
+        elif self.dataset_store is not None:
+            select_active(self.dataset_store.read(), "./nep.txt", os.getcwd(), self.b_cache,
+                          self.n_jobs, store_dir, self.b_projection_dtype, self.maxvol_engine)
+        else:
+            shutil.copy("../2-nep/train.xyz", "./")
+            select_active("./train.xyz", "./nep.txt", os.getcwd(), self.b_cache,
+                          self.n_jobs, store_dir, self.b_projection_dtype, self.maxvol_engine)
+            os.remove("./train.xyz")
         os.remove("./nep.txt")
 
         with open("./DONE", "w") as f:
             f.close()
         os.chdir("..")
 
-    def run_gpumd(self, iter_num):
+    def run_gpumd(self, iter_num, on_complete=None):
         self.print(f"[nep-v{iter_num}] 4-GPUMD")
         os.makedirs("4-gpumd", exist_ok=True)
         os.chdir("4-gpumd")
         shutil.copy("../3-select_active_set/active_set.asi", "./")
-        task_num = 0
+        tasks, job_ids = [], {}
         for stru in os.listdir(self.model_dir):
             os.makedirs(f"{stru}", exist_ok=True)
             os.chdir(f"{stru}")
@@ -225,22 +344,104 @@ class Auto_nep():
             if self.restart and os.path.exists("./DONE"):
                 self.print(f"[续算模式] 任务{stru}已完成")
                 os.chdir("..")
-                task_num += 1
+                tasks.append(f"./{stru}")
+                continue
+            # 续算时作业仍在排队或运行, 不重复提交
+            job_id = read_job_id(".")
+            if self.restart and job_id is not None and self.scheduler.active([job_id]):
+                self.print(f"[续算模式] 任务{stru}作业 {job_id} 运行中")
+                os.chdir("..")
+                tasks.append(f"./{stru}")
+                job_ids[f"./{stru}"] = job_id
                 continue
             os.system(f"cat {self.model_dir}/{stru} > ./model.xyz")  # model.xyz
             os.system(f"cat {self.run_in} > ./run.in")  # run.in
             os.system(f"cat ../../2-nep/nep.txt > ./nep.txt")  # nep.txt
             os.system(f"cat {self.gpumd_pbs} > ./gpumd.pbs")  # gpumd.pbs
-            os.system("qsub gpumd.pbs")  # 提交
+            job_id = self.scheduler.submit("gpumd.pbs")  # 提交
             os.chdir("..")
-            task_num += 1
-        self.check_gpumd(task_num, iter_num)
+            tasks.append(f"./{stru}")
+            job_ids[f"./{stru}"] = job_id
+        self.check_gpumd(tasks, iter_num, job_ids, on_complete)
         # 每个结构的任务个数检测 extrapolation_dump.xyz
         self.check_struc_num()
         os.system("cat */extrapolation_dump.xyz > ./large_gamma.xyz")
         os.chdir("..")
 
 
+    def run_stream(self, iter_num):
+        """
+        流式模式: 代替 4-GPUMD 之后的阶段屏障
+        每个 GPUMD 任务完成后立即筛选其 extrapolation_dump.xyz (StreamSelector, 主动学习集随选中结构增长),
+        选中的结构立即提交到 iter_{iter_num + 1}/1-scf, 下一次迭代的 run_scf 只需等待和提取
+        max_structures_per_iteration 为整个迭代的总预算, 先完成的任务先占用
+        :param iter_num: 迭代次数
+        :return: 0 没有探索到新结构, 1 继续迭代
+        """
+        iter_dir = os.getcwd()
+        select_dir = iter_dir + "/5-select_structures"
+        scf_dir = self.home_path + f"/gpumd-dataset/iter_{iter_num + 1}/1-scf"
+        if self.restart and os.path.exists(select_dir + "/DONE"):
+            self.print("[续算模式] 流式选择已完成")
+            return int(os.path.getsize(iter_dir + "/4-gpumd/large_gamma.xyz") > 0)
+        os.makedirs(select_dir, exist_ok=True)
+        os.makedirs(scf_dir, exist_ok=True)
+
+        self.print(f"[nep-v{iter_num}] 4-GPUMD + 5-select structures (streaming)")
+        # 复用第 3 步的主动学习集, 没有时从训练集重新计算
+        asi = iter_dir + "/3-select_active_set/active_set.asi"
+        if os.path.exists(asi):
+            train = None
+        else:
+            asi = None
+            train = self.dataset_store.read() if self.dataset_store is not None else iter_dir + "/2-nep/train.xyz"
+        selector = StreamSelector(train, iter_dir + "/2-nep/nep.txt", self.b_cache,
+                                  self.n_jobs, self.b_projection_dtype, self.maxvol_engine, asi=asi)
+        abacus = Abacus(self.config, scheduler=self.scheduler)
+        to_add_path = select_dir + "/to_add.xyz"
+        streamed_path = select_dir + "/streamed.txt"
+
+        # 续算: 已选中的结构重新加入主动学习集, 已处理的任务跳过
+        to_add, streamed = [], set()
+        if self.restart and os.path.exists(to_add_path) and os.path.getsize(to_add_path) > 0:
+            to_add = read(to_add_path, index=":")
+            selector.add(to_add)
+            self.print(f"[续算模式] 已选中 {len(to_add)} 结构")
+        else:
+            open(to_add_path, "w").close()
+        if self.restart and os.path.exists(streamed_path):
+            with open(streamed_path) as f:
+                streamed = set(f.read().split())
+
+        def on_complete(task):
+            dump = task + "/extrapolation_dump.xyz"
+            if task in streamed or len(to_add) >= self.max_structures_per_iteration:
+                return
+            frames = []
+            if os.path.exists(dump) and os.path.getsize(dump) > 0:
+                self.limit_dump(dump)
+                frames = read(dump, index=":", format="extxyz")
+            selected = selector.add(frames, self.max_structures_per_iteration - len(to_add))
+            if selected:
+                cwd = os.getcwd()
+                os.chdir(scf_dir)
+                try:
+                    abacus.sub_structures(selected, len(to_add) + 1)
+                finally:
+                    os.chdir(cwd)
+                to_add.extend(selected)
+                write(to_add_path, selected, format="extxyz", append=True)
+            with open(streamed_path, "a") as f:
+                f.write(task + "\n")
+            self.print(f"[stream] {task}: {len(frames)} 结构, 选中 {len(selected)}, "
+                       f"已提交 SCF {len(to_add)}/{self.max_structures_per_iteration}")
+
+        self.run_gpumd(iter_num, on_complete)
+        self.print(f"[Step1] 流式选择 {len(to_add)} 个结构 (筛选 {selector.n_screened} 结构)")
+        with open(select_dir + "/DONE", "w") as f:
+            f.close()
+        return int(os.path.getsize(iter_dir + "/4-gpumd/large_gamma.xyz") > 0)
+
     def select_structures(self, iter_num):
         self.print(f"[nep-v{iter_num}] 5-select structures")
         os.makedirs("5-select_structures", exist_ok=True)
@@ -252,53 +453,117 @@ class Auto_nep():
             os.chdir("..")
             return ret
 
-        shutil.copy("../2-nep/train.xyz", ".")
+        train = None
+        if self.dataset_store is not None:
+            train = self.dataset_store.read()
+        else:
+            shutil.copy("../2-nep/train.xyz", ".")
         shutil.copy("../2-nep/nep.txt", ".")
         shutil.copy("../4-gpumd/large_gamma.xyz", ".")
-        select_extend()
+        store_dir = os.getcwd() + "/B_store" if self.b_projection_store else None
+        select_extend(self.b_cache, self.n_jobs, store_dir, self.b_projection_dtype, self.maxvol_engine, train)
         with open("./DONE", "w") as f:
             f.close()
         ret = read("./to_add.xyz", index=":")
         os.chdir("..")
         return ret
 
-    def check_gpumd(self, task_num, iter_num):
+    def check_gpumd(self, tasks, iter_num, job_ids=None, on_complete=None):
+        """
+        等待 GPUMD 任务完成: 有 out.log 计算中, 有 DONE 计算完成, 作业结束但无 DONE 为失败
+        :param tasks: 任务目录列表
+        :param iter_num: 迭代次数
+        :param job_ids: {task: job_id}
+        :param on_complete: 每个任务完成时调用 on_complete(task)
+        """
         sysprint(f"[nep-v{iter_num}] Check GPUMD")
-
-        start_time = time.perf_counter()
-        total_time = 0  # 计算总耗时 min
-
-        while True:
-            accomplish = []
-            calculating = []
-            awating = []
-            for root, _, files in os.walk("./"):
-                if "DONE" in files:
-                    accomplish.append(root)
-                elif "out.log" in files and "DONE" not in files:
-                    calculating.append(root)
-                elif "gpumd.pbs" in files and "out.log" not in files and "DONE" not in files:
-                    awating.append(root)
-
-            if total_time % 6 == 0:
-                # Current Task 打印模块
-                sysprint("\n-------------------------------- GPUMD -------------------------------\n"
-                         f'Total task num: {task_num}\t'
-                         f'Total time(s): {round(time.perf_counter() - start_time, 2)}\t'
-                         f"  Progress:{len(accomplish)}/{task_num}\n"
-                         f"-----------------------------------------------------------------------")
-                for task in calculating:
-                    step = self.get_step(task)
-                    print(f"Current Task: [{task}] Step: [{step}]\n"
-                          f"-----------------------------------------------------------------------")
-
-            if len(accomplish) == task_num:
-                sysprint("计算完成提取 larger_gamma.xyz", 'red')
-                sysprint(f"Mean time(s):{(time.perf_counter() - start_time) / len(accomplish): .2f} s")
-                break
-
-            total_time += 1
-            time.sleep(10)
+        task_num = len(tasks)
+
+        def progress(watcher):
+            # Current Task 打印模块
+            sysprint("\n-------------------------------- GPUMD -------------------------------\n"
+                     f'Total task num: {task_num}\t'
+                     f'Total time(s): {round(watcher.elapsed(), 2)}\t'
+                     f"  Progress:{len(watcher.tasks(watcher.DONE))}/{task_num}\n"
+                     f"-----------------------------------------------------------------------")
+            for task in watcher.tasks(watcher.RUNNING):
+                step = self.get_step(task)
+                print(f"Current Task: [{task}] Step: [{step}]\n"
+                      f"-----------------------------------------------------------------------")
+
+        early_stop = self.early_stop_monitor() if self.early_stop_factor else None
+        watcher = TaskWatcher(tasks, done_file="DONE", running_file="out.log",
+                              scheduler=self.scheduler, job_ids=job_ids)
+        for task in watcher.completions(progress, on_wake=early_stop):
+            if on_complete is not None:
+                on_complete(task)
+        for task in watcher.tasks(watcher.FAILED):
+            sysprint(f"[Warning] GPUMD 任务 {task} 作业 {watcher.job_ids[task]} 已结束但未生成 DONE", "red")
+        if early_stop is not None:
+            sysprint(f"[early stop] 提前结束 {len(early_stop.saved)} 个任务, "
+                     f"节省约 {sum(early_stop.saved):.1f} GPU-hours")
+        sysprint("计算完成提取 larger_gamma.xyz", 'red')
+        sysprint(f"Mean time(s):{watcher.elapsed() / max(task_num, 1): .2f} s")
+        sysprint(watcher.report())
+
+    def early_stop_monitor(self):
+        """
+        每轮检测时增量统计运行中任务的 extrapolation_dump.xyz 结构数,
+        达到 early_stop_factor * max_structures_per_model 时通过调度器取消作业,
+        作业结束后截断到最后一个完整结构并写入 DONE
+        :return: on_wake(watcher) 回调, saved 属性为每个任务节省的 GPU-hours 估计
+        """
+        limit = max(1, int(self.early_stop_factor * self.max_structures_per_model))
+        total_steps = self.total_steps()
+        counters, started, stopping = {}, {}, {}
+
+        def on_wake(watcher):
+            now = time.perf_counter()
+            for task in watcher.tasks(watcher.RUNNING):
+                started.setdefault(task, now)
+                job_id = watcher.job_ids.get(task)
+                if job_id is None or task in stopping:
+                    continue
+                counter = counters.setdefault(task, FrameCounter(task + "/extrapolation_dump.xyz"))
+                if counter.update() < limit:
+                    continue
+                # 按当前速度估计剩余步数所需时间
+                step = self.get_step_num(task)
+                hours = (now - started[task]) / 3600
+                remain = hours * (total_steps - step) / step if 0 < step < total_steps else 0.0
+                on_wake.saved.append(remain * self.gpus_per_job)
+                sysprint(f"[early stop] {task}: {counter.count} 结构 >= {limit}, 取消作业 {job_id} (step {step}/{total_steps})")
+                self.scheduler.cancel(job_id)
+                # 不再按失败检测, 作业结束后由这里写 DONE
+                watcher.job_ids.pop(task)
+                stopping[task] = job_id
+
+            for task, job_id in list(stopping.items()):
+                if self.scheduler.active([job_id]):
+                    continue
+                counters[task].truncate()
+                with open(task + "/DONE", "w") as f:
+                    f.write("EARLY STOP\n")
+                stopping.pop(task)
+
+        on_wake.saved = []
+        return on_wake
+
+    def total_steps(self):
+        """
+        run.in 中所有 run 的总步数
+        """
+        steps = 0
+        with open(self.run_in) as f:
+            for line in f:
+                items = line.split()
+                if len(items) >= 2 and items[0] == "run":
+                    steps += int(items[1])
+        return steps
+
+    def get_step_num(self, task):
+        step = self.get_step(task)
+        return int(str(step).split()[-1])
 
     def get_step(self, task):
         try:
@@ -316,10 +581,16 @@ class Auto_nep():
         """
         for roots, _, files in os.walk("."):
             if "extrapolation_dump.xyz" in files:
-                extrapolation = read(roots + "/extrapolation_dump.xyz", index=":", format="extxyz")
-                if len(extrapolation) > self.max_structures_per_model:
-                    sysprint(f"[Warning] 探索到 {len(extrapolation)} 结构, 随机选取 {self.max_structures_per_model} 结构")
-                    random.shuffle(extrapolation)
-                    extrapolation = extrapolation[: self.max_structures_per_model]
-                    write(roots + "/extrapolation_dump.xyz", extrapolation, format="extxyz""")
+                self.limit_dump(roots + "/extrapolation_dump.xyz")
 
+    def limit_dump(self, dump):
+        """
+        extrapolation_dump.xyz 结构数超过 max_structures_per_model 时随机选取
+        按表头流式计数, 蓄水池抽样后逐字节复制选中的结构
+        :param dump: extrapolation_dump.xyz 路径
+        :return: 保留的结构数
+        """
+        count, kept = sample_frames(dump, self.max_structures_per_model)
+        if count > kept:
+            sysprint(f"[Warning] 探索到 {count} 结构, 随机选取 {kept} 结构")
+        return kept
@@ -16,6 +16,7 @@ from auto_nep.abacus import Abacus  # 类
 from auto_nep.utils import Perturb, Select  # 类
 from auto_nep.utils.config import load_config
 from auto_nep.utils import find_struc, convert_format
+from auto_nep.select import select_gamma
 from auto_nep.sysprint import sysprint
 
 
@@ -28,6 +29,12 @@ def build_train(subparsers):
                               type=str,
                               default="train.yaml",
                               help="Train config file yaml path, default is train.yaml.")
+    # 并行进程数, 覆盖 train.yaml 中的 active.n_jobs
+    train_parser.add_argument("-j", "--n_jobs",
+                              type=int,
+                              default=None,
+                              help="Number of worker processes for B projections and gamma, "
+                                   "overrides active.n_jobs in train.yaml.")
 
 
 def build_abacus2nep(subparsers):
@@ -37,6 +44,8 @@ def build_abacus2nep(subparsers):
     # 添加子命令 path
     abacus2nep.add_argument("-d", "--dataset",
                             help="Abacus dataset path.")
+    abacus2nep.add_argument("-j", "--n_jobs", type=int, default=1,
+                            help="Number of processes for parsing running_scf.log.")
 
 
 def build_perturb(subparsers):
@@ -120,6 +129,48 @@ def build_find_from_dataset(subparsers):
                        help="No shifted energy dataset path.")
 
 
+def build_gamma(subparsers):
+    """
+    流式 gamma 筛选
+    :param subparsers:
+    :return:
+    """
+    # 添加 gamma 命令
+    gamma = subparsers.add_parser("gamma",
+                                  help="Screen a (large) trajectory by extrapolation grade gamma.")
+
+    gamma.add_argument("-t", "--trajectory",
+                       help="Trajectory path (dump/movie xyz).")
+    gamma.add_argument("-nep", "--nep",
+                       type=str,
+                       default="nep.txt",
+                       help="Nep potential file, default is nep.txt.")
+    gamma.add_argument("-asi", "--asi",
+                       type=str,
+                       default="active_set.asi",
+                       help="Active set inverse file, default is active_set.asi.")
+    gamma.add_argument("-o", "--output",
+                       type=str,
+                       default="large_gamma.xyz",
+                       help="Output file path, default is large_gamma.xyz.")
+    gamma.add_argument("-low", "--gamma_low",
+                       type=float,
+                       default=1.0,
+                       help="Keep frames with max gamma > gamma_low, default is 1.0.")
+    gamma.add_argument("-high", "--gamma_high",
+                       type=float,
+                       default=None,
+                       help="Drop frames with max gamma > gamma_high, default is no limit.")
+    gamma.add_argument("-c", "--chunk_size",
+                       type=int,
+                       default=1000,
+                       help="Frames per chunk, default is 1000.")
+    gamma.add_argument("-j", "--n_jobs",
+                       type=int,
+                       default=1,
+                       help="Number of worker processes, default is 1.")
+
+
 def build_convert_format(subparsers):
     """
     格式转换脚本 xyz -> abacus
@@ -132,6 +183,10 @@ def build_convert_format(subparsers):
 
     shift.add_argument("-xyz",
                        help="xyz file root.")
+    shift.add_argument("-j", "--n_jobs",
+                       type=int,
+                       default=1,
+                       help="Number of processes for writing STRU files, default is 1.")
 
 
 
@@ -150,6 +205,7 @@ def main():
     build_shift(subparsers)
     build_find_from_dataset(subparsers)
     build_convert_format(subparsers)
+    build_gamma(subparsers)
 
     home_folder = os.path.expanduser("~")
     env_file_path = os.path.join(home_folder, ".auto_nep_env")
@@ -164,13 +220,15 @@ def main():
     if args.command == "train":
         config_path = args.yaml
         config = load_config(config_path)
+        if args.n_jobs is not None:
+            config["active"]["n_jobs"] = args.n_jobs
         a = Auto_nep(config)
         a.run()
     elif args.command == "abacus2nep":
         abacus = Abacus()
         abacus.dataset_roots = [f"{args.dataset}"]
         sysprint(f"从 {args.dataset} 提取 train.xyz")
-        abacus.abacus2nep()
+        abacus.abacus2nep(n_jobs=args.n_jobs)
     elif args.command == "perturb":
         if args.path is None:
             sysprint("请输入初始模型的路径 -path", "red")
@@ -200,7 +258,13 @@ def main():
         if args.xyz is None:
             sysprint("请输入 xyz 的路径 -xyz", "red")
             exit()
-        convert_format(args.xyz)
+        convert_format(args.xyz, args.n_jobs)
+    elif args.command == "gamma":
+        if args.trajectory is None:
+            sysprint("请输入 trajectory 的路径 -t", "red")
+            exit()
+        select_gamma(args.trajectory, args.nep, args.asi, args.output, args.gamma_low,
+                     args.gamma_high, args.chunk_size, args.n_jobs)
     else:
         parser.print_help()
 
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：__init__.py
+@Author ：RongYi
+@Date ：2025/7/3 09:30
+@E-mail ：2071914258@qq.com
+"""
+from .store import DatasetStore
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：store.py
+@Author ：RongYi
+@Date ：2025/7/3 09:30
+@E-mail ：2071914258@qq.com
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.data import chemical_symbols
+from ase.io import iread
+from ase.stress import voigt_6_to_full_3x3_stress
+
+SYMBOLS = np.array(chemical_symbols)
+
+
+def _lower_info(atoms):
+    return {k.lower(): v for k, v in atoms.info.items()}
+
+
+def _frame_values(atoms):
+    """
+    从 ase Atoms 中取出需要保存的量, 兼容 info (Energy / Virial) 和 calc (energy / forces / stress) 两种来源
+    :return: energy, virial (9,), forces (n, 3), config_type, weight, 缺失的量为 nan
+    """
+    info = _lower_info(atoms)
+    results = atoms.calc.results if atoms.calc is not None else {}
+    energy = info.get("energy", results.get("energy", np.nan))
+
+    virial = np.full(9, np.nan)
+    if "virial" in info:
+        virial = np.asarray(info["virial"], dtype=np.float64).reshape(9)
+    else:
+        stress = info.get("stress", results.get("stress"))
+        if stress is not None:
+            stress = np.asarray(stress, dtype=np.float64)
+            stress = voigt_6_to_full_3x3_stress(stress) if stress.size == 6 else stress.reshape(3, 3)
+            virial = (-stress * atoms.get_volume()).reshape(9)
+
+    forces = results.get("forces", atoms.arrays.get("forces", atoms.arrays.get("force")))
+    forces = np.full((len(atoms), 3), np.nan) if forces is None else np.asarray(forces, dtype=np.float64)
+    return float(energy), virial, forces, str(info.get("config_type", "")), float(info.get("weight", 1.0))
+
+
+class DatasetStore:
+    """
+    追加写入的列式训练集
+    root/store.json 记录块列表, 每个块一个目录, 每列一个 .npy:
+        结构列 natoms, energy, virial (9), cell (9), pbc (3), weight, config_type
+        原子列 numbers, positions (3), forces (3)
+    新结构只追加新块, 已有块不再改写, 每个块记录加入时的迭代 (iteration) 和来源文件
+    读取时按需内存映射, train.xyz 只在需要时流式导出
+    块不可变, 每个块的 extxyz 文本 (frames.xyz) 在第一次导出时生成, 之后整体导出只需拼接
+    """
+    VERSION = 1
+    XYZ = "frames.xyz"
+    FRAME_COLUMNS = ("natoms", "energy", "virial", "cell", "pbc", "weight", "config_type")
+    ATOM_COLUMNS = ("numbers", "positions", "forces")
+
+    def __init__(self, root, chunk_frames=10000):
+        """
+        :param root: 存储目录
+        :param chunk_frames: 每个块最多的结构数
+        """
+        self.root = os.path.abspath(root)
+        self.chunk_frames = chunk_frames
+        self.meta_path = os.path.join(self.root, "store.json")
+        os.makedirs(self.root, exist_ok=True)
+        self.chunks = self._load()
+        self._index = None
+
+    def _load(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return []
+        if meta.get("version") != self.VERSION:
+            raise ValueError(f"{self.meta_path}: unsupported store version {meta.get('version')}")
+        return meta["chunks"]
+
+    def _save(self):
+        tmp = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": self.VERSION, "chunks": self.chunks}, f, indent=1)
+        os.replace(tmp, self.meta_path)
+        self._index = None
+
+    def __len__(self):
+        return sum(chunk["frames"] for chunk in self.chunks)
+
+    def iterations(self):
+        return sorted({chunk["iteration"] for chunk in self.chunks})
+
+    # ---------------------------------------------------------------- 写入
+    def append(self, frames, iteration=0, source=None):
+        """
+        追加结构, 每 chunk_frames 个结构写一个块
+        :param frames: ase Atoms 的可迭代对象 (可以是 iread 生成器)
+        :param iteration: 主动学习迭代次数
+        :param source: 来源文件
+        :return: 追加的结构数
+        """
+        batch, count = [], 0
+        for atoms in frames:
+            batch.append(atoms)
+            if len(batch) == self.chunk_frames:
+                self._write_chunk(batch, iteration, source)
+                count += len(batch)
+                batch = []
+        if batch:
+            self._write_chunk(batch, iteration, source)
+            count += len(batch)
+        return count
+
+    def append_xyz(self, path, iteration=0):
+        """
+        流式读取 extxyz 追加到存储
+        """
+        return self.append(iread(path, index=":"), iteration, os.path.abspath(path))
+
+    def truncate(self, iteration):
+        """
+        删除 iteration 及之后加入的块, 续算时重新加入本次迭代的结构
+        :return: 删除的结构数
+        """
+        removed = [chunk for chunk in self.chunks if chunk["iteration"] >= iteration]
+        if not removed:
+            return 0
+        self.chunks = [chunk for chunk in self.chunks if chunk["iteration"] < iteration]
+        self._save()
+        for chunk in removed:
+            shutil.rmtree(os.path.join(self.root, chunk["name"]), ignore_errors=True)
+        return sum(chunk["frames"] for chunk in removed)
+
+    def _write_chunk(self, frames, iteration, source):
+        values = [_frame_values(atoms) for atoms in frames]
+        columns = {
+            "natoms": np.array([len(atoms) for atoms in frames], dtype=np.int32),
+            "energy": np.array([v[0] for v in values], dtype=np.float64),
+            "virial": np.array([v[1] for v in values], dtype=np.float64).reshape(-1, 9),
+            "cell": np.array([atoms.cell.array.reshape(9) for atoms in frames], dtype=np.float64),
+            "pbc": np.array([atoms.pbc for atoms in frames], dtype=bool),
+            "weight": np.array([v[4] for v in values], dtype=np.float64),
+            "config_type": np.array([v[3] for v in values], dtype=str),
+            "numbers": np.concatenate([atoms.numbers for atoms in frames]).astype(np.int16),
+            "positions": np.concatenate([atoms.positions for atoms in frames]).astype(np.float64),
+            "forces": np.concatenate([v[2] for v in values]),
+        }
+        number = max((int(chunk["name"]) for chunk in self.chunks), default=-1) + 1
+        name = f"{number:06d}"
+        path = os.path.join(self.root, name)
+        tmp = os.path.join(self.root, f".{name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for key, value in columns.items():
+            np.save(os.path.join(tmp, f"{key}.npy"), value)
+        # 上次中断留下的同名目录不在 store.json 中, 直接替换
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        self.chunks.append({"name": name, "frames": len(frames), "atoms": int(columns["natoms"].sum()),
+                            "iteration": iteration, "source": source})
+        self._save()
+
+    # ---------------------------------------------------------------- 读取
+    def load_chunk(self, chunk, columns=None):
+        """
+        内存映射读取一个块
+        :param chunk: 块序号 (self.chunks 中的位置)
+        :param columns: 列名, None 为全部
+        :return: {列名: 数组}, 另有 offsets (frames + 1,) 每个结构的原子起点
+        """
+        path = os.path.join(self.root, self.chunks[chunk]["name"])
+        names = self.FRAME_COLUMNS + self.ATOM_COLUMNS if columns is None else columns
+        data = {key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r") for key in names}
+        natoms = data["natoms"] if "natoms" in data else np.load(os.path.join(path, "natoms.npy"))
+        data["offsets"] = np.concatenate([[0], np.cumsum(natoms, dtype=np.int64)])
+        return data
+
+    def iter_chunks(self, columns=None):
+        """
+        按块顺序返回 load_chunk 的结果, 用于流式处理整个数据集
+        """
+        for chunk in range(len(self.chunks)):
+            yield self.load_chunk(chunk, columns)
+
+    def index(self):
+        """
+        结构索引 (全局结构序号 -> 位置)
+        :return: {chunk, local, iteration} 每个结构所在的块, 块内序号, 加入时的迭代
+        """
+        if self._index is None:
+            frames = np.array([chunk["frames"] for chunk in self.chunks], dtype=np.int64)
+            chunk = np.repeat(np.arange(len(self.chunks)), frames)
+            starts = np.concatenate([[0], np.cumsum(frames)])[:-1]
+            self._index = {
+                "chunk": chunk,
+                "local": np.arange(frames.sum()) - np.repeat(starts, frames),
+                "iteration": np.repeat([c["iteration"] for c in self.chunks], frames),
+            }
+        return self._index
+
+    def _select(self, index):
+        """
+        全局结构序号 -> 按块分组的块内序号, 保持给定顺序
+        """
+        n = len(self)
+        if index is None:
+            frames = np.arange(n)
+        elif isinstance(index, slice):
+            frames = np.arange(n)[index]
+        else:
+            frames = np.atleast_1d(np.asarray(index, dtype=np.int64))
+            frames = np.where(frames < 0, frames + n, frames)
+            if frames.size and (frames.min() < 0 or frames.max() >= n):
+                raise IndexError(f"frame index out of range for store with {n} frames")
+        idx = self.index()
+        chunks, local = idx["chunk"][frames], idx["local"][frames]
+        # 连续属于同一块的结构合并为一组, 每组只映射一次该块
+        breaks = np.flatnonzero(np.diff(chunks)) + 1
+        for group in np.split(np.arange(len(frames)), breaks):
+            if group.size:
+                yield int(chunks[group[0]]), local[group]
+
+    def read(self, index=None):
+        """
+        读取结构为 ase Atoms (带 SinglePointCalculator: energy, forces, stress)
+        :param index: None 全部, int, slice 或全局结构序号列表
+        :return: Atoms 列表 (index 为 int 时返回单个 Atoms)
+        """
+        single = isinstance(index, (int, np.integer))
+        out = []
+        for chunk, local in self._select(index):
+            data = self.load_chunk(chunk)
+            out.extend(self._to_atoms(data, i) for i in local)
+        return out[0] if single else out
+
+    def iread(self, batch_size=1000):
+        """
+        逐批读取全部结构, 内存只保留一批
+        """
+        for chunk in range(len(self.chunks)):
+            data = self.load_chunk(chunk)
+            n = self.chunks[chunk]["frames"]
+            for start in range(0, n, batch_size):
+                yield [self._to_atoms(data, i) for i in range(start, min(start + batch_size, n))]
+
+    @staticmethod
+    def _to_atoms(data, i):
+        start, end = data["offsets"][i], data["offsets"][i + 1]
+        atoms = Atoms(numbers=np.asarray(data["numbers"][start:end]),
+                      positions=np.array(data["positions"][start:end]),
+                      cell=np.array(data["cell"][i]).reshape(3, 3), pbc=np.array(data["pbc"][i]))
+        atoms.info["config_type"] = str(data["config_type"][i])
+        atoms.info["weight"] = float(data["weight"][i])
+        results = {}
+        energy = float(data["energy"][i])
+        if not np.isnan(energy):
+            results["energy"] = energy
+        forces = np.array(data["forces"][start:end])
+        if not np.isnan(forces).any():
+            results["forces"] = forces
+        virial = np.array(data["virial"][i])
+        if not np.isnan(virial).any() and atoms.cell.rank == 3:
+            results["stress"] = -virial.reshape(3, 3) / atoms.get_volume()
+        atoms.calc = SinglePointCalculator(atoms, **results)
+        return atoms
+
+    # ---------------------------------------------------------------- 导出
+    def export_xyz(self, filename, index=None, energy=None):
+        """
+        流式导出 nep extxyz (与 abacus2nep 相同的表头和 .10f 格式)
+        全部导出且不替换能量时直接拼接各块的 frames.xyz, 否则逐个结构格式化
+        先写临时文件再 os.replace
+        :param filename: 输出文件
+        :param index: None 全部, slice 或全局结构序号列表
+        :param energy: 代替存储能量的数组 (按 index 顺序, 例如平移后的能量), None 为存储的能量
+        :return: 导出的结构数
+        """
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        if index is None and energy is None:
+            with open(tmp, "wb") as f:
+                for chunk in range(len(self.chunks)):
+                    with open(self.chunk_xyz(chunk), "rb") as src:
+                        shutil.copyfileobj(src, f, 1 << 24)
+            os.replace(tmp, filename)
+            return len(self)
+
+        count = 0
+        with open(tmp, "w", encoding="utf-8", buffering=1 << 20) as f:
+            for chunk, local in self._select(index):
+                data = self.load_chunk(chunk)
+                for i in local:
+                    e = None if energy is None else energy[count]
+                    f.write(self._format_frame(data, i, e))
+                    count += 1
+        os.replace(tmp, filename)
+        return count
+
+    def chunk_xyz(self, chunk):
+        """
+        块的 extxyz 文本, 不存在时生成
+        """
+        path = os.path.join(self.root, self.chunks[chunk]["name"], self.XYZ)
+        if not os.path.exists(path):
+            data = self.load_chunk(chunk)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8", buffering=1 << 20) as f:
+                for i in range(self.chunks[chunk]["frames"]):
+                    f.write(self._format_frame(data, i))
+            os.replace(tmp, path)
+        return path
+
+    @staticmethod
+    def _format_frame(data, i, energy=None):
+        start, end = data["offsets"][i], data["offsets"][i + 1]
+        energy = float(data["energy"][i]) if energy is None else float(energy)
+        virial = np.asarray(data["virial"][i])
+        forces = np.asarray(data["forces"][start:end])
+        has_forces = not np.isnan(forces).any()
+
+        header = []
+        if not np.isnan(energy):
+            header.append(f"Energy={energy:.10f}")
+        header.append('Lattice="' + " ".join(f"{v:.10f}" for v in data["cell"][i].tolist()) + '"')
+        if not np.isnan(virial).any():
+            header.append('Virial="' + " ".join(f"{v:.10f}" for v in virial.tolist()) + '"')
+        header.append(f'Config_type="{data["config_type"][i]}"')
+        header.append("Properties=species:S:1:pos:R:3" + (":forces:R:3" if has_forces else ""))
+        header.append(f"Weight={float(data['weight'][i])}")
+        header.append('Pbc="' + " ".join("T" if p else "F" for p in data["pbc"][i].tolist()) + '"')
+
+        symbols = SYMBOLS[np.asarray(data["numbers"][start:end])].tolist()
+        positions = np.asarray(data["positions"][start:end]).tolist()
+        lines = [f"{end - start}\n" + " ".join(header) + "\n"]
+        if has_forces:
+            for s, (x, y, z), (fx, fy, fz) in zip(symbols, positions, forces.tolist()):
+                lines.append(f"{s}\t{x:.10f}\t{y:.10f}\t{z:.10f}\t{fx:.10f}\t{fy:.10f}\t{fz:.10f}\n")
+        else:
+            for s, (x, y, z) in zip(symbols, positions):
+                lines.append(f"{s}\t{x:.10f}\t{y:.10f}\t{z:.10f}\n")
+        return "".join(lines)
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：__init__.py
+@Author ：RongYi
+@Date ：2025/6/27 10:31
+@E-mail ：2071914258@qq.com
+"""
+from .scheduler import PBS, Slurm, Local, get_scheduler, read_job_id, write_job_id
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：scheduler.py
+@Author ：RongYi
+@Date ：2025/6/27 10:31
+@E-mail ：2071914258@qq.com
+"""
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+作业调度后端, 统一接口:
+    submit(script, cwd, array) -> job_id     提交作业 (array 个元素的作业数组), 作业号同时写入 cwd/.job_id
+    status(job_ids) -> {job_id: state} state 为 queued / running / finished / unknown
+                       只有调度器明确列出结束状态或报告作业号不存在时为 finished,
+                       查询失败 (超时, 服务不可用) 为 unknown, 调用方按状态未变处理
+    cancel(job_id)                    取消作业
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+UNKNOWN = "unknown"
+
+JOB_ID_FILE = ".job_id"
+
+
+def read_job_id(cwd):
+    """
+    读取任务目录中记录的作业号, 没有返回 None
+    """
+    try:
+        with open(os.path.join(cwd, JOB_ID_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_job_id(cwd, job_id):
+    with open(os.path.join(cwd, JOB_ID_FILE), "w") as f:
+        f.write(job_id + "\n")
+
+
+class Scheduler:
+    name = None
+
+    def submit(self, script, cwd=".", array=None):
+        """
+        :param script: 作业脚本
+        :param cwd: 提交目录
+        :param array: 作业数组元素个数, 元素序号 0 ~ array-1 由 PBS_ARRAY_INDEX / PBS_ARRAYID /
+                      SLURM_ARRAY_TASK_ID 传入脚本, None 或 1 为普通作业
+        :return: job_id
+        """
+        array = array if array is not None and array > 1 else None
+        job_id = self._submit(script, os.path.abspath(cwd), array)
+        write_job_id(cwd, job_id)
+        return job_id
+
+    def status(self, job_ids):
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        raise NotImplementedError
+
+    def active(self, job_ids):
+        """
+        仍在排队或运行的作业, 状态未知的作业也算在内
+        """
+        return {job_id for job_id, state in self.status(job_ids).items() if state != FINISHED}
+
+    def _submit(self, script, cwd, array=None):
+        raise NotImplementedError
+
+    def _query(self, job_ids):
+        """
+        一次查询
+        :return: ({job_id: state} 输出中列出的作业, 返回值, stderr)
+        """
+        raise NotImplementedError
+
+    def _query_all(self, job_ids, messages):
+        """
+        先一次查询全部作业, 没有列出的作业只在 stderr 明确报告该作业号不存在时记为 finished;
+        批量查询的错误信息可能不含作业号 (slurm), 这时逐个重新查询, 其余记为 unknown
+        :param messages: 作业号不存在的错误信息
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        states, code, err = self._query(job_ids)
+        missing = [job_id for job_id in job_ids if job_id not in states]
+        states.update(self._missing(missing, err, messages, single=len(job_ids) == 1))
+        missing = [job_id for job_id in missing if job_id not in states]
+        if len(job_ids) > 1:
+            for job_id in missing:
+                listed, _, err = self._query([job_id])
+                states.update(listed)
+                states.update(self._missing([job_id], err, messages, single=True))
+        return {job_id: states.get(job_id, UNKNOWN) for job_id in job_ids}
+
+    @staticmethod
+    def _missing(job_ids, err, messages, single):
+        """
+        stderr 中明确报告不存在的作业; 只查询了一个作业时错误信息可以不含作业号
+        """
+        states = {}
+        for line in err.splitlines():
+            if not any(message.lower() in line.lower() for message in messages):
+                continue
+            tokens = {token.strip(":,").split(".")[0] for token in line.split()}
+            for job_id in job_ids:
+                if single or job_id.split(".")[0] in tokens:
+                    states[job_id] = FINISHED
+        return states
+
+    @staticmethod
+    def _run(cmd, cwd=None):
+        ret = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return ret.returncode, ret.stdout, ret.stderr
+
+
+class PBS(Scheduler):
+    name = "pbs"
+    STATES = {"Q": QUEUED, "H": QUEUED, "W": QUEUED, "T": QUEUED, "S": QUEUED,
+              "R": RUNNING, "E": RUNNING, "B": RUNNING, "C": FINISHED, "F": FINISHED, "X": FINISHED}
+
+    def __init__(self, array_flag="-J"):
+        # PBS Pro 为 -J, Torque 为 -t
+        self.array_flag = array_flag
+
+    def _submit(self, script, cwd, array=None):
+        cmd = ["qsub", script] if array is None else ["qsub", self.array_flag, f"0-{array - 1}", script]
+        code, out, err = self._run(cmd, cwd)
+        if code != 0:
+            raise RuntimeError(f"qsub {script} failed in {cwd}: {err.strip()}")
+        return out.strip()
+
+    # 已结束并清出队列 (torque), 已结束只保留历史记录 (PBS Pro)
+    MESSAGES = ("Unknown Job Id", "Job has finished")
+
+    def status(self, job_ids):
+        return self._query_all(job_ids, self.MESSAGES)
+
+    def _query(self, job_ids):
+        # 未知作业 qstat 只在 stderr 报错, 不影响其他作业的输出
+        code, out, err = self._run(["qstat"] + job_ids)
+        states = {}
+        prefix = {job_id.split(".")[0]: job_id for job_id in job_ids}
+        for line in out.splitlines():
+            items = line.split()
+            if len(items) < 5:
+                continue
+            job_id = prefix.get(items[0].split(".")[0])
+            if job_id is not None:
+                states[job_id] = self.STATES.get(items[4], RUNNING)
+        return states, code, err
+
+    def cancel(self, job_id):
+        self._run(["qdel", job_id])
+
+
+class Slurm(Scheduler):
+    name = "slurm"
+    STATES = {"PD": QUEUED, "CF": QUEUED, "S": QUEUED, "R": RUNNING, "CG": RUNNING}
+
+    def _submit(self, script, cwd, array=None):
+        cmd = ["sbatch", "--parsable"] + ([] if array is None else [f"--array=0-{array - 1}"]) + [script]
+        code, out, err = self._run(cmd, cwd)
+        if code != 0:
+            raise RuntimeError(f"sbatch {script} failed in {cwd}: {err.strip()}")
+        return out.strip().split(";")[0]
+
+    # 作业已清出 slurmctld, 错误信息不含作业号
+    MESSAGES = ("Invalid job id",)
+
+    def status(self, job_ids):
+        return self._query_all(job_ids, self.MESSAGES)
+
+    def _query(self, job_ids):
+        code, out, err = self._run(["squeue", "-h", "-o", "%i %t", "-j", ",".join(job_ids)])
+        states = {}
+        if code != 0:
+            # 查询失败时输出不完整, 不能用来判断
+            return states, code, err
+        for line in out.splitlines():
+            items = line.split()
+            # 作业数组元素为 jobid_index, 任一元素未结束则整个数组未结束; 列出的其他状态 (CD, F, CA, TO ...) 为已结束
+            job_id = items[0].split("_")[0] if len(items) == 2 else None
+            if job_id in job_ids and states.get(job_id) != RUNNING:
+                state = self.STATES.get(items[1], FINISHED)
+                if state != FINISHED or job_id not in states:
+                    states[job_id] = state
+        return states, code, err
+
+    def cancel(self, job_id):
+        self._run(["scancel", job_id])
+
+
+class Local(Scheduler):
+    """
+    本机进程池: 作业脚本用 bash 在任务目录中运行, 最多 max_workers 个同时运行
+    设置 PBS_O_WORKDIR / SLURM_SUBMIT_DIR / PBS_NODEFILE, 现有 pbs 脚本无需修改
+    作业数组的每个元素占用一个进程, 序号由 PBS_ARRAY_INDEX / SLURM_ARRAY_TASK_ID 传入
+    作业号只在当前进程内有效, 重启后视为已结束
+    """
+    name = "local"
+
+    def __init__(self, max_workers=1, cores_per_job=None):
+        self.max_workers = max_workers
+        self.cores_per_job = cores_per_job or max(1, (os.cpu_count() or 1) // max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.processes = {}
+        self.cancelled = set()
+        self.returncodes = {}
+        self.count = 0
+
+    def _submit(self, script, cwd, array=None):
+        with self.lock:
+            self.count += 1
+            job_id = f"local.{os.getpid()}.{self.count}"
+        indices = [None] if array is None else range(array)
+        self.futures[job_id] = [self.executor.submit(self._execute, job_id, index, script, cwd) for index in indices]
+        return job_id
+
+    def _execute(self, job_id, index, script, cwd):
+        if job_id in self.cancelled:
+            return None
+        nodefile = os.path.join(cwd, ".nodefile")
+        with open(nodefile, "w") as f:
+            f.write("localhost\n" * self.cores_per_job)
+        env = dict(os.environ, PBS_O_WORKDIR=cwd, SLURM_SUBMIT_DIR=cwd, PBS_NODEFILE=nodefile,
+                   PBS_JOBID=job_id, SLURM_JOB_ID=job_id)
+        suffix = job_id.rsplit(".", 1)[-1]
+        if index is not None:
+            env.update(PBS_ARRAY_INDEX=str(index), PBS_ARRAYID=str(index), SLURM_ARRAY_TASK_ID=str(index))
+            suffix += f".{index}"
+        with open(os.path.join(cwd, f"{os.path.basename(script)}.o{suffix}"), "w") as log:
+            process = subprocess.Popen(["bash", script], cwd=cwd, env=env, stdout=log,
+                                       stderr=subprocess.STDOUT, start_new_session=True)
+            self.processes[(job_id, index)] = process
+            code = process.wait()
+        self.processes.pop((job_id, index), None)
+        # 作业数组的返回值取各元素中最大的
+        with self.lock:
+            self.returncodes[job_id] = max(code, self.returncodes.get(job_id, code))
+        return code
+
+    def status(self, job_ids):
+        states = {}
+        running = {job_id for job_id, _ in list(self.processes)}
+        for job_id in job_ids:
+            futures = self.futures.get(job_id, [])
+            if all(future.done() for future in futures):
+                states[job_id] = FINISHED
+            elif job_id in running:
+                states[job_id] = RUNNING
+            else:
+                states[job_id] = QUEUED
+        return states
+
+    def cancel(self, job_id):
+        self.cancelled.add(job_id)
+        for future in self.futures.get(job_id, []):
+            future.cancel()
+        for (j, _), process in list(self.processes.items()):
+            if j != job_id:
+                continue
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def returncode(self, job_id):
+        return self.returncodes.get(job_id)
+
+
+SCHEDULERS = {
+    "pbs": PBS,
+    "slurm": Slurm,
+    "local": Local,
+}
+
+
+def get_scheduler(config=None):
+    """
+    根据配置创建调度后端
+    :param config: train.yaml 中的 scheduler 配置 {type, max_workers, cores_per_job, array_flag}, None 为 pbs
+    :return: Scheduler
+    """
+    config = config or {}
+    name = config.get("type", "pbs").lower()
+    if name not in SCHEDULERS:
+        raise Exception(f"scheduler type should be one of {list(SCHEDULERS)}.")
+    if name == "local":
+        return Local(config.get("max_workers", 1), config.get("cores_per_job"))
+    if name == "pbs":
+        return PBS(config.get("array_flag", "-J"))
+    return Slurm()
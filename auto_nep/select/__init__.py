@@ -7,5 +7,7 @@
 @Date ：2025/5/3 11:40
 @E-mail ：2071914258@qq.com
 """
-from .select_active import select_active
+from .select_active import select_active, select_active_incremental
 from .select_extend import select_extend
+from .select_gamma import select_gamma
+from .select_stream import StreamSelector
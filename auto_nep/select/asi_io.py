@@ -7,28 +7,156 @@
 @Date ：2025/5/3 16:21
 @E-mail ：2071914258@qq.com
 """
+import os
+import struct
+
 import numpy as np
 
+# 二进制 asi 文件: 文件头 + 按元素连续存储的矩阵块 (可 mmap)
+ASIB_MAGIC = b"ASIB"
+ASIB_VERSION = 1
+ASIB_ALIGN = 64
+_DTYPE_CODE = {np.dtype(np.float32): 4, np.dtype(np.float64): 8}
+_CODE_DTYPE = {v: k for k, v in _DTYPE_CODE.items()}
+
 
 def save_asi(asi, filename="active_set.asi"):
+    """
+    写出 GPUMD 可读的文本 asi 文件, 每个元素整块格式化后一次写入
+    :param asi: {element: np.ndarray}
+    :param filename: 输出文件
+    :return: None
+    """
     with open(filename, "w") as f:
         for k, v in asi.items():
             f.write(f"{k} {v.shape[0]} {v.shape[1]}\n")
-            for i in v.flatten():
-                f.write(str(i) + "\n")
+            # repr 为最短可精确还原的浮点表示, 与逐个 str(np.float64) 输出一致
+            f.write("\n".join(map(repr, np.asarray(v, dtype=np.float64).ravel().tolist())))
+            f.write("\n")
 
 
 def load_asi(asi):
+    """
+    读取 asi 文件, 自动识别文本格式和二进制格式
+    文本 asi 若存在更新的二进制副本 (*.asib), 直接 mmap 二进制副本
+    :param asi: asi 文件路径
+    :return: {element: np.ndarray}
+    """
+    if is_asi_binary(asi):
+        return load_asi_binary(asi)
+    sidecar = asi_sidecar_path(asi)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(asi):
+        return load_asi_binary(sidecar)
+    return load_asi_text(asi)
+
+
+def load_asi_text(asi):
+    """
+    整块解析文本 asi 文件
+    :param asi: asi 文件路径
+    :return: {element: np.ndarray}
+    """
+    ret = {}
+    with open(asi, "rb") as f:
+        content = f.read()
+    if not content.endswith(b"\n"):
+        content += b"\n"
+    # 所有换行符位置, 每个块占 1 行表头 + rows*cols 行数据
+    newlines = np.flatnonzero(np.frombuffer(content, dtype=np.uint8) == ord("\n"))
+    line, start = 0, 0
+    while line < len(newlines):
+        header = content[start: newlines[line]].split()
+        if len(header) == 0:
+            line, start = line + 1, newlines[line] + 1
+            continue
+        element, shape1, shape2 = header[0].decode(), int(header[1]), int(header[2])
+        size = shape1 * shape2
+        if line + size >= len(newlines):
+            raise ValueError(f"{asi}: block {element} is truncated.")
+        block = content[newlines[line] + 1: newlines[line + size]].decode()
+        ret[element] = np.fromstring(block, dtype=np.float64, sep="\n").reshape((shape1, shape2))
+        line, start = line + size + 1, newlines[line + size] + 1
+    return ret
+
+
+def asi_sidecar_path(asi):
+    """
+    文本 asi 对应的二进制副本路径 active_set.asi -> active_set.asib
+    """
+    return os.path.splitext(asi)[0] + ".asib"
+
+
+def is_asi_binary(asi):
+    with open(asi, "rb") as f:
+        return f.read(len(ASIB_MAGIC)) == ASIB_MAGIC
+
+
+def save_asi_binary(asi, filename="active_set.asib", dtype=np.float64):
+    """
+    写出二进制 asi 文件
+    文件头: magic, version, 元素个数, 每个元素 (名称, 行, 列, dtype, 偏移)
+    数据块: 按 ASIB_ALIGN 字节对齐的 C 连续矩阵
+    :param asi: {element: np.ndarray}
+    :param filename: 输出文件
+    :param dtype: np.float32 或 np.float64
+    :return: None
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in _DTYPE_CODE:
+        raise ValueError("dtype should be float32 or float64.")
+
+    entries = []
+    header_size = len(ASIB_MAGIC) + struct.calcsize("<II")
+    for k in asi.keys():
+        header_size += struct.calcsize("<H") + len(k.encode()) + struct.calcsize("<QQBQ")
+
+    offset = _align(header_size)
+    for k, v in asi.items():
+        entries.append((k, v.shape[0], v.shape[1], offset))
+        offset = _align(offset + v.shape[0] * v.shape[1] * dtype.itemsize)
+
+    with open(filename, "wb") as f:
+        f.write(ASIB_MAGIC)
+        f.write(struct.pack("<II", ASIB_VERSION, len(entries)))
+        for k, shape1, shape2, off in entries:
+            name = k.encode()
+            f.write(struct.pack("<H", len(name)))
+            f.write(name)
+            f.write(struct.pack("<QQBQ", shape1, shape2, _DTYPE_CODE[dtype], off))
+        for (k, _, _, off), v in zip(entries, asi.values()):
+            f.write(b"\0" * (off - f.tell()))
+            f.write(np.ascontiguousarray(v, dtype=dtype).tobytes())
+
+
+def load_asi_binary(asi, mmap=True):
+    """
+    读取二进制 asi 文件
+    :param asi: asi 文件路径
+    :param mmap: True 时返回只读 np.memmap, 不拷贝数据
+    :return: {element: np.ndarray}
+    """
     ret = {}
-    with open(asi, "r") as f:
-        while True:
-            B = []
-            line1 = f.readline()
-            if len(line1) == 0:
-                break
-            line1 = line1.split(" ")
-            element, shape1, shape2 = line1[0], int(line1[1]), int(line1[2])
-            for _ in range(shape1 * shape2):
-                B.append(float(f.readline()))
-            ret[element] = np.array(B).reshape((shape1, shape2))
+    with open(asi, "rb") as f:
+        if f.read(len(ASIB_MAGIC)) != ASIB_MAGIC:
+            raise ValueError(f"{asi} is not a binary asi file.")
+        version, n = struct.unpack("<II", f.read(struct.calcsize("<II")))
+        if version != ASIB_VERSION:
+            raise ValueError(f"{asi}: unsupported asib version {version}.")
+        entries = []
+        for _ in range(n):
+            (length,) = struct.unpack("<H", f.read(struct.calcsize("<H")))
+            element = f.read(length).decode()
+            shape1, shape2, code, off = struct.unpack("<QQBQ", f.read(struct.calcsize("<QQBQ")))
+            entries.append((element, shape1, shape2, _CODE_DTYPE[code], off))
+
+        for element, shape1, shape2, dtype, off in entries:
+            if mmap:
+                ret[element] = np.memmap(asi, dtype=dtype, mode="r", offset=off, shape=(shape1, shape2))
+            else:
+                f.seek(off)
+                ret[element] = np.fromfile(f, dtype=dtype, count=shape1 * shape2).reshape((shape1, shape2))
     return ret
+
+
+def _align(n):
+    return (n + ASIB_ALIGN - 1) // ASIB_ALIGN * ASIB_ALIGN
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：cache.py
+@Author ：RongYi
+@Date ：2025/6/21 15:08
+@E-mail ：2071914258@qq.com
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# 偏移索引的一条记录: 结构指纹, 在数据文件中的起始行, 行数 (原子数)
+RECORD = np.dtype([("key", "u1", (20,)), ("offset", "<i8"), ("rows", "<i8")])
+
+
+class _Segment:
+    """
+    一个 nep.txt 的缓存段, 目录 cache_dir/{nep 摘要}/:
+        B.bin       每个原子一行的 B projection (float64, dim 列), 只追加
+        index.bin   RECORD 记录, 只追加, 先写数据再写记录
+    打开时读入全部记录, 写入中断留下的不完整记录和多余数据被截去
+    """
+    DATA = "B.bin"
+    INDEX = "index.bin"
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.data_path = os.path.join(path, self.DATA)
+        self.index_path = os.path.join(path, self.INDEX)
+        self.entries = None
+        self.data = None
+        self.index = None
+
+    def nbytes(self):
+        return sum(os.path.getsize(p) for p in (self.data_path, self.index_path) if os.path.exists(p))
+
+    def load(self):
+        if self.entries is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        index = b""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                index = f.read()
+        records = np.frombuffer(index, dtype=RECORD, count=len(index) // RECORD.itemsize)
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        records = records[records["offset"] + records["rows"] <= size // (8 * self.dim)]
+        end = int((records["offset"] + records["rows"]).max()) if len(records) else 0
+        # 写入中断: 截去不完整的记录和没有记录的数据, 之后按行对齐追加
+        if records.nbytes != len(index) or end * 8 * self.dim != size:
+            with open(self.index_path, "wb") as f:
+                f.write(records.tobytes())
+            with open(self.data_path, "ab") as f:
+                f.truncate(end * 8 * self.dim)
+        self.entries = {r["key"].tobytes(): (int(r["offset"]), int(r["rows"])) for r in records}
+        self.data = open(self.data_path, "a+b", buffering=0)
+        self.index = open(self.index_path, "ab", buffering=0)
+
+    def __contains__(self, fingerprint):
+        self.load()
+        return fingerprint in self.entries
+
+    def get(self, fingerprint):
+        self.load()
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            return None
+        offset, rows = entry
+        self.data.seek(offset * 8 * self.dim)
+        return np.fromfile(self.data, dtype=np.float64, count=rows * self.dim).reshape(rows, self.dim)
+
+    def put(self, fingerprint, value):
+        """
+        :return: 写入的字节数
+        """
+        self.load()
+        data = np.ascontiguousarray(value, dtype=np.float64).tobytes()
+        offset = self.data.seek(0, os.SEEK_END) // (8 * self.dim)
+        self.data.write(data)
+        record = np.array([(np.frombuffer(fingerprint, dtype=np.uint8), offset, len(value))], dtype=RECORD)
+        self.index.write(record.tobytes())
+        self.entries[fingerprint] = (offset, len(value))
+        return len(data) + RECORD.itemsize
+
+    def close(self):
+        for f in (self.data, self.index):
+            if f is not None:
+                f.close()
+        self.data = self.index = self.entries = None
+
+
+class BProjectionCache:
+    """
+    B projections 磁盘缓存, 按 nep.txt 摘要分段, 每段是只追加的数组 (见 _Segment)
+    键: (nep.txt 摘要, 结构指纹), 值: 每个原子的 B projection
+    cache.json 记录各段的 dim 和最近使用时间, 总大小由各段文件大小得到, 不遍历缓存目录
+    总大小超过 max_size 时按最近使用时间整段淘汰, 正在写入的段不淘汰, 仍超出时不再写入
+
+    B projection 由 nep.txt 的描述符和神经网络参数决定, nep.txt 改变后全部失效:
+    只有同一个 nep.txt 再次计算相同结构时命中 (同一次迭代的 step 3 / step 5 / gamma, 续算)
+    """
+    VERSION = 1
+    META = "cache.json"
+
+    def __init__(self, cache_dir, max_size=10 * 1024 ** 3):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.meta_path = os.path.join(self.cache_dir, self.META)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.meta = self._load()
+        self.segments = {}
+        self.sizes = {digest: self._segment(digest, meta["dim"]).nbytes() for digest, meta in self.meta.items()}
+        self.size = sum(self.sizes.values())
+
+    def _load(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if meta.get("version") != self.VERSION:
+            return {}
+        return meta["segments"]
+
+    def _save(self):
+        tmp = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": self.VERSION, "segments": self.meta}, f, indent=1)
+        os.replace(tmp, self.meta_path)
+
+    def _segment(self, digest, dim=None):
+        if digest not in self.segments:
+            self.segments[digest] = _Segment(os.path.join(self.cache_dir, digest), dim)
+        return self.segments[digest]
+
+    def _open(self, digest):
+        """
+        第一次使用时读入段的记录, 写入中断被截去时修正总大小
+        """
+        segment = self._segment(digest)
+        if segment.entries is None:
+            segment.load()
+            size = segment.nbytes()
+            self.size += size - self.sizes[digest]
+            self.sizes[digest] = size
+        return segment
+
+    @staticmethod
+    def nep_digest(nep_file):
+        """
+        nep.txt 内容摘要
+        """
+        h = hashlib.sha1()
+        with open(nep_file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def fingerprint(atoms):
+        """
+        结构指纹: 原子序数, 坐标, 晶胞, 周期性
+        """
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(atoms.numbers, dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(atoms.positions, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(atoms.cell[:], dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(atoms.pbc, dtype=np.uint8).tobytes())
+        return h.digest()
+
+    def key(self, atoms, nep_digest):
+        return nep_digest, self.fingerprint(atoms)
+
+    def get(self, key):
+        digest, fingerprint = key
+        value = None
+        if digest in self.meta:
+            value = self._open(digest).get(fingerprint)
+        if value is None:
+            self.misses += 1
+            return None
+        # 使用时间只记在内存, report / evict 时写入 cache.json
+        self.meta[digest]["used"] = time.time()
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        digest, fingerprint = key
+        if digest not in self.meta:
+            self.meta[digest] = {"dim": int(np.shape(value)[1]), "used": time.time()}
+            self.sizes[digest] = 0
+            self._segment(digest, self.meta[digest]["dim"])
+            self._save()
+        # 内容寻址, 已有的条目不重复写入
+        if fingerprint in self._open(digest):
+            return
+        nbytes = np.size(value) * 8 + RECORD.itemsize
+        if self.size + nbytes > self.max_size:
+            if len(self.meta) > 1:
+                self.evict(keep=digest)
+            if self.size + nbytes > self.max_size:
+                return
+        nbytes = self._open(digest).put(fingerprint, value)
+        self.sizes[digest] += nbytes
+        self.size += nbytes
+        self.meta[digest]["used"] = time.time()
+
+    def evict(self, keep=None):
+        """
+        按最近使用时间从旧到新整段删除, 直到总大小低于 0.9 * max_size
+        :param keep: 不删除的段 (正在写入)
+        """
+        for digest in sorted(self.meta, key=lambda d: self.meta[d].get("used", 0)):
+            if self.size <= 0.9 * self.max_size:
+                break
+            if digest == keep:
+                continue
+            segment = self.segments.pop(digest, None)
+            if segment is not None:
+                segment.close()
+            shutil.rmtree(os.path.join(self.cache_dir, digest), ignore_errors=True)
+            self.size -= self.sizes.pop(digest)
+            self.meta.pop(digest)
+        self._save()
+
+    def report(self):
+        self._save()
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        print(f"B projection cache: {self.hits}/{total} hits ({rate:.1f}%), size {self.size / 1024 ** 2:.1f} MB")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：engines.py
+@Author ：RongYi
+@Date ：2025/6/24 14:17
+@E-mail ：2071914258@qq.com
+"""
+from time import time
+
+import numpy as np
+from scipy.linalg import blas, qr, solve
+
+from auto_nep.select.maxvol_cpu import maxvol, maxvol_swaps
+
+"""
+主动学习集选择引擎, 统一接口 engine(A, e, k, dtype=np.float64, stats=None) -> I
+    maxvol: LU 初始化 + 行交换 (maxvol_cpu)
+    qr:     列主元 QR 初始化 + 行交换
+    rect:   矩形 MaxVol, 每轮加入多行, 最后在选出的小矩阵上做方阵 MaxVol
+"""
+
+
+def qr_maxvol(A, e, k, dtype=np.float64, stats=None):
+    """
+    列主元 QR 选出初始的 r 行, 再做 MaxVol 行交换
+    对病态的 B 矩阵, QR 主元比 LU 主元更接近最大体积, 交换次数少
+    :param A: [n, r] 矩阵 (n > r)
+    :param e: 精度参数 (>= 1)
+    :param k: 最大迭代次数
+    :param dtype: 迭代精度
+    :param stats: 不为 None 时写入迭代次数
+    :return: 选中的行号, 长度 r
+    """
+    n, r = A.shape
+    if n <= r:
+        raise ValueError('Input matrix should be "tall"')
+
+    _, piv = qr(A.T, mode="r", pivoting=True, check_finite=False)
+    I = piv[:r]
+    B = solve(A[I].T, A.T, check_finite=False).T
+    return maxvol_swaps(B, I, e, k, dtype, stats)
+
+
+def rect_maxvol(A, e, k, dtype=np.float64, stats=None, dr_max=None, block=8, e0=1.05, k0=10):
+    """
+    矩形 MaxVol
+    1. 宽松精度 e0 / k0 次迭代的方阵 MaxVol 作为起点
+    2. 每轮取系数行范数最大的 block 行依次加入 (秩一更新), 直到所有行范数 <= e
+    3. 在选出的 r + dr 行上做方阵 MaxVol, 返回 r 行 (GPUMD 需要方阵的逆)
+    4. 以第 3 步结果为起点在全部行上做行交换, 保证 max gamma <= e
+    :param A: [n, r] 矩阵 (n > r)
+    :param e: 精度参数 (>= 1)
+    :param k: 第 3, 4 步最大迭代次数
+    :param dtype: 迭代精度
+    :param stats: 不为 None 时写入 iters (交换次数) 和 passes (加行轮数)
+    :param dr_max: 最多额外加入的行数, 默认 r
+    :param block: 每轮加入的行数
+    :param e0: 第 1 步精度参数
+    :param k0: 第 1 步最大迭代次数
+    :return: 选中的行号, 长度 r
+    """
+    n, r = A.shape
+    if n <= r:
+        raise ValueError('Input matrix should be "tall"')
+    dr_max = r if dr_max is None else dr_max
+    r_max = min(r + dr_max, n)
+
+    start_stats = {}
+    I0 = maxvol(A, e0, k0, dtype, start_stats)
+    B0 = solve(A[I0].T, A.T, check_finite=False).T
+
+    ger = blas.sger if np.dtype(dtype) == np.float32 else blas.dger
+    B = np.zeros((n, r_max), dtype=dtype, order="F")
+    B[:, :r] = B0
+    I = list(I0)
+    selected = np.zeros(n, dtype=bool)
+    selected[I0] = True
+    F = np.where(selected, 0.0, np.einsum("ij,ij->i", B0, B0))
+
+    t0 = time()
+    c, passes = r, 0
+    while c < r_max:
+        candidates = np.flatnonzero(F > e * e)
+        if len(candidates) == 0:
+            break
+        passes += 1
+        top = candidates[np.argsort(F[candidates])[::-1][: min(block, r_max - c)]]
+        for i in top:
+            # 前面加入的行会降低其余行的范数, 低于阈值的跳过
+            if F[i] <= e * e:
+                continue
+            bi = B[i, :c].copy()
+            v = B[:, :c] @ bi
+            l = 1.0 / (1.0 + v[i])
+            ger(-l, v, bi, a=B[:, :c], overwrite_a=1)
+            B[:, c] = l * v
+            F = F - l * v * v
+            selected[i] = True
+            F[selected] = 0.0
+            I.append(i)
+            c += 1
+    print(f"Rect maxvol: {c - r} rows added in {passes} passes, {time() - t0:.2f} s")
+
+    # 在 r + dr 行上做方阵 MaxVol, 再在全部行上收尾交换保证 max gamma <= e
+    I = np.array(I)
+    square_stats, final_stats = {}, {}
+    if len(I) > r:
+        J = maxvol(A[I], e, k, dtype, square_stats)
+        I = I[J]
+    B = solve(A[I].T, A.T, check_finite=False).T
+    I = maxvol_swaps(B, I, e, k, dtype, final_stats)
+    if stats is not None:
+        stats["iters"] = sum(x.get("iters", 0) for x in (start_stats, square_stats, final_stats))
+        stats["passes"] = passes
+    return I
+
+
+ENGINES = {
+    "maxvol": maxvol,
+    "qr": qr_maxvol,
+    "rect": rect_maxvol,
+}
+
+
+def get_engine(name):
+    if name not in ENGINES:
+        raise Exception(f"engine should be one of {list(ENGINES)}.")
+    return ENGINES[name]
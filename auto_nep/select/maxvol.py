@@ -8,6 +8,8 @@
 @E-mail ：2071914258@qq.com
 """
 
+from functools import partial
+
 import numpy as np
 
 
@@ -16,6 +18,85 @@ def find_inverse(m):
     return np.linalg.pinv(m, rcond=1e-8)
 
 
+def _read_rows(A, index=None):
+    """
+    读取 A 的若干行为 float64 数组
+    A 可以是磁盘上的内存映射矩阵 (可能为 float32), 连续行号按切片读取, 只加载当前 batch
+    """
+    if index is None:
+        return np.asarray(A, dtype=np.float64)
+    index = np.asarray(index)
+    if index.dtype != bool and len(index) > 0 and np.all(np.diff(index) == 1):
+        return np.asarray(A[index[0]: index[-1] + 1], dtype=np.float64)
+    return np.asarray(A[index], dtype=np.float64)
+
+
+def get_maxvol(mode="GPU", dtype=np.float64, engine="maxvol"):
+    """
+    选择 MaxVol 实现, 没有 CuPy 时 GPU 模式自动退回 CPU
+    :param mode: "GPU" 或 "CPU"
+    :param dtype: CPU 模式系数矩阵精度, np.float64 或 np.float32
+    :param engine: 选择引擎 maxvol / qr / rect (qr 和 rect 只有 CPU 实现)
+    :return: maxvol(A, e, k)
+    """
+    if mode not in ("GPU", "CPU"):
+        raise Exception("mode should be CPU or GPU.")
+    if mode == "GPU" and engine == "maxvol":
+        try:
+            from auto_nep.select.maxvol_gpu import maxvol
+            return maxvol
+        except ImportError:
+            print("CuPy is not available, MaxVol falls back to CPU.")
+    from auto_nep.select.engines import get_engine
+    return partial(get_engine(engine), dtype=dtype)
+
+
+def get_maxvol_swaps(mode="GPU", dtype=np.float64):
+    """
+    选择 MaxVol 行交换实现 (已知系数矩阵时使用), 没有 CuPy 时 GPU 模式自动退回 CPU
+    :param mode: "GPU" 或 "CPU"
+    :param dtype: CPU 模式系数矩阵精度
+    :return: maxvol_swaps(B, I, e, k)
+    """
+    if mode == "GPU":
+        try:
+            from auto_nep.select.maxvol_gpu import maxvol_swaps
+            return maxvol_swaps
+        except ImportError:
+            pass
+    from auto_nep.select.maxvol_cpu import maxvol_swaps
+    return partial(maxvol_swaps, dtype=dtype)
+
+
+def update_active_set(A_selected, struct_index_selected, inv, A_new, struct_index_new, gamma_tol, maxvol_iter, swaps):
+    """
+    用新的环境更新主动学习集
+    A_selected 的系数是单位阵, 新环境的系数为 A_new @ inv, 直接在 [I; C] 上做行交换,
+    不需要对 [A_selected; A_new] 重新做 LU
+    :param A_selected: 当前主动学习集 [r, r]
+    :param struct_index_selected: 当前主动学习集的结构序号
+    :param inv: A_selected 的逆
+    :param A_new: 新环境 [m, r]
+    :param struct_index_new: 新环境的结构序号
+    :param gamma_tol: gamma 阈值
+    :param maxvol_iter: 最大迭代次数
+    :param swaps: get_maxvol_swaps 的返回值
+    :return: A_selected, struct_index_selected, inv, 新加入的环境数
+    """
+    C = A_new @ inv
+    if np.abs(C).max() <= gamma_tol:
+        return A_selected, struct_index_selected, inv, 0
+
+    r = len(A_selected)
+    B = np.vstack([np.eye(r), C])
+    selected = swaps(B, np.arange(r), gamma_tol, maxvol_iter)
+    n_add = int((selected >= r).sum())
+
+    A_selected = np.vstack([A_selected, A_new])[selected]
+    struct_index_selected = np.hstack([struct_index_selected, struct_index_new])[selected]
+    return A_selected, struct_index_selected, find_inverse(A_selected), n_add
+
+
 def calculate_maxvol(
     A,
     struct_index,
@@ -24,18 +105,15 @@ def calculate_maxvol(
     mode="GPU",
     batch_size=None,
     n_refinement=10,
+    dtype=np.float64,
+    engine="maxvol",
 ):
-    if mode == "GPU":
-        from auto_nep.select.maxvol_gpu import maxvol
-    elif mode == "CPU":
-        from auto_nep.select.maxvol_cpu import maxvol
-    else:
-        raise Exception("mode should be CPU or GPU.")
+    maxvol = get_maxvol(mode, dtype, engine)
 
     # one batch
     if batch_size is None:
-        selected = maxvol(A, gamma_tol, maxvol_iter)
-        return A[selected], struct_index[selected]
+        selected = maxvol(_read_rows(A), gamma_tol, maxvol_iter)
+        return _read_rows(A, selected), struct_index[selected]
 
     # multiple batches
     batch_num = np.ceil(len(A) / batch_size)
@@ -45,45 +123,61 @@ def calculate_maxvol(
     )
 
     # stage 1 - cumulative maxvol
+    # 第一个 batch 完整 MaxVol, 之后保留主动学习集的逆, 新 batch 只需一次矩阵乘法求系数
+    swaps = get_maxvol_swaps(mode, dtype)
     A_selected = None
     struct_index_selected = None
+    inv = None
     for i, ind in enumerate(batch_splits_indices):
+        A_batch = _read_rows(A, ind)
         # first batch
         if A_selected is None:
-            A_joint = A[ind]
-            struct_index_joint = struct_index[ind]
+            selected = maxvol(A_batch, gamma_tol, maxvol_iter)
+            A_selected = A_batch[selected]
+            struct_index_selected = struct_index[ind][selected]
+            inv = find_inverse(A_selected)
+            n_add = len(selected)
         # other batches
         else:
-            A_joint = np.vstack([A_selected, A[ind]])
-            struct_index_joint = np.hstack([struct_index_selected, struct_index[ind]])
-
-        selected = maxvol(A_joint, gamma_tol, maxvol_iter)
-        if A_selected is None:
-            l = 0
-        else:
-            l = len(A_selected)
-        A_selected = A_joint[selected]
-        struct_index_selected = struct_index_joint[selected]
-        n_add = (selected >= l).sum()
+            A_selected, struct_index_selected, inv, n_add = update_active_set(
+                A_selected, struct_index_selected, inv, A_batch, struct_index[ind],
+                gamma_tol, maxvol_iter, swaps,
+            )
         print(f"Batch {i}: adding {n_add} envs. ")
 
     # stage 2 - refinement
+    # 分块检查全部环境相对当前主动学习集的 gamma, 只收集 gamma > gamma_tol 的行做行交换
     for ii in range(n_refinement):
-        # check max gamma, if small enough, no need to refine
-        inv = find_inverse(A_selected)
-        gamma = np.abs(A_selected @ inv)
-        large_gamma = gamma > gamma_tol
+        large_gamma, max_gamma = find_large_gamma(A, inv, gamma_tol, batch_size)
         print(
-            f"Refinement round {ii}: {large_gamma.sum()} envs out of active set. Max gamma = {np.max(gamma)}"
+            f"Refinement round {ii}: {len(large_gamma)} envs out of active set. Max gamma = {max_gamma}"
         )
-        if np.max(gamma) < gamma_tol:
+        if len(large_gamma) == 0:
             print("Refinement done.")
             return A_selected, struct_index_selected
 
-        A_joint = np.vstack([A_selected, A[large_gamma]])
-        struct_index_joint = np.hstack(
-            [struct_index_selected, struct_index[large_gamma]]
+        A_selected, struct_index_selected, inv, _ = update_active_set(
+            A_selected, struct_index_selected, inv, _read_rows(A, large_gamma), struct_index[large_gamma],
+            gamma_tol, maxvol_iter, swaps,
         )
-        selected = maxvol(A_joint, gamma_tol, maxvol_iter)
-        A_selected = A_joint[selected]
-        struct_index_selected = struct_index_joint[selected]
+
+    print(f"Refinement not converged after {n_refinement} rounds.")
+    return A_selected, struct_index_selected
+
+
+def find_large_gamma(A, inv, gamma_tol, chunk_size=10000):
+    """
+    分块计算 gamma = max|A_chunk @ inv|, 不构造 n x r 的完整结果
+    :param A: 全部环境 (可为内存映射矩阵)
+    :param inv: 主动学习集的逆
+    :param gamma_tol: gamma 阈值
+    :param chunk_size: 每块行数
+    :return: gamma > gamma_tol 的行号, 最大 gamma
+    """
+    large_gamma = []
+    max_gamma = 0.0
+    for start in range(0, len(A), chunk_size):
+        gamma = np.abs(_read_rows(A, np.arange(start, min(start + chunk_size, len(A)))) @ inv).max(axis=1)
+        max_gamma = max(max_gamma, float(gamma.max()))
+        large_gamma.append(start + np.flatnonzero(gamma > gamma_tol))
+    return np.concatenate(large_gamma), max_gamma
@@ -9,7 +9,7 @@
 """
 
 import numpy as np
-from scipy.linalg import lu, solve_triangular
+from scipy.linalg import blas, lu, solve_triangular
 from time import time
 
 """
@@ -17,7 +17,7 @@ The following code comes from https://github.com/AndreiChertkov/teneva
 """
 
 
-def maxvol(A, e, k):
+def maxvol(A, e, k, dtype=np.float64, stats=None):
     """Compute the maximal-volume submatrix for given tall matrix.
 
     Args:
@@ -29,6 +29,10 @@ def maxvol(A, e, k):
             will be slightly lower (in most cases, the optimal value is within
             the range of 1.01 - 1.1).
         k (int): maximum number of iterations (should be >= 1).
+        dtype (np.dtype): precision of the coefficient matrix B during the
+            swap iterations, np.float64 or np.float32 (GPUMD uses float).
+        stats (dict): if given, the number of swap iterations is stored in
+            stats["iters"].
 
     Returns:
         (np.ndarray, np.ndarray): the row numbers I containing the maximal
@@ -48,28 +52,58 @@ def maxvol(A, e, k):
     if n <= r:
         raise ValueError('Input matrix should be "tall"')
 
-    P, L, U = lu(A, check_finite=False)
-    I = P[:, :r].argmax(axis=0)
+    # 置换以行号返回, 不构造 n x n 置换矩阵
+    p, L, U = lu(A, check_finite=False, p_indices=True)
+    I = np.argsort(p)[:r]
     Q = solve_triangular(U, A.T, trans=1, check_finite=False)
     B = solve_triangular(
         L[:r, :], Q, trans=1, check_finite=False, unit_diagonal=True, lower=True
     ).T
 
+    return maxvol_swaps(B, I, e, k, dtype, stats)
+
+
+def maxvol_swaps(B, I, e, k, dtype=np.float64, stats=None):
+    """
+    MaxVol 行交换迭代
+    :param B: 系数矩阵 [n, r], A = B A[I, :] (按列存储且精度一致时原地修改)
+    :param I: 当前选中的行号, 长度 r
+    :param e: 精度参数 (>= 1)
+    :param k: 最大迭代次数
+    :param dtype: 迭代精度, np.float64 或 np.float32
+    :param stats: 不为 None 时写入迭代次数 stats["iters"]
+    :return: 选中的行号 I
+    """
+    n, r = B.shape
+    I = np.array(I, copy=True)
+
+    # 系数矩阵按列存储: 一维视图上 i?amax 一次扫描找到最大元素,
+    # ?ger 原地完成秩一更新, 每次交换不再分配 n x r 临时矩阵
+    if np.dtype(dtype) == np.float32:
+        iamax, ger = blas.isamax, blas.sger
+    else:
+        iamax, ger = blas.idamax, blas.dger
+    B = np.asfortranarray(B, dtype=dtype)
+    B_flat = B.ravel(order="F")
+
     t0 = time()
+    iter = 0
     for iter in range(k):
-        i, j = np.divmod(np.abs(B).argmax(), r)
+        j, i = np.divmod(iamax(B_flat), n)
         E = np.abs(B[i, j])
         if E <= e:
-            v = iter / (time() - t0)
+            v = iter / max(time() - t0, 1e-9)
             print(f"Maxvol Speed: {int(v)} iters/s")
             break
 
         I[j] = i
 
-        bj = B[:, j]
+        bj = B[:, j].copy()
         bi = B[i, :].copy()
         bi[j] -= 1.0
 
-        B -= np.outer(bj, bi / B[i, j])
+        ger(-1.0 / bj[i], bj, bi, a=B, overwrite_a=1)
 
+    if stats is not None:
+        stats["iters"] = iter
     return I
@@ -56,12 +56,28 @@ def maxvol(A, e, k):
         L[:r, :], Q, trans=1, check_finite=False, unit_diagonal=True, lower=True
     ).T
 
+    return maxvol_swaps(B, I, e, k)
+
+
+def maxvol_swaps(B, I, e, k):
+    """
+    MaxVol 行交换迭代 (GPU)
+    :param B: 系数矩阵 [n, r], A = B A[I, :]
+    :param I: 当前选中的行号, 长度 r
+    :param e: 精度参数 (>= 1)
+    :param k: 最大迭代次数
+    :return: 选中的行号 I (numpy)
+    """
+    B = cp.array(B)
+    I = cp.array(I)
+    n, r = B.shape
+
     t0 = time()
     for iter in range(k):
         i, j = cp.divmod(cp.abs(B).argmax(), r)
         E = cp.abs(B[i, j])
         if E <= e:
-            v = iter / (time() - t0)
+            v = iter / max(time() - t0, 1e-9)
             print(f"Maxvol Speed: {int(v)} iters/s")
             break
 
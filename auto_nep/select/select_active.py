@@ -7,20 +7,56 @@
 @Date ：2025/5/3 11:42
 @E-mail ：2071914258@qq.com
 """
+import shutil
 
+import numpy as np
 from ase.io import write
 from pynep.io import load_nep, dump_nep
 from auto_nep.select.tools import get_B_projections, get_active_set
 
 
-def select_active(xyz_path, nep_path, out_dir):
+def select_active(xyz_path, nep_path, out_dir, cache=None, n_jobs=1, store_dir=None, dtype=np.float64,
+                  engine="maxvol"):
     nep_file = nep_path
-    traj = load_nep(xyz_path)
+    # xyz_path 也可以是 ase Atoms 列表 (例如 DatasetStore.read())
+    traj = load_nep(xyz_path) if isinstance(xyz_path, str) else list(xyz_path)
+    _select_active(traj, nep_file, out_dir, cache, n_jobs, store_dir, dtype, engine)
 
-    B_projections, B_projections_struct_index = get_B_projections(traj, nep_file)
+
+def select_active_incremental(prev_active_xyz, add_xyz, nep_path, out_dir, cache=None, n_jobs=1,
+                              store_dir=None, dtype=np.float64, engine="maxvol"):
+    """
+    增量更新主动学习集
+    以上一次迭代的主动学习集结构为种子 (排在最前, 作为 MaxVol 第一批),
+    只加入本次新增的 to_add.xyz 结构, 不再遍历整个 train.xyz
+    :param prev_active_xyz: 上一次迭代的 select_active.xyz
+    :param add_xyz: 本次新增结构 to_add.xyz
+    :param nep_path: 当前 nep.txt
+    :param out_dir: 输出目录
+    :param cache: BProjectionCache 或 None
+    :param n_jobs: B projections 和 MaxVol 并行进程数
+    :param store_dir: B projections 内存映射目录, None 时保存在内存
+    :param dtype: B projections 存储精度
+    :param engine: 选择引擎 maxvol / qr / rect
+    :return: None
+    """
+    prev_traj = load_nep(prev_active_xyz)
+    add_traj = load_nep(add_xyz)
+    print(f"Incremental active set: {len(prev_traj)} previous active structures + {len(add_traj)} new structures")
+    _select_active(prev_traj + add_traj, nep_path, out_dir, cache, n_jobs, store_dir, dtype, engine)
+
+
+def _select_active(traj, nep_file, out_dir, cache=None, n_jobs=1, store_dir=None, dtype=np.float64,
+                   engine="maxvol"):
+    B_projections, B_projections_struct_index = get_B_projections(
+        traj, nep_file, cache, n_jobs, store_dir=store_dir, dtype=dtype
+    )
     active_set_inv, active_set_struct = get_active_set(
-        B_projections, B_projections_struct_index, out_dir=out_dir
+        B_projections, B_projections_struct_index, out_dir=out_dir, n_jobs=n_jobs, engine=engine
     )
+    del B_projections
+    if store_dir is not None:
+        shutil.rmtree(store_dir, ignore_errors=True)
 
     out_traj = [traj[i] for i in active_set_struct]
     try:
@@ -7,15 +7,20 @@
 @Date ：2025/5/3 16:23
 @E-mail ：2071914258@qq.com
 """
+import shutil
 
+import numpy as np
 from ase.io import write, read
 from pynep.io import load_nep, dump_nep
 from auto_nep.select.tools import get_B_projections, get_active_set
 
 
-def select_extend():
+def select_extend(cache=None, n_jobs=1, store_dir=None, dtype=np.float64, engine="maxvol", train=None):
+    """
+    :param train: 训练集 ase Atoms 列表, None 读取当前目录的 train.xyz
+    """
     nep_file = "nep.txt"
-    data1 = load_nep("train.xyz")
+    data1 = load_nep("train.xyz") if train is None else list(train)
     try:
         data2 = load_nep("large_gamma.xyz")
     except:
@@ -23,10 +28,15 @@ def select_extend():
 
     data = data1 + data2
 
-    B_projections, B_projections_struct_index = get_B_projections(data, nep_file)
+    B_projections, B_projections_struct_index = get_B_projections(
+        data, nep_file, cache, n_jobs, store_dir=store_dir, dtype=dtype
+    )
     active_set_inv, active_set_struct = get_active_set(
-        B_projections, B_projections_struct_index, write_asi=False
+        B_projections, B_projections_struct_index, write_asi=False, n_jobs=n_jobs, engine=engine
     )
+    del B_projections
+    if store_dir is not None:
+        shutil.rmtree(store_dir, ignore_errors=True)
 
     out = [data[i] for i in active_set_struct if i >= len(data1)]
 
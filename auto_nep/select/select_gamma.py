@@ -7,17 +7,57 @@
 @Date ：2025/5/3 16:24
 @E-mail ：2071914258@qq.com
 """
-from ase.io import write
-from pynep.io import load_nep, dump_nep
-from tools import get_gamma
+import time
+from itertools import islice
 
-nep_file = "nep.txt"
-traj = load_nep("to_select.xyz")
+from ase.io import iread, write
+from auto_nep.select.asi_io import load_asi
+from auto_nep.select.tools import get_gamma
+from auto_nep.sysprint import sysprint
 
-get_gamma(traj, nep_file, "active_set.asi")
 
-out_traj = [atoms for atoms in traj if atoms.arrays["gamma"].max() > 1]
-try:
-    dump_nep("large_gamma.xyz", out_traj)
-except:
-    write("large_gamma.xyz", out_traj)
+def select_gamma(trajectory, nep_file="nep.txt", asi_file="active_set.asi", output="large_gamma.xyz",
+                 gamma_low=1.0, gamma_high=None, chunk_size=1000, n_jobs=1, cache=None):
+    """
+    流式筛选大轨迹中外推等级高的结构
+    按 chunk_size 分块读取, 内存只与块大小有关, 与轨迹大小无关
+    :param trajectory: 轨迹文件 (dump / movie, extxyz)
+    :param nep_file: nep.txt 路径
+    :param asi_file: active_set.asi 路径
+    :param output: 输出文件
+    :param gamma_low: 保留最大 gamma > gamma_low 的结构
+    :param gamma_high: 丢弃最大 gamma > gamma_high 的结构 (非物理结构), None 为不限制
+    :param chunk_size: 每块结构数
+    :param n_jobs: B projections 计算进程数
+    :param cache: BProjectionCache 或 None
+    :return: 筛选出的结构数
+    """
+    active_set_inverse = load_asi(asi_file)
+    frames = iread(trajectory, index=":")
+
+    start_time = time.perf_counter()
+    total, selected, too_large = 0, 0, 0
+    with open(output, "w") as f:
+        while True:
+            chunk = list(islice(frames, chunk_size))
+            if len(chunk) == 0:
+                break
+            gamma, gamma_max = get_gamma(chunk, nep_file, active_set_inverse, cache, n_jobs)
+            keep = gamma_max > gamma_low
+            if gamma_high is not None:
+                too_large += int((gamma_max > gamma_high).sum())
+                keep &= gamma_max <= gamma_high
+            out = [atoms for atoms, k in zip(chunk, keep) if k]
+            if out:
+                write(f, out, format="extxyz")
+                f.flush()
+
+            total += len(chunk)
+            selected += len(out)
+            spend_time = time.perf_counter() - start_time
+            sysprint(f"[gamma] {total} frames, selected {selected}, "
+                     f"{total / spend_time:.1f} frames/s")
+
+    sysprint(f"[gamma] 共 {total} 结构, 选出 {selected} 结构写入 {output}"
+             + (f", {too_large} 结构 gamma > {gamma_high} 被丢弃" if gamma_high is not None else ""))
+    return selected
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：select_stream.py
+@Author ：RongYi
+@Date ：2025/6/28 15:20
+@E-mail ：2071914258@qq.com
+"""
+import numpy as np
+from pynep.io import load_nep
+from auto_nep.select.asi_io import load_asi
+from auto_nep.select.maxvol import calculate_maxvol, find_inverse, get_maxvol_swaps, update_active_set
+from auto_nep.select.tools import get_B_projections, iter_B_projections
+
+
+class StreamSelector:
+    """
+    流式结构选择
+    以第 3 步的 active_set.asi (或 train.xyz 重新计算的主动学习集) 为起点, 每批候选结构的系数为 B @ inv, gamma > gamma_tol 的环境
+    通过行交换进入主动学习集, 含有新进入环境的候选结构被选中
+    已选中的结构不会撤回 (后续批次可能把它的环境换出, 但它已经提交计算)
+    """
+    def __init__(self, train_xyz, nep_file, cache=None, n_jobs=1, dtype=np.float64, engine="maxvol",
+                 gamma_tol=1.001, maxvol_iter=1000, mode="GPU", batch_size=10000, asi=None):
+        """
+        :param train_xyz: 训练集路径或 ase Atoms 列表, 给出 asi 时不使用
+        :param nep_file: nep.txt 路径
+        :param cache: BProjectionCache 或 None
+        :param n_jobs: B projections 计算进程数
+        :param dtype: B projections 存储精度
+        :param engine: 初始主动学习集选择引擎 maxvol / qr / rect
+        :param gamma_tol: gamma 阈值
+        :param maxvol_iter: 最大迭代次数
+        :param mode: "GPU" 或 "CPU"
+        :param batch_size: 初始主动学习集 MaxVol 每批环境数
+        :param asi: active_set.asi 路径或 {element: inverse}, 直接作为初始主动学习集
+        """
+        self.nep_file = nep_file
+        self.cache = cache
+        self.n_jobs = n_jobs
+        self.gamma_tol = gamma_tol
+        self.maxvol_iter = maxvol_iter
+        self.swaps = get_maxvol_swaps(mode, dtype)
+        self.n_screened = 0
+        self.n_selected = 0
+
+        if asi is not None:
+            # 主动学习集 A 为 inverse 的逆, 其中的结构都来自训练集, 序号记为 -1
+            inverse = load_asi(asi) if isinstance(asi, str) else asi
+            self.active = {}
+            for e, inv in inverse.items():
+                inv = np.array(inv, dtype=np.float64)
+                self.active[e] = (find_inverse(inv), np.full(len(inv), -1), inv)
+            self.n_structures = 0
+            return
+
+        train = load_nep(train_xyz) if isinstance(train_xyz, str) else train_xyz
+        B_projections, B_projections_struct_index = get_B_projections(train, nep_file, cache, n_jobs, dtype=dtype)
+        self.active = {}
+        for e, B in B_projections.items():
+            A_selected, struct_index = calculate_maxvol(
+                B, B_projections_struct_index[e], gamma_tol, maxvol_iter, mode, batch_size,
+                dtype=dtype, engine=engine,
+            )
+            self.active[e] = (A_selected, struct_index, find_inverse(A_selected))
+        self.n_structures = len(train)
+
+    def add(self, frames, limit=None):
+        """
+        筛选一批候选结构并更新主动学习集
+        :param frames: ase Atoms 列表
+        :param limit: 最多选中的结构数, None 为不限制
+        :return: 选中的结构列表 (按输入顺序)
+        """
+        if len(frames) == 0:
+            return []
+        first = self.n_structures
+        self.n_structures += len(frames)
+
+        # 按元素收集候选环境
+        rows = {e: [] for e in self.active}
+        index = {e: [] for e in self.active}
+        for i, B_projection in enumerate(iter_B_projections(frames, self.nep_file, self.cache, self.n_jobs)):
+            symbols = np.array(frames[i].get_chemical_symbols())
+            for e in self.active:
+                mask = symbols == e
+                if mask.any():
+                    rows[e].append(B_projection[mask])
+                    index[e].append(np.full(int(mask.sum()), first + i))
+
+        rows = {e: np.concatenate(r) for e, r in rows.items() if r}
+        index = {e: np.concatenate(i) for e, i in index.items() if i}
+        active, selected = self._update(rows, index, first)
+        if limit is not None and len(selected) > limit:
+            # 超出预算: 只用前 limit 个选中结构的环境, 从更新前的主动学习集重新更新,
+            # 放弃的结构不能留在主动学习集中
+            keep = np.array(sorted(selected)[:limit])
+            rows = {e: r[np.isin(index[e], keep)] for e, r in rows.items()}
+            index = {e: i[np.isin(i, keep)] for e, i in index.items()}
+            active, selected = self._update(rows, index, first)
+        self.active = active
+
+        self.n_screened += len(frames)
+        self.n_selected += len(selected)
+        return [frames[i - first] for i in sorted(selected)]
+
+    def _update(self, rows, index, first):
+        """
+        用候选环境更新每种元素的主动学习集, 不修改 self.active
+        :return: 新的主动学习集, 选中的结构序号
+        """
+        active, selected = dict(self.active), set()
+        for e, (A_selected, struct_index, inv) in self.active.items():
+            if e not in rows or not len(rows[e]):
+                continue
+            before = set(struct_index.tolist())
+            A_selected, struct_index, inv, n_add = update_active_set(
+                A_selected, struct_index, inv, rows[e], index[e],
+                self.gamma_tol, self.maxvol_iter, self.swaps,
+            )
+            active[e] = (A_selected, struct_index, inv)
+            if n_add:
+                selected.update(i for i in set(struct_index.tolist()) - before if i >= first)
+        return active, selected
@@ -7,58 +7,241 @@
 @Date ：2025/5/3 11:44
 @E-mail ：2071914258@qq.com
 """
+import os
 
 import numpy as np
+from ase.data import atomic_numbers
 from tqdm import tqdm
+from joblib import Parallel, delayed, effective_n_jobs, parallel_config
 from pynep.calculate import NEP
-from auto_nep.select.asi_io import save_asi, load_asi
+from auto_nep.select.cache import BProjectionCache
+from auto_nep.select.asi_io import save_asi, load_asi, save_asi_binary, asi_sidecar_path
 from auto_nep.select.maxvol import calculate_maxvol, find_inverse
 
 
-def get_gamma(traj, nep_file, asi_file):
-    calc = NEP(nep_file)
-    active_set_inverse = load_asi(asi_file)
-    for atoms in tqdm(traj):
-        atoms.arrays["gamma"] = np.zeros(len(atoms))
+# 每个 (worker) 进程只加载一次势函数, 键为 (绝对路径, 内容摘要)
+# 迭代之间同名的 nep.txt 会被新模型覆盖, 只按路径缓存会一直使用旧模型
+_NEP_CALCULATORS = {}
+
+
+def _get_calculator(nep_file, nep_digest):
+    key = (os.path.abspath(nep_file), nep_digest)
+    calc = _NEP_CALCULATORS.get(key)
+    if calc is None:
+        # 同一路径的旧模型不再使用
+        for old in [k for k in _NEP_CALCULATORS if k[0] == key[0]]:
+            del _NEP_CALCULATORS[old]
+        calc = _NEP_CALCULATORS[key] = NEP(key[0])
+    return calc
+
+
+def _B_projection_chunk(frames, nep_file, nep_digest):
+    """
+    worker: 计算一组结构的 B projection
+    """
+    calc = _get_calculator(nep_file, nep_digest)
+    ret = []
+    for atoms in frames:
         calc.calculate(atoms, ["B_projection"])
-        B_projection = calc.results["B_projection"]
-        for e in active_set_inverse.keys():
-            index = [
-                ii for ii in range(len(atoms)) if atoms.get_chemical_symbols()[ii] == e
-            ]
-            g = B_projection[index] @ active_set_inverse[e]
-            g = np.max(np.abs(g), axis=1)
-            atoms.arrays["gamma"][index] = g
-    return traj
-
-
-def get_B_projections(traj, nep_file):
-    calc = NEP(nep_file)
+        ret.append(np.array(calc.results["B_projection"]))
+    return ret
+
+
+def iter_B_projections(traj, nep_file, cache=None, n_jobs=1, chunk_size=16):
+    """
+    按 traj 顺序逐帧返回 B projection
+    缓存查找和写入在主进程完成, 未命中的结构分块交给进程池计算
+    :param traj: ase Atoms 列表
+    :param nep_file: nep.txt 路径
+    :param cache: BProjectionCache 或 None
+    :param n_jobs: 进程数, 1 为串行, 负数与 joblib 相同 (-1 为所有核)
+    :param chunk_size: 每个任务的结构数
+    :return: generator of np.ndarray (n_atoms, dim)
+    """
+    # worker 的工作目录不随主进程 chdir 改变, 传绝对路径
+    nep_file = os.path.abspath(nep_file)
+    nep_digest = BProjectionCache.nep_digest(nep_file)
+
+    def lookup(frames):
+        keys = [cache.key(atoms, nep_digest) for atoms in frames] if cache is not None else [None] * len(frames)
+        cached = [cache.get(key) for key in keys] if cache is not None else [None] * len(frames)
+        return keys, cached
+
+    def merge(frames, keys, cached, computed):
+        computed = iter(computed)
+        for key, B_projection in zip(keys, cached):
+            if B_projection is None:
+                B_projection = next(computed)
+                if cache is not None:
+                    cache.put(key, B_projection)
+            yield B_projection
+
+    if n_jobs == 1:
+        for start in range(0, len(traj), chunk_size):
+            frames = traj[start: start + chunk_size]
+            keys, cached = lookup(frames)
+            missing = [atoms for atoms, b in zip(frames, cached) if b is None]
+            computed = _B_projection_chunk(missing, nep_file, nep_digest) if missing else []
+            yield from merge(frames, keys, cached, computed)
+        return
+
+    # 每个 block 内并行, block 之间复用同一个进程池 (worker 内势函数不重复加载)
+    block_size = chunk_size * effective_n_jobs(n_jobs) * 4
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for start in range(0, len(traj), block_size):
+            frames = traj[start: start + block_size]
+            keys, cached = lookup(frames)
+            missing = [atoms for atoms, b in zip(frames, cached) if b is None]
+            chunks = [missing[i: i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            results = parallel(delayed(_B_projection_chunk)(chunk, nep_file, nep_digest) for chunk in chunks)
+            computed = [b for result in results for b in result]
+            yield from merge(frames, keys, cached, computed)
+
+
+def get_gamma(traj, nep_file, asi_file, cache=None, n_jobs=1, batch_atoms=200000):
+    """
+    计算每个原子的外推等级 gamma
+    按原子序数分组, 一个 batch 内所有结构拼接后每种元素只做一次矩阵乘法
+    :param traj: ase Atoms 列表, gamma 同时写入 atoms.arrays["gamma"]
+    :param nep_file: nep.txt 路径
+    :param asi_file: active_set.asi 路径, 或已读取的 {element: inverse}
+    :param cache: BProjectionCache 或 None
+    :param n_jobs: B projections 计算进程数
+    :param batch_atoms: 每个 batch 的原子数上限
+    :return: gamma (所有原子按 traj 顺序拼接), gamma_max (每帧最大 gamma)
+    """
+    active_set_inverse = load_asi(asi_file) if isinstance(asi_file, str) else asi_file
+    inverse_numbers = {atomic_numbers[e]: inv for e, inv in active_set_inverse.items()}
+
+    natoms = np.array([len(atoms) for atoms in traj], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(natoms)])
+    gamma = np.zeros(offsets[-1])
+    gamma_max = np.zeros(len(traj))
+
+    def flush(first, last, batch):
+        B_batch = np.concatenate(batch)
+        numbers = np.concatenate([traj[i].numbers for i in range(first, last)])
+        g = gamma[offsets[first]: offsets[last]]
+        for z, inv in inverse_numbers.items():
+            mask = numbers == z
+            if mask.any():
+                g[mask] = np.abs(B_batch[mask] @ inv).max(axis=1)
+        nonempty = natoms[first: last] > 0
+        starts = (offsets[first: last] - offsets[first])[nonempty]
+        if len(starts):
+            gamma_max[first: last][nonempty] = np.maximum.reduceat(g, starts)
+
+    first, batch, batch_size = 0, [], 0
+    B_projections = iter_B_projections(traj, nep_file, cache, n_jobs)
+    for index, B_projection in enumerate(tqdm(B_projections, total=len(traj))):
+        batch.append(B_projection)
+        batch_size += len(B_projection)
+        if batch_size >= batch_atoms:
+            flush(first, index + 1, batch)
+            first, batch, batch_size = index + 1, [], 0
+    if batch:
+        flush(first, len(traj), batch)
+
+    for index, atoms in enumerate(traj):
+        atoms.arrays["gamma"] = gamma[offsets[index]: offsets[index + 1]]
+    if cache is not None:
+        cache.report()
+    return gamma, gamma_max
+
+
+def read_nep_parameters(nep_file):
+    """
+    读取 nep.txt, 拆分为表头 (模型结构) 和参数向量
+    :param nep_file: nep.txt 路径
+    :return: header list, parameters np.ndarray
+    """
+    header, parameters = [], []
+    with open(nep_file) as f:
+        for line in f:
+            items = line.split()
+            if len(items) == 1:
+                try:
+                    parameters.append(float(items[0]))
+                    continue
+                except ValueError:
+                    pass
+            header.append(" ".join(items))
+    return header, np.array(parameters)
+
+
+def nep_change(old_nep_file, new_nep_file):
+    """
+    两个势函数参数的相对变化 ||new - old|| / ||old||
+    模型结构不同时 B projections 不可比较, 返回 inf
+    :param old_nep_file: 旧 nep.txt
+    :param new_nep_file: 新 nep.txt
+    :return: float
+    """
+    old_header, old_parameters = read_nep_parameters(old_nep_file)
+    new_header, new_parameters = read_nep_parameters(new_nep_file)
+    if old_header != new_header or old_parameters.shape != new_parameters.shape:
+        return np.inf
+    norm = np.linalg.norm(old_parameters)
+    if norm == 0:
+        return np.inf
+    return np.linalg.norm(new_parameters - old_parameters) / norm
+
+
+def get_B_projections(traj, nep_file, cache=None, n_jobs=1, store_dir=None, dtype=np.float64):
+    """
+    计算 B projections, 按元素写入预分配矩阵
+    :param traj: ase Atoms 列表
+    :param nep_file: nep.txt 路径
+    :param cache: BProjectionCache 或 None
+    :param n_jobs: 进程数
+    :param store_dir: 不为 None 时矩阵写入该目录下的内存映射文件 B_{element}.npy, 不占用内存
+    :param dtype: 矩阵存储精度, np.float64 或 np.float32
+    :return: B_projections, B_projections_struct_index
+    """
     with open(nep_file) as f:
         first_line = f.readline()
         elements = first_line.split(" ")[2:-1]
         print(f"Elements in the NEP potential: {elements}")
 
-    B_projections = {e: [] for e in elements}
-    B_projections_struct_index = {e: [] for e in elements}
+    # 预先统计每种元素的原子环境数, 结果直接写入预分配矩阵
+    symbols = [np.array(atoms.get_chemical_symbols()) for atoms in traj]
+    counts = {e: sum(int((s == e).sum()) for s in symbols) for e in elements}
+    B_projections = {}
+    B_projections_struct_index = {e: np.empty(counts[e], dtype=int) for e in elements}
+    cursor = {e: 0 for e in elements}
+
     print("Calculating B projections...")
-    for index, atoms in enumerate(tqdm(traj)):
-        calc.calculate(atoms, ["B_projection"])
-        B_projection = calc.results["B_projection"]
-        for b, e in zip(B_projection, atoms.get_chemical_symbols()):
-            B_projections[e].append(b)
-            B_projections_struct_index[e].append(index)
+    B_iter = iter_B_projections(traj, nep_file, cache, n_jobs)
+    for index, B_projection in enumerate(tqdm(B_iter, total=len(traj))):
+        if not B_projections:
+            shapes = {e: (counts[e], B_projection.shape[1]) for e in elements}
+            if store_dir is None:
+                B_projections = {e: np.empty(shapes[e], dtype=dtype) for e in elements}
+            else:
+                os.makedirs(store_dir, exist_ok=True)
+                B_projections = {
+                    e: np.lib.format.open_memmap(f"{store_dir}/B_{e}.npy", mode="w+", dtype=dtype, shape=shapes[e])
+                    for e in elements
+                }
+        for e in elements:
+            mask = symbols[index] == e
+            n = int(mask.sum())
+            if n == 0:
+                continue
+            B_projections[e][cursor[e]: cursor[e] + n] = B_projection[mask]
+            B_projections_struct_index[e][cursor[e]: cursor[e] + n] = index
+            cursor[e] += n
 
-    B_projections_struct_index = {
-        e: np.array(i) for e, i in B_projections_struct_index.items()
-    }
+    if cache is not None:
+        cache.report()
 
     print("Shape of the B matrix:")
     for e, b in B_projections.items():
-        B_projections[e] = np.vstack(b)
-        print(f"{e}: {B_projections[e].shape}")
+        if isinstance(b, np.memmap):
+            b.flush()
+        print(f"{e}: {b.shape}")
         assert (
-            B_projections[e].shape[0] >= B_projections[e].shape[1]
+            b.shape[0] >= b.shape[1]
         ), f"Not enough environments for {e}."
 
     return B_projections, B_projections_struct_index
@@ -70,15 +253,35 @@ def get_active_set(
     write_asi=True,
     batch_size=10000,
     mode="GPU",
-    out_dir=None
+    out_dir=None,
+    dtype=np.float64,
+    n_jobs=1,
+    engine="maxvol",
 ):
     print("Performing MaxVol...")
+    # 各元素的 MaxVol 互不相关, 多元素体系按元素并行, 环境数多的元素先提交
+    elements = sorted(B_projections, key=lambda e: len(B_projections[e]), reverse=True)
+    n_workers = min(effective_n_jobs(n_jobs), len(elements))
+
+    kwargs = dict(batch_size=batch_size, mode=mode, dtype=dtype, engine=engine)
+
+    if n_workers > 1:
+        # 按进程划分 BLAS 线程数, 避免超额订阅
+        threads = max(1, (os.cpu_count() or 1) // n_workers)
+        print(f"MaxVol on {n_workers} elements concurrently, {threads} BLAS threads each")
+        with parallel_config(backend="loky", inner_max_num_threads=threads):
+            results = Parallel(n_jobs=n_workers)(
+                delayed(calculate_maxvol)(B_projections[e], B_projections_struct_index[e], **kwargs)
+                for e in elements
+            )
+    else:
+        results = [calculate_maxvol(B_projections[e], B_projections_struct_index[e], **kwargs) for e in elements]
+    results = dict(zip(elements, results))
+
     active_set = {}
     active_set_struct = []  # the index of structure
-    for e, b in B_projections.items():
-        A, selected_index = calculate_maxvol(
-            b, B_projections_struct_index[e], batch_size=batch_size, mode=mode
-        )
+    for e in B_projections:
+        A, selected_index = results[e]
         active_set[e] = A
         active_set_struct.extend(selected_index)
         print("Shape of the active set:")
@@ -93,5 +296,7 @@ def get_active_set(
     if write_asi:
         print("Saving active set inverse...")
         save_asi(active_set_inv, out_dir+"/active_set.asi")
+        # 二进制副本, load_asi 优先 mmap 读取
+        save_asi_binary(active_set_inv, asi_sidecar_path(out_dir+"/active_set.asi"))
 
     return active_set_inv, active_set_struct
\ No newline at end of file
@@ -7,4 +7,4 @@
 @Date ：2025/5/4 18:08
 @E-mail ：2071914258@qq.com
 """
-from .shift_energy import shift_energy
\ No newline at end of file
+from .shift_energy import shift_energy, ShiftStats
\ No newline at end of file
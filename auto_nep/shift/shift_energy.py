@@ -7,8 +7,16 @@
 @Date ：2025/5/2 13:01
 @E-mail ：2071914258@qq.com
 """
+import os
+
 import numpy as np
-from ase.io import read, write
+from ase.data import atomic_numbers, chemical_symbols
+from ase.io import iread, write
+from ase.io.extxyz import key_val_str_to_dict
+
+# 组成按原子序数计数, 不需要预先知道数据集中的元素
+N_Z = len(chemical_symbols)
+
 
 def SVD_A(A, b):
     """
@@ -24,65 +32,208 @@ def SVD_A(A, b):
     return x
 
 
-def shift_energy(xyz, filename="shifted.xyz"):
+def iter_composition(xyz):
+    """
+    逐帧读取原子序数和能量, 只解析表头和元素列
+    :param xyz: xyz 文件
+    :return: generator of (原子序数 array, 能量)
+    """
+    with open(xyz) as f:
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            natoms = int(line)
+            info = key_val_str_to_dict(f.readline())
+            # 与 ase 一致: energy 为计算器能量, 否则取 Energy
+            energy = info["energy"] if "energy" in info else info["Energy"]
+            props = info.get("Properties", "species:S:1:pos:R:3").split(":")
+            col = 0
+            for name, _, n in zip(props[::3], props[1::3], props[2::3]):
+                if name == "species":
+                    break
+                col += int(n)
+            numbers = [atomic_numbers[f.readline().split()[col]] for _ in range(natoms)]
+            yield np.array(numbers), float(energy)
+
+
+class ShiftStats:
+    """
+    能量平移最小二乘的充分统计量 CᵀC, Cᵀe, 按原子序数累加, 内存与结构数无关
+    另外累加 C 的 QR 分解的 R (C = QR), 秩按 C 的奇异值判断:
+    CᵀC 的特征值是奇异值的平方, 舍入误差下无法区分精确欠定和条件数 1e8 的组成矩阵
+    """
+
+    def __init__(self):
+        self.r = np.zeros((0, N_Z))
+        self.gram = np.zeros((N_Z, N_Z))
+        self.rhs = np.zeros(N_Z)
+        self.counts = np.zeros(N_Z, dtype=np.int64)
+        self.n_frames = 0
+        self.energy_sum = 0.0
+
+    def save(self, path):
+        """
+        保存统计量, 下一次迭代只需累加新增结构
+        :param path: npz 文件
+        :return: None
+        """
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, r=self.r, gram=self.gram, rhs=self.rhs, counts=self.counts,
+                 n_frames=self.n_frames, energy_sum=self.energy_sum)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: save 保存的 npz 文件
+        :return: ShiftStats, 旧版本文件 (没有 R) 的 r 为 None
+        """
+        stats = cls()
+        with np.load(path) as data:
+            stats.r = data["r"] if "r" in data.files else None
+            stats.gram = data["gram"]
+            stats.rhs = data["rhs"]
+            stats.counts = data["counts"]
+            stats.n_frames = int(data["n_frames"])
+            stats.energy_sum = float(data["energy_sum"])
+        return stats
+
+    def add(self, numbers, energies):
+        """
+        累加一批结构
+        :param numbers: 每个结构的原子序数 list
+        :param energies: 每个结构的能量
+        :return: None
+        """
+        if not len(numbers):
+            return
+        energies = np.asarray(energies, dtype=float)
+        frame = np.repeat(np.arange(len(numbers)), [len(n) for n in numbers])
+        composition = np.bincount(frame * N_Z + np.concatenate(numbers),
+                                  minlength=len(numbers) * N_Z).reshape(len(numbers), N_Z).astype(float)
+        self.r = np.linalg.qr(np.vstack([self.r, composition]), mode="r")
+        self.gram += composition.T @ composition
+        self.rhs += composition.T @ energies
+        self.counts += composition.sum(axis=0).astype(np.int64)
+        self.n_frames += len(numbers)
+        self.energy_sum += energies.sum()
+
+    def update(self, xyz, batch_size=4096):
+        """
+        流式读取 xyz 并累加
+        :param xyz: xyz 文件
+        :param batch_size: 每批结构数
+        :return: 读取的结构数
+        """
+        n_frames = self.n_frames
+        numbers, energies = [], []
+        for z, e in iter_composition(xyz):
+            numbers.append(z)
+            energies.append(e)
+            if len(numbers) == batch_size:
+                self.add(numbers, energies)
+                numbers, energies = [], []
+        self.add(numbers, energies)
+        return self.n_frames - n_frames
+
+    @property
+    def elements(self):
+        """
+        :return: 出现的元素 (按元素符号排序) 及其原子序数
+        """
+        z = sorted(np.flatnonzero(self.counts), key=lambda i: chemical_symbols[i])
+        return [chemical_symbols[i] for i in z], np.array(z, dtype=int)
+
+    def solve(self):
+        """
+        在 k×k 正规方程上求解每种元素的参考能量
+        :return: 元素, 参考能量, 是否欠定
+        """
+        elements, z = self.elements
+        k = len(z)
+        if k == 0:
+            return elements, np.zeros(0), False
+        gram = self.gram[np.ix_(z, z)]
+        # 与原实现 np.linalg.matrix_rank(composition_matrix) 相同的容差
+        sv = np.linalg.svd(self.r[:, z], compute_uv=False)
+        tol = sv.max() * max(self.n_frames, k) * np.finfo(float).eps
+        underdetermined = int((sv > tol).sum()) < k
+        if underdetermined:
+            # 与原实现相同: 每对元素添加约束 x_i - x_j = 0, 即 CᵀC 加上 k*I - 11ᵀ
+            gram = gram + k * np.eye(k) - np.ones((k, k))
+        x = np.linalg.lstsq(gram, self.rhs[z], rcond=None)[0]
+        return elements, x, underdetermined
+
+    def reference(self):
+        """
+        :return: 按原子序数索引的参考能量 (N_Z, )
+        """
+        _, z = self.elements
+        _, x, _ = self.solve()
+        ref = np.zeros(N_Z)
+        ref[z] = x
+        return ref
+
+
+def write_shifted(xyz, filename, reference):
+    """
+    第二遍: 逐帧平移能量并写出, 可以原地覆盖 xyz
+    :param xyz: 未平移的 xyz 文件
+    :param filename: 输出文件
+    :param reference: 按原子序数索引的参考能量
+    :return: 平移后能量的平均值, 绝对值最大值
+    """
+    # 平移后能量之和, 绝对值最大值, 结构数
+    summary = [0.0, 0.0, 0]
+
+    def frames():
+        for atoms in iread(xyz, index=":", format="extxyz"):
+            # 直接取计算器结果, 避免 get_forces 的拷贝
+            results = atoms.calc.results if atoms.calc is not None else {}
+            energy = results["energy"] if "energy" in results else atoms.info["Energy"]
+            if "forces" in results:
+                atoms.new_array('forces', results["forces"])
+            atoms.calc = None
+            shifted = energy - reference[atoms.numbers].sum()
+            atoms.info['energy'] = shifted
+            summary[0] += shifted
+            summary[1] = max(summary[1], abs(shifted))
+            summary[2] += 1
+            yield atoms
+
+    tmp = f"{filename}.tmp"
+    with open(tmp, "w") as f:
+        write(f, frames(), format="extxyz")
+    os.replace(tmp, filename)
+    if summary[2] == 0:
+        return 0.0, 0.0
+    return summary[0] / summary[2], summary[1]
+
+
+def shift_energy(xyz, filename="shifted.xyz", stats=None):
     """
-    能量平移
+    能量平移, 两遍流式读取: 第一遍累加 CᵀC 和 Cᵀe, 第二遍写出平移后的结构
     :param xyz: xyz 文件
-    :return: None
+    :param filename: 输出文件
+    :param stats: 已包含 xyz 全部结构的 ShiftStats, 给出时跳过第一遍
+    :return: ShiftStats
     """
-    # 读取所有帧
-    all_frames = read(xyz, index=":")
-
-    # 提取所有唯一的元素
-    flatten_comprehension = lambda matrix: [item for row in matrix for item in row]
-    all_elements = sorted(set(flatten_comprehension([i.get_chemical_symbols() for i in all_frames])))
-
-    # 初始化组成矩阵和能量矩阵
-    composition_matrix = np.zeros((len(all_frames), len(all_elements)))
-    energy_matrix = np.zeros((len(all_frames), 1))
-
-    # 获取每一帧内 各个元素出现的次数 composition_matrix 以及结构能量
-    for i in range(len(all_frames)):
-        for j in range(len(all_elements)):
-            composition_matrix[i][j] = all_frames[i].get_chemical_symbols().count(all_elements[j])
-        try:
-            energy_matrix[i][0] = all_frames[i].get_potential_energy()
-        except RuntimeError:
-            energy_matrix[i][0] = all_frames[i].info["Energy"]
-
-    # 如果矩阵的秩小于列数 欠定 需要添加约束使矩阵可解
-    if np.linalg.matrix_rank(composition_matrix) < len(all_elements):
+    if stats is None:
+        stats = ShiftStats()
+        stats.update(xyz)
+    elements, x, underdetermined = stats.solve()
+    if underdetermined:
         print("Warning! The composition_matrix is underdetermined, adding constrains....")
-        number_of_constrains = len(all_elements) - np.linalg.matrix_rank(composition_matrix)
-        import itertools
-        to_add_constrain_pairs = []
-        for i in itertools.combinations(range(len(all_elements)), 2):
-            additional_matrix = np.zeros(len(all_elements))
-            additional_matrix[i[0]] = 1
-            additional_matrix[i[1]] = -1
-            additional_energy = np.zeros(1)
-            composition_matrix = np.r_[composition_matrix, [additional_matrix]]
-            energy_matrix = np.r_[energy_matrix, [additional_energy]]
 
     # 计算每个原子的基态能量
-    atomic_shifted_energy = SVD_A(composition_matrix, energy_matrix)
-    for i in range(len(all_elements)):
-        print("%s:%f" % (all_elements[i], atomic_shifted_energy[i][0]), end=' ')
-
-    # 平移后能量 = 平移前能量 - composition_matrix(m, 3) @ atomic_shifted_energy(3, 1)
-    shifted_energy = (energy_matrix - np.matmul(composition_matrix, atomic_shifted_energy)).flatten()
-
-    print(f"\nAveraged energies now: {shifted_energy.mean():.10f} eV.")
-    print(f"Absolute maximum energy now: {max(abs(shifted_energy)):.10f} eV.")
-
-    # 输出所有帧
-    for i in range(len(all_frames)):
-        try:
-            forces = all_frames[i].get_forces()
-            all_frames[i].new_array('forces', forces)
-        except:
-            pass
-        all_frames[i].calc = None
-        all_frames[i].info['energy'] = shifted_energy[i]
-    write(filename, all_frames)
+    for element, e in zip(elements, x):
+        print("%s:%f" % (element, e), end=' ')
 
+    # 平移后能量 = 平移前能量 - 组成 @ 参考能量
+    mean, max_abs = write_shifted(xyz, filename, stats.reference())
+    print(f"\nAveraged energies now: {mean:.10f} eV.")
+    print(f"Absolute maximum energy now: {max_abs:.10f} eV.")
+    return stats
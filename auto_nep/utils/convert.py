@@ -9,9 +9,25 @@
 """
 
 from ase.io import read, write
+from joblib import Parallel, delayed
 from tqdm import tqdm
+import io
 import os
 import re
+import time
+
+from auto_nep.utils.xyz_stream import scan_frames
+
+
+def _find_file(element_type, files, suffix):
+    """
+    以元素类型开头, 以 suffix 结尾的第一个文件
+    """
+    pattern = re.compile(rf'^{element_type}[._].*{suffix}$')
+    for filename in files:
+        if pattern.match(filename):
+            return filename
+    return None
 
 
 def find_pp_basis(elements_list, pp_path, basis_path):
@@ -21,41 +37,124 @@ def find_pp_basis(elements_list, pp_path, basis_path):
     :return:
     """
     pp, basis = {}, {}
+    pp_files, basis_files = os.listdir(pp_path), os.listdir(basis_path)
 
-    for index, element_type in enumerate(elements_list):
-        pp_flag, basis_flag = False, False  # 标志位
-        # pp_pattern: 以元素类型开头, 以.upf结尾
-        pp_pattern = rf'^{element_type}[._].*upf$'
-        # basis_pattern: 以元素类型开头, 以.orb结尾
-        basis_pattern = rf'^{element_type}[._].*orb$'
-
-        for filename in os.listdir(pp_path):
-            if re.match(pp_pattern, filename):
-                pp[f'{element_type}'] = filename
-                pp_flag = True
-                break
-
-        for filename in os.listdir(basis_path):
-            if re.match(basis_pattern, filename):
-                basis[f'{element_type}'] = filename
-                basis_flag = True
-                break
-
-        if pp_flag is False:
+    for element_type in elements_list:
+        # pp: 以元素类型开头, 以.upf结尾; basis: 以元素类型开头, 以.orb结尾
+        pp_file = _find_file(element_type, pp_files, 'upf')
+        basis_file = _find_file(element_type, basis_files, 'orb')
+        if pp_file is None:
             print(f'未找到 {element_type} 赝势文件, 请检查 {pp_path}')
             exit()
-        if basis_flag is False:
+        if basis_file is None:
             print(f'未找到 {element_type} 轨道文件, 请检查 {basis_path}')
             exit()
+        pp[f'{element_type}'] = pp_file
+        basis[f'{element_type}'] = basis_file
     print(f'赝势文件: {pp}')
     print(f'轨道文件: {basis}')
     return pp, basis
 
 
-def convert_format(xyz):
+class PPBasisLookup:
+    """
+    赝势/轨道文件查找: 目录只列出一次, 每种元素组合只匹配一次
+    可以传入已确定的 pp / basis, 也可以传给子进程使用
+    """
+    def __init__(self, pp_path=None, basis_path=None, pp=None, basis=None):
+        self.pp_path = pp_path
+        self.basis_path = basis_path
+        self.pp = dict(pp or {})
+        self.basis = dict(basis or {})
+        self.pp_files = os.listdir(pp_path) if pp_path is not None else []
+        self.basis_files = os.listdir(basis_path) if basis_path is not None else []
+        self.cache = {}
+
+    def get(self, elements):
+        """
+        :param elements: 元素符号 (可重复)
+        :return: (pp, basis) 只包含这些元素
+        :raise FileNotFoundError: 找不到某个元素的文件
+        """
+        key = frozenset(elements)
+        if key not in self.cache:
+            for element_type in sorted(key - self.pp.keys()):
+                pp_file = _find_file(element_type, self.pp_files, 'upf')
+                if pp_file is None:
+                    raise FileNotFoundError(f'未找到 {element_type} 赝势文件, 请检查 {self.pp_path}')
+                self.pp[element_type] = pp_file
+            for element_type in sorted(key - self.basis.keys()):
+                basis_file = _find_file(element_type, self.basis_files, 'orb')
+                if basis_file is None:
+                    raise FileNotFoundError(f'未找到 {element_type} 轨道文件, 请检查 {self.basis_path}')
+                self.basis[element_type] = basis_file
+            self.cache[key] = ({e: self.pp[e] for e in sorted(key)}, {e: self.basis[e] for e in sorted(key)})
+        return self.cache[key]
+
+
+def _write_stru_batch(xyz, ranges, out_dirs, lookup):
+    """
+    子进程: 按字节范围读取结构并写入 STRU
+    :return: 写入的结构数, 出现的元素
+    """
+    elements = set()
+    with open(xyz, "rb") as f:
+        for (start, end), out_dir in zip(ranges, out_dirs):
+            f.seek(start)
+            atoms = read(io.StringIO(f.read(end - start).decode()), format="extxyz")
+            symbols = atoms.get_chemical_symbols()
+            elements.update(symbols)
+            pp, basis = lookup.get(symbols)
+            os.makedirs(out_dir, exist_ok=True)
+            write(os.path.join(out_dir, "STRU"), atoms, format='abacus', pp=pp, basis=basis)
+    return len(ranges), elements
+
+
+def write_stru_dataset(xyz, out_dir, lookup, n_jobs=1, batch_size=64, progress=False):
+    """
+    一次扫描 xyz 文件, 每个结构写入一个 STRU, 按批分给进程池
+    主进程只按表头切分字节范围, 结构的解析和写入都在子进程中
+    :param xyz: extxyz 文件
+    :param out_dir: out_dir(i) -> 第 i 个结构 (从 1 开始) 的目录
+    :param lookup: PPBasisLookup
+    :param n_jobs: 进程数
+    :param batch_size: 每批结构数
+    :param progress: 是否显示进度条
+    :return: 结构目录列表, 出现的元素
+    """
+    dirs = []
+
+    def batches():
+        with open(xyz, "rb") as f:
+            ranges = []
+            for start, end in scan_frames(f):
+                ranges.append((start, end))
+                dirs.append(out_dir(len(dirs) + 1))
+                if len(ranges) == batch_size:
+                    yield ranges, dirs[-batch_size:]
+                    ranges = []
+            if ranges:
+                yield ranges, dirs[-len(ranges):]
+
+    if n_jobs == 1:
+        results = (_write_stru_batch(xyz, ranges, batch_dirs, lookup) for ranges, batch_dirs in batches())
+    else:
+        results = Parallel(n_jobs=n_jobs, return_as="generator")(
+            delayed(_write_stru_batch)(xyz, ranges, batch_dirs, lookup) for ranges, batch_dirs in batches()
+        )
+    elements = set()
+    with tqdm(unit="struct", disable=not progress) as bar:
+        for count, batch_elements in results:
+            elements.update(batch_elements)
+            bar.update(count)
+    return dirs, elements
+
+
+def convert_format(xyz, n_jobs=1):
     """
     转换 xyz 文件变成 abacus 的 STRU 文件
     :param xyz: xyz 文件路径
+    :param n_jobs: 写 STRU 的进程数
     :return:
     """
     # 获取用户文件夹路径
@@ -85,14 +184,17 @@ def convert_format(xyz):
     print(f"pp_path: {pp_path_value}")
     print(f"basis_path: {basis_path_value}")
 
-    all_frames = read(xyz, index=":")
-    print(len(all_frames))
-    # 展平 获取元素
-    flatten_comprehension = lambda matrix: [item for row in matrix for item in row]
-    elements_list = sorted(set(flatten_comprehension([i.get_chemical_symbols() for i in all_frames])))
-    pp, basis = find_pp_basis(elements_list, pp_path_value, basis_path_value)
-
-    for i in tqdm(range(1, len(all_frames) + 1)):
-        os.makedirs(f"./xyz2abacus/{i}", exist_ok=True)
-        write(f"./xyz2abacus/{i}/STRU", all_frames[i-1], format='abacus', pp=pp, basis=basis)
+    # 流式读取, 元素组合第一次出现时查找赝势和轨道文件
+    lookup = PPBasisLookup(pp_path_value, basis_path_value)
+    start = time.perf_counter()
+    try:
+        dirs, elements = write_stru_dataset(xyz, lambda i: f"./xyz2abacus/{i}", lookup, n_jobs, progress=True)
+    except FileNotFoundError as e:
+        print(e)
+        exit()
+    elapsed = time.perf_counter() - start
+    pp, basis = lookup.get(elements)
+    print(f'赝势文件: {pp}')
+    print(f'轨道文件: {basis}')
+    print(f"{len(dirs)} 个结构, 用时 {elapsed:.1f} s, {len(dirs) / max(elapsed, 1e-9):.0f} 结构/s")
     print("格式转换完成!")
@@ -11,11 +11,75 @@ from ase.io import read, write
 import numpy as np
 
 
+def fingerprint(atoms, precision=0):
+    """
+    结构的规范指纹: 原子数, 元素, 按 precision 取整后的坐标 (与原逐个比较相同, 不包含晶胞)
+    :param atoms: Atoms
+    :param precision: 小数位数
+    :return: tuple 可作为 dict 的 key
+    """
+    # + 0.0 把 -0.0 归一为 0.0, 否则两者的字节不同
+    positions = np.around(atoms.get_positions(), precision) + 0.0
+    return len(atoms), atoms.numbers.tobytes(), positions.tobytes()
+
+
+class StructureIndex:
+    """
+    数据集结构索引, 只建立一次:
+    指纹哈希 O(1) 精确匹配, 找不到时与原实现相同, 在相同 (原子数, 元素) 的结构中
+    取第一个取整后至少 99% 的坐标相等的结构作为近似匹配, 整组一次比较
+    """
+    SIMILARITY = 0.99
+
+    def __init__(self, frames, precision=0):
+        """
+        :param frames: 数据集 Atoms list
+        :param precision: 坐标取整的小数位数
+        """
+        self.precision = precision
+        self.exact = {}
+        self.groups = {}
+        self.arrays = {}
+        for index, atoms in enumerate(frames):
+            # 相同指纹保留第一个, 与顺序查找一致
+            key = fingerprint(atoms, precision)
+            self.exact.setdefault(key, index)
+            group = self.groups.setdefault(key[:2], ([], []))
+            group[0].append(index)
+            group[1].append(np.frombuffer(key[2]))
+
+    def _group(self, key):
+        # 取整坐标矩阵只在需要近似匹配时按组建立
+        if key not in self.arrays:
+            indices, positions = self.groups[key]
+            self.arrays[key] = np.array(indices), np.array(positions)
+        return self.arrays[key]
+
+    def find(self, atoms):
+        """
+        :param atoms: 待查找的结构
+        :return: (数据集中的序号, 是否精确匹配), 找不到返回 (None, False)
+        """
+        key = fingerprint(atoms, self.precision)
+        index = self.exact.get(key)
+        if index is not None:
+            return index, True
+        if key[:2] not in self.groups:
+            return None, False
+        indices, positions = self._group(key[:2])
+        ratio = np.mean(positions == np.frombuffer(key[2]), axis=1)
+        hits = np.flatnonzero(ratio >= self.SIMILARITY)
+        if not len(hits):
+            return None, False
+        return int(indices[hits[0]]), False
+
+
 def find_struc(train_xyz, dataset, precision=0):
     """
     从数据集里面找 train.xyz
     :param train_xyz:
     :param dataset:
+    :param precision: 坐标比较的小数位数
     :return:
     """
     shifted_xyz = read(train_xyz, format='extxyz', index=':')
@@ -26,60 +90,29 @@ def find_struc(train_xyz, dataset, precision=0):
     print("shifted_xyz length:", len1)
     print("no_shifted_xyz length:", len2)
 
-    # no_shifted_xyz -> shifted_xyz:
-    # shifted_index (0, 439)
-
-    # if no_shifted_xyz[no_shifted_index] = shifted_xyz[shifted_index] : ok
-    # else no_shifted_index += 1
-
-    # # test
-    # test1 = np.around(shifted_xyz[1].get_positions(), 3)
-    # test2 = np.around(no_shifted_xyz[2].get_positions(), 3)
-    # print((test1 == test2).all())
+    # 对 no_shifted_xyz 建立一次索引, 每个 shifted_xyz 结构查找一次
+    index = StructureIndex(no_shifted_xyz, precision)
 
     total_index = []
-    no_in1 = []
     no_in2 = []
-    for shifted_index in range(len1):
-        # 初始化 pos1 pos2 no_shifted_index
-        no_shifted_index = 0
-        pos1 = np.around(shifted_xyz[shifted_index].get_positions(), precision)
-        pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
-
-        while True:
-            if len(pos1) != len(pos2):
-                if no_shifted_index < len(no_shifted_xyz) - 1:
-                    no_shifted_index += 1
-                    pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
-                else:
-                    no_in2.append(shifted_index)
-                    print("skip")
-                    break
+    with open("./index.txt", "a") as f:
+        for shifted_index, atoms in enumerate(shifted_xyz):
+            no_shifted_index, exact = index.find(atoms)
+            if no_shifted_index is None:
+                no_in2.append(shifted_index)
+                print("skip")
+                continue
+            if exact:
+                f.write(f"shifted_index: {shifted_index} -> no_shifted_index: {no_shifted_index}\n")
             else:
-                # 位置一样 跳出循环
-                if ((pos1 == pos2).all()):
-                    with open("./index.txt", "a") as f:
-                        f.write(f"shifted_index: {shifted_index} -> no_shifted_index: {no_shifted_index}\n")
-                    total_index.append(no_shifted_index)
-                    break
-                else:
-                    same_elements = np.sum(pos1 == pos2)
-                    total_elements = pos1.size
-                    similarity_ratio = same_elements / total_elements
-                    if similarity_ratio >= 0.99:
-                        print(f"{shifted_index} ~ {no_shifted_index} {similarity_ratio}% 的元素相同")
-                        total_index.append(no_shifted_index)
-                        break
-                    if no_shifted_index < len(no_shifted_xyz) - 1:
-                        no_shifted_index += 1
-                        pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
-                    else:
-                        no_in2.append(shifted_index)
-                        print("skip")
-                        break
-    for i in range(len2):
-        if i not in total_index:
-            no_in1.append(i)
+                pos1 = np.around(atoms.get_positions(), precision)
+                pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
+                similarity_ratio = np.sum(pos1 == pos2) / pos1.size
+                print(f"{shifted_index} ~ {no_shifted_index} {similarity_ratio}% 的元素相同")
+            total_index.append(no_shifted_index)
+
+    found = set(total_index)
+    no_in1 = [i for i in range(len2) if i not in found]
     select_no_shifted_xyz = [no_shifted_xyz[index] for index in total_index]
     no_in1_xyz = [no_shifted_xyz[index] for index in no_in1]
     no_in2_xyz = [shifted_xyz[index] for index in no_in2]
@@ -87,4 +120,3 @@ def find_struc(train_xyz, dataset, precision=0):
     write('./no_in1.xyz', no_in1_xyz, format='extxyz')
     write('./no_in2.xyz', no_in2_xyz, format='extxyz')
     print("OK!Write find_no_shifted.xyz")
-
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：xyz_stream.py
+@Author ：RongYi
+@Date ：2025/6/29 10:05
+@E-mail ：2071914258@qq.com
+"""
+import os
+
+import numpy as np
+
+
+def scan_frames(f, offset=0, chunk_size=1 << 26):
+    """
+    按 extxyz 表头 (原子数行) 扫描完整的结构, 不解析坐标
+    :param f: 二进制模式打开的文件
+    :param offset: 起始字节位置 (必须是结构开头)
+    :param chunk_size: 每次读取字节数
+    :return: generator of (start, end) 每个完整结构的字节范围, 末尾不完整的结构不返回
+    """
+    f.seek(offset)
+    buf, base = b"", offset
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        buf += data
+        nl = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)
+        pos, k = 0, 0
+        while k < len(nl):
+            header = buf[pos: nl[k]].strip()
+            if not header:
+                # 结构之间的空行
+                pos, k = nl[k] + 1, k + 1
+                continue
+            try:
+                natoms = int(header)
+            except ValueError:
+                raise ValueError(f"Invalid extxyz header at byte {base + pos}: {header[:50]!r}")
+            last = k + natoms + 1  # 原子数行 + 注释行 + natoms 行
+            if last >= len(nl):
+                break
+            end = int(nl[last]) + 1
+            yield base + pos, base + end
+            pos, k = end, last + 1
+        buf, base = buf[pos:], base + pos
+
+
+def count_frames(path):
+    """
+    extxyz 文件中完整结构的个数
+    """
+    with open(path, "rb") as f:
+        return sum(1 for _ in scan_frames(f))
+
+
+class FrameCounter:
+    """
+    增量统计正在写入的 extxyz 文件的结构数
+    每次 update 只读取上次最后一个完整结构之后新写入的字节
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0  # 最后一个完整结构的结束位置
+        self.count = 0
+
+    def update(self):
+        if not os.path.exists(self.path):
+            return self.count
+        with open(self.path, "rb") as f:
+            for _, end in scan_frames(f, self.offset):
+                self.count += 1
+                self.offset = end
+        return self.count
+
+    def truncate(self):
+        """
+        截断到最后一个完整结构
+        """
+        self.update()
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.offset:
+            os.truncate(self.path, self.offset)
+
+
+def sample_frames(path, k, seed=10, output=None, chunk_size=1 << 24):
+    """
+    蓄水池抽样: 一次扫描随机选取 k 个结构, 按原顺序逐字节复制到输出文件
+    只保存 k 个字节范围, 内存与文件大小无关, 不重新格式化浮点数
+    :param path: extxyz 文件
+    :param k: 选取的结构数
+    :param seed: 随机数种子
+    :param output: 输出文件, None 为原地替换
+    :return: 结构总数, 写入的结构数
+    """
+    rng = np.random.default_rng(seed)
+    reservoir = []
+    count = 0
+    with open(path, "rb") as f:
+        for start, end in scan_frames(f):
+            if count < k:
+                reservoir.append((start, end))
+            else:
+                j = rng.integers(0, count + 1)
+                if j < k:
+                    reservoir[j] = (start, end)
+            count += 1
+    if count <= k and output is None:
+        return count, count
+
+    output = path if output is None else output
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        for start, end in sorted(reservoir):
+            src.seek(start)
+            remain = end - start
+            while remain > 0:
+                block = src.read(min(chunk_size, remain))
+                if not block:
+                    break
+                dst.write(block)
+                remain -= len(block)
+    os.replace(tmp, output)
+    return count, len(reservoir)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：watcher.py
+@Author ：RongYi
+@Date ：2025/6/26 09:12
+@E-mail ：2071914258@qq.com
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+from auto_nep.scheduler.scheduler import QUEUED, RUNNING, FINISHED
+
+# inotify 常量 (linux/inotify.h)
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class _Inotify:
+    """
+    ctypes 封装的 inotify, 只用于唤醒: 共享文件系统上其他节点写入的文件不一定产生事件,
+    任务状态始终以 stat 结果为准
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add(self, path):
+        if path in self.watches:
+            return True
+        wd = self._add_watch(self.fd, os.fsencode(path), IN_CREATE | IN_MOVED_TO)
+        if wd < 0:
+            return False
+        self.watches[path] = wd
+        return True
+
+    def remove(self, path):
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self._rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """
+        等待事件或超时, 返回读到的事件数
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return 0
+        events = 0
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            # struct inotify_event: int wd; uint32 mask, cookie, len; char name[len]
+            offset = 0
+            while offset < len(buf):
+                name_len = int.from_bytes(buf[offset + 12: offset + 16], "little")
+                offset += 16 + name_len
+                events += 1
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TaskWatcher:
+    """
+    任务完成检测
+    每个任务目录的状态: waiting (无 running_file) -> running (有 running_file) -> done (有 done_file)
+    给定调度后端和作业号时, 作业已结束但没有 done_file 的任务先记为 finished (未确认),
+    共享文件系统 (NFS/Lustre) 上 done_file 可能延迟可见, 在 grace_period 内继续检测, 超时仍没有才记为 failed;
+    grace_period 内继续查询调度器, 作业仍被列出时回到 running, 调度器状态未知 (查询失败) 时保持原状态
+    每轮只 stat 未完成的任务, 状态无变化时检测间隔按 2 倍增长 (min_interval -> max_interval),
+    有 inotify 时新文件产生会提前唤醒
+    """
+    WAITING = "waiting"
+    RUNNING = "running"
+    FINISHED = "finished"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, tasks, done_file="DONE", running_file="out.log",
+                 min_interval=1, max_interval=60, use_inotify=True, scheduler=None, job_ids=None,
+                 grace_period=300):
+        """
+        :param tasks: 任务目录列表
+        :param done_file: 任务完成标志文件
+        :param running_file: 任务开始标志文件, None 为不区分 waiting / running
+        :param min_interval: 最短检测间隔 (s)
+        :param max_interval: 最长检测间隔 (s)
+        :param use_inotify: 是否使用 inotify 唤醒
+        :param scheduler: 调度后端 (auto_nep.scheduler), None 为只检测标志文件
+        :param job_ids: {task: job_id}
+        :param grace_period: 作业结束后等待 done_file 可见的时间 (s)
+        """
+        self.done_file = done_file
+        self.running_file = running_file
+        self.scheduler = scheduler
+        self.job_ids = dict(job_ids or {})
+        self.grace_period = grace_period
+        self.finished_at = {}
+        self.scheduler_calls = 0
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.state = {}
+        self.stat_calls = 0
+        self.events = 0
+        self.cpu_time = 0.0
+        self.start_time = time.perf_counter()
+
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = _Inotify()
+            except (OSError, AttributeError):
+                self.inotify = None
+        self.mode = "inotify + stat" if self.inotify is not None else "stat"
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task, job_id=None):
+        """
+        加入新任务
+        """
+        if job_id is not None:
+            self.job_ids[task] = job_id
+        if task not in self.state:
+            self.state[task] = self.WAITING
+            if self.inotify is not None and os.path.isdir(task):
+                self.inotify.add(task)
+
+    def tasks(self, state):
+        return [task for task, s in self.state.items() if s == state]
+
+    def finished(self):
+        return all(s in (self.DONE, self.FAILED) for s in self.state.values())
+
+    def poll(self):
+        """
+        对未完成的任务做一次 stat, 更新状态
+        :return: 本轮新完成的任务列表
+        """
+        cpu0 = time.process_time()
+        done, changed = [], False
+        for task, state in self.state.items():
+            if state in (self.DONE, self.FAILED):
+                continue
+            self.stat_calls += 1
+            if os.path.exists(os.path.join(task, self.done_file)):
+                self.state[task] = self.DONE
+                done.append(task)
+                changed = True
+                if self.inotify is not None:
+                    self.inotify.remove(task)
+                continue
+            if state == self.FINISHED:
+                if time.perf_counter() - self.finished_at[task] >= self.grace_period:
+                    self._fail(task)
+                    changed = True
+                continue
+            if state == self.WAITING and self.running_file is not None:
+                self.stat_calls += 1
+                if os.path.exists(os.path.join(task, self.running_file)):
+                    self.state[task] = self.RUNNING
+                    changed = True
+            if self.inotify is not None and task not in self.inotify.watches and os.path.isdir(task):
+                self.inotify.add(task)
+
+        if self.scheduler is not None:
+            changed |= self._check_jobs(done)
+
+        # 状态变化后恢复最短间隔, 否则指数退避
+        self.interval = self.min_interval if changed else min(self.interval * 2, self.max_interval)
+        self.cpu_time += time.process_time() - cpu0
+        return done
+
+    def _check_jobs(self, done):
+        """
+        一次调度器查询更新所有未完成任务的作业状态
+        作业已结束时再 stat 一次 done_file, 仍没有时记为 finished, 由 poll 在 grace_period 内继续检测
+        """
+        pending = {task: job_id for task, job_id in self.job_ids.items()
+                   if self.state.get(task) in (self.WAITING, self.RUNNING, self.FINISHED)}
+        if not pending:
+            return False
+        self.scheduler_calls += 1
+        states = self.scheduler.status(pending.values())
+        changed = False
+        for task, job_id in pending.items():
+            state = states.get(job_id)
+            if self.state[task] == self.FINISHED:
+                # 之前的查询结果有误 (调度器短暂未列出作业), 作业仍在队列中
+                if state in (QUEUED, RUNNING):
+                    self.state[task] = self.RUNNING
+                    self.finished_at.pop(task, None)
+                    changed = True
+                continue
+            if state == RUNNING and self.state[task] == self.WAITING:
+                self.state[task] = self.RUNNING
+                changed = True
+            elif state == FINISHED:
+                self.stat_calls += 1
+                if os.path.exists(os.path.join(task, self.done_file)):
+                    self.state[task] = self.DONE
+                    done.append(task)
+                    if self.inotify is not None:
+                        self.inotify.remove(task)
+                elif self.grace_period > 0:
+                    self.state[task] = self.FINISHED
+                    self.finished_at[task] = time.perf_counter()
+                else:
+                    self._fail(task)
+                changed = True
+        return changed
+
+    def _fail(self, task):
+        self.state[task] = self.FAILED
+        if self.inotify is not None:
+            self.inotify.remove(task)
+
+    def wait(self):
+        """
+        等待一个检测间隔, inotify 事件提前唤醒
+        """
+        if self.inotify is None:
+            time.sleep(self.interval)
+            return
+        events = self.inotify.wait(self.interval)
+        self.events += events
+        if events:
+            self.interval = self.min_interval
+
+    def completions(self, on_poll=None, report_interval=60, on_wake=None):
+        """
+        按完成顺序返回任务目录, 所有任务完成或失败后结束 (失败的任务不返回, 见 tasks(FAILED))
+        :param on_poll: 进度回调 on_poll(watcher), 每 report_interval 秒最多调用一次
+        :param report_interval: 回调间隔 (s)
+        :param on_wake: 每轮检测后调用 on_wake(watcher)
+        :return: generator of task
+        """
+        last_report = None
+        try:
+            while True:
+                yield from self.poll()
+                if on_wake is not None:
+                    on_wake(self)
+                now = time.perf_counter()
+                if on_poll is not None and (last_report is None or now - last_report >= report_interval):
+                    on_poll(self)
+                    last_report = now
+                if self.finished():
+                    break
+                self.wait()
+        finally:
+            self.close()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def report(self):
+        return (f"Watcher ({self.mode}): {len(self.state)} tasks, {len(self.tasks(self.FAILED))} failed, "
+                f"{self.stat_calls} stat calls, {self.scheduler_calls} scheduler queries, "
+                f"{self.events} inotify events, CPU {self.cpu_time:.3f} s in {self.elapsed():.0f} s")
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
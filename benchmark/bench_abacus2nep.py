@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_abacus2nep.py
+@Author ：RongYi
+@Date ：2025/6/30 11:05
+@E-mail ：2071914258@qq.com
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from auto_nep.abacus import Abacus
+
+DASH = "-" * 90
+
+
+def make_log(path, n_atoms, n_scf, rng):
+    """
+    合成 running_scf.log, 只包含 abacus2nep 用到的字段和 SCF 迭代输出
+    """
+    a = 10 + rng.random()
+    frac = rng.random((n_atoms, 3))
+    forces = rng.normal(size=(n_atoms, 3))
+    stress = rng.normal(size=(3, 3)) * 10
+    lines = [" " + "=" * 60, " TOTAL ATOM NUMBER = %d" % n_atoms, ""]
+    lines += [" Lattice vectors: (Cartesian coordinate: in unit of a_0)",
+              "     +%.10f                  +0                  +0" % a,
+              "                  +0       +%.10f                  +0" % a,
+              "                  +0                  +0       +%.10f" % a,
+              " Volume (Bohr^3) = %.10f" % (a ** 3 / 0.529177 ** 3),
+              " Volume (A^3) = %.10f" % a ** 3, ""]
+    for axis in "ABC":
+        lines.append("                                NORM_%s     1.0000000000 %.10f" % (axis, a))
+    lines.append(" atom                  x                  y                  z  mag vx vy vz")
+    for i, (x, y, z) in enumerate(frac):
+        lines.append(" taud_C%d  %.10f  %.10f  %.10f  0.0000  0.0000  0.0000  0.0000" % (i + 1, x, y, z))
+    for step in range(n_scf):
+        lines.append(" GE%d    %.10e    %.10e    %.4e   %.3f" % (step + 1, -1e3, 1e-4, 1e-5, 0.5))
+    lines += [" charge density convergence is achieved",
+              " final etot is -1000.0 eV",
+              " " + "!" * 10 + " FINAL_ETOT_IS %.10f eV" % (-1000 * rng.random()), "",
+              " " + DASH, " TOTAL-FORCE (eV/Angstrom)", " " + DASH]
+    for i, f in enumerate(forces):
+        lines.append(" C%-10d %20.10f %20.10f %20.10f" % (i + 1, *f))
+    lines += [" " + DASH, "", " " + DASH, " TOTAL-STRESS (KBAR)", " " + DASH]
+    for s in stress:
+        lines.append(" %20.10f %20.10f %20.10f" % tuple(s))
+    lines += [" " + DASH, ""]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def make_dataset(root, n_logs, n_atoms, n_scf, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(n_logs):
+        out = os.path.join(root, str(i), "OUT.ABACUS")
+        os.makedirs(out)
+        make_log(os.path.join(out, "running_scf.log"), n_atoms, n_scf, rng)
+    # 未收敛任务
+    out = os.path.join(root, "unconverged", "OUT.ABACUS")
+    os.makedirs(out)
+    with open(os.path.join(out, "running_scf.log"), "w") as f:
+        f.write(" TOTAL ATOM NUMBER = 1\n")
+
+
+def find_logs(root):
+    """
+    与 Abacus.abacus2nep 相同的日志顺序
+    """
+    log_files = []
+    for root2, dirs, files in os.walk(root):
+        dirs.sort()
+        log_files += [os.path.abspath(os.path.join(root2, f)) for f in sorted(files) if f == "running_scf.log"]
+    return log_files
+
+
+def legacy(log_files, filename):
+    """
+    原 Abacus.abacus2nep 的解析和输出 (去掉 sysprint)
+    """
+    for log_file in log_files:
+        with open(log_file, encoding='utf-8') as f:
+            content = f.read()
+        if "charge density convergence is achieved" not in content:
+            continue
+        config_type = "/".join(log_file.split("/")[:-2])
+        total_atom_number = re.search(r"TOTAL ATOM NUMBER = (\d+)", content).group(1)
+        lattice = re.search(r" Lattice vectors.*(\n.*\n.*\n.*)", content).group(1).strip().replace('+', '')
+        lattice = ' '.join([f'{float(l):.10f}' for l in lattice.split()])
+        energy = float(re.search(r"FINAL_ETOT_IS\s+(\S+)", content).group(1))
+        volume = float(re.search(r"Volume \(A\^3\) = (\S+)", content).group(1).strip())
+        stress = re.search(r"TOTAL-STRESS.*\n.*(\n.*\n.*\n.*)", content).group(1).strip()
+        virial = ' '.join([f'{volume * float(s) * 0.062415091:.10f}' for s in stress.split()])
+        cell_a = float(re.search(r"NORM_A\s+\S+ (.*)", content).group(1))
+        cell_b = float(re.search(r"NORM_B\s+\S+ (.*)", content).group(1))
+        cell_c = float(re.search(r"NORM_C\s+\S+ (.*)", content).group(1))
+        type_position = re.compile(r"taud_([a-z,A-z]+)\w+\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)").findall(content)
+        type_position = [f'{type}\t{float(x) * cell_a:.10f}\t{float(y) * cell_b:.10f}\t{float(z) * cell_c:.10f}'
+                         for type, x, y, z in type_position]
+        force_match = re.compile(
+            r"TOTAL-FORCE \(eV/Angstrom\)\s*"
+            r"------------------------------------------------------------------------------------------\s*"
+            r"((?:\s*\S+\s+-?\d+\.\d+\s+-?\d+\.\d+\s+-?\d+\.\d+\s*\n)*)",
+            re.DOTALL
+        )
+        force = list(filter(None, force_match.search(content).group(1).split('\n')))
+        with open(filename, 'a', encoding='utf-8') as f:
+            f.write(f'{total_atom_number}\n'
+                    f'Energy={energy:.10f} Lattice=\"{lattice}\" Virial=\"{virial}\"'
+                    f' Config_type=\"{config_type}\" Properties=species:S:1:pos:R:3:forces:R:3'
+                    f' Weight=1.0 Pbc=\"T T T\"\n')
+            for part1, part2 in zip(type_position, force):
+                pattern = re.compile(r'^[+-]?\d+(\.\d+)?$')
+                part2 = '\t'.join([item for item in part2.split(' ') if pattern.match(item)])
+                f.write('\t'.join([part1, part2]) + "\n")
+
+
+def main(n_logs=2000, n_atoms=64, n_scf=30, n_jobs=4):
+    """
+    python benchmark/bench_abacus2nep.py [n_logs] [n_atoms] [n_scf] [n_jobs]
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        root = os.path.join(tmp, "dataset")
+        make_dataset(root, n_logs, n_atoms, n_scf)
+        print(f"dataset: {n_logs} logs x {n_atoms} atoms")
+
+        abacus = Abacus()
+        abacus.dataset_roots = [root]
+        new = os.path.join(tmp, "new.xyz")
+        t0 = time.perf_counter()
+        abacus.abacus2nep(new, n_jobs=1)
+        t_serial = time.perf_counter() - t0
+
+        parallel = os.path.join(tmp, "parallel.xyz")
+        t0 = time.perf_counter()
+        abacus.abacus2nep(parallel, n_jobs=n_jobs)
+        t_parallel = time.perf_counter() - t0
+
+        log_files = find_logs(root)
+        old = os.path.join(tmp, "legacy.xyz")
+        t0 = time.perf_counter()
+        legacy(log_files, old)
+        t_legacy = time.perf_counter() - t0
+
+        print(f"{'legacy':12s}{t_legacy:10.3f} s")
+        print(f"{'single-pass':12s}{t_serial:10.3f} s")
+        print(f"{'n_jobs=%d' % n_jobs:12s}{t_parallel:10.3f} s")
+
+        # 输出逐字节一致
+        with open(old, "rb") as f:
+            expected = f.read()
+        for path in (new, parallel):
+            with open(path, "rb") as f:
+                assert f.read() == expected
+
+        # 增量: 新增 1% 的日志后再次提取, 只解析新日志
+        rng = np.random.default_rng(1)
+        for i in range(max(1, n_logs // 100)):
+            out = os.path.join(root, f"new_{i}", "OUT.ABACUS")
+            os.makedirs(out)
+            make_log(os.path.join(out, "running_scf.log"), n_atoms, n_scf, rng)
+        t0 = time.perf_counter()
+        abacus.abacus2nep(new, n_jobs=1)
+        print(f"{'incremental':12s}{time.perf_counter() - t0:10.3f} s")
+        log_files = find_logs(root)
+        os.remove(old)
+        legacy(log_files, old)
+        with open(old, "rb") as f, open(new, "rb") as g:
+            assert f.read() == g.read()
+
+        # 两个数据集依次提取到同一文件: 与原实现相同, 第二次在第一次的结构后追加
+        other = os.path.join(tmp, "other")
+        make_dataset(other, max(1, n_logs // 100), n_atoms, n_scf, seed=2)
+        sequence = os.path.join(tmp, "sequence.xyz")
+        for dataset in (root, other, other):
+            abacus.dataset_roots = [dataset]
+            abacus.abacus2nep(sequence, n_jobs=1)
+        os.remove(old)
+        legacy(log_files, old)
+        legacy(find_logs(other), old)
+        with open(old, "rb") as f, open(sequence, "rb") as g:
+            assert f.read() == g.read()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:5]]
+    main(*args)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_asi_io.py
+@Author ：RongYi
+@Date ：2025/6/20 10:12
+@E-mail ：2071914258@qq.com
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from auto_nep.select.asi_io import save_asi, load_asi_text, save_asi_binary, load_asi_binary
+
+
+def legacy_save_asi(asi, filename):
+    with open(filename, "w") as f:
+        for k, v in asi.items():
+            f.write(f"{k} {v.shape[0]} {v.shape[1]}\n")
+            for i in v.flatten():
+                f.write(str(i) + "\n")
+
+
+def legacy_load_asi(asi):
+    ret = {}
+    with open(asi, "r") as f:
+        while True:
+            B = []
+            line1 = f.readline()
+            if len(line1) == 0:
+                break
+            line1 = line1.split(" ")
+            element, shape1, shape2 = line1[0], int(line1[1]), int(line1[2])
+            for _ in range(shape1 * shape2):
+                B.append(float(f.readline()))
+            ret[element] = np.array(B).reshape((shape1, shape2))
+    return ret
+
+
+def timeit(func, *args, repeat=3):
+    best = float("inf")
+    ret = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ret = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, ret
+
+
+def main(dim=300, elements=("C", "N", "Ga", "O")):
+    """
+    python benchmark/bench_asi_io.py [dim]
+    """
+    rng = np.random.default_rng(0)
+    asi = {e: rng.standard_normal((dim, dim)) for e in elements}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy, text, binary = [os.path.join(tmp, f) for f in ("legacy.asi", "text.asi", "binary.asib")]
+
+        t_legacy_save, _ = timeit(legacy_save_asi, asi, legacy)
+        t_text_save, _ = timeit(save_asi, asi, text)
+        t_bin_save, _ = timeit(save_asi_binary, asi, binary)
+
+        t_legacy_load, ref = timeit(legacy_load_asi, legacy)
+        t_text_load, ret_text = timeit(load_asi_text, text)
+        t_bin_load, ret_bin = timeit(load_asi_binary, binary)
+
+        for e in elements:
+            assert np.array_equal(ref[e], asi[e])
+            assert np.array_equal(ret_text[e], asi[e])
+            assert np.array_equal(ret_bin[e], asi[e])
+        with open(legacy) as f1, open(text) as f2:
+            assert f1.read() == f2.read()
+
+        print(f"asi: {len(elements)} elements x ({dim}, {dim}) float64")
+        print(f"{'':12s}{'save(s)':>12s}{'load(s)':>12s}")
+        print(f"{'legacy':12s}{t_legacy_save:12.4f}{t_legacy_load:12.4f}")
+        print(f"{'text':12s}{t_text_save:12.4f}{t_text_load:12.4f}")
+        print(f"{'binary':12s}{t_bin_save:12.4f}{t_bin_load:12.4f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_calculate_maxvol.py
+@Author ：RongYi
+@Date ：2025/6/25 10:06
+@E-mail ：2071914258@qq.com
+"""
+import sys
+import time
+
+import numpy as np
+
+from auto_nep.select.maxvol import find_inverse, get_maxvol, get_maxvol_swaps, update_active_set
+from bench_maxvol import test_matrix, max_gamma
+
+
+def legacy_stage1(A, struct_index, batch_size, e, k, maxvol):
+    """
+    旧的 stage 1: 每个 batch 把已选行和新 batch 拼接后重新 MaxVol
+    """
+    A_selected, struct_index_selected = None, None
+    for ind in np.array_split(np.arange(len(A)), np.ceil(len(A) / batch_size)):
+        if A_selected is None:
+            A_joint, struct_index_joint = A[ind], struct_index[ind]
+        else:
+            A_joint = np.vstack([A_selected, A[ind]])
+            struct_index_joint = np.hstack([struct_index_selected, struct_index[ind]])
+        selected = maxvol(A_joint, e, k)
+        A_selected, struct_index_selected = A_joint[selected], struct_index_joint[selected]
+    return A_selected, struct_index_selected
+
+
+def stage1(A, struct_index, batch_size, e, k, maxvol, swaps):
+    """
+    新的 stage 1: 保留主动学习集的逆, 新 batch 的系数为 A_batch @ inv
+    """
+    A_selected, struct_index_selected, inv = None, None, None
+    for ind in np.array_split(np.arange(len(A)), np.ceil(len(A) / batch_size)):
+        if A_selected is None:
+            selected = maxvol(A[ind], e, k)
+            A_selected, struct_index_selected = A[ind][selected], struct_index[ind][selected]
+            inv = find_inverse(A_selected)
+        else:
+            A_selected, struct_index_selected, inv, _ = update_active_set(
+                A_selected, struct_index_selected, inv, A[ind], struct_index[ind], e, k, swaps
+            )
+    return A_selected, struct_index_selected
+
+
+def main(n=200000, r=60, batch_size=10000, e=1.001, k=1000):
+    """
+    python benchmark/bench_calculate_maxvol.py [n] [r] [batch_size]
+    """
+    A = test_matrix(n, r)
+    struct_index = np.arange(n)
+    maxvol = get_maxvol("CPU")
+    swaps = get_maxvol_swaps("CPU")
+    print(f"A: ({n}, {r}), batch size {batch_size}")
+    print(f"{'stage 1':16s}{'time(s)':>10s}{'rows/s':>12s}{'max gamma':>12s}{'log|det|':>12s}")
+
+    for name, run in (
+        ("legacy", lambda: legacy_stage1(A, struct_index, batch_size, e, k, maxvol)),
+        ("coefficients", lambda: stage1(A, struct_index, batch_size, e, k, maxvol, swaps)),
+    ):
+        t0 = time.perf_counter()
+        _, I = run()
+        t = time.perf_counter() - t0
+        logdet = np.linalg.slogdet(A[I])[1]
+        print(f"{name:16s}{t:10.3f}{n / t:12.0f}{max_gamma(A, I):12.4f}{logdet:12.4f}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    main(*args)
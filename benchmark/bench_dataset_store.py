@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_dataset_store.py
+@Author ：RongYi
+@Date ：2025/7/3 15:10
+@E-mail ：2071914258@qq.com
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ase.io import read
+
+from auto_nep.dataset import DatasetStore
+
+
+def make_xyz(path, n_frames, n_atoms, rng):
+    with open(path, "w") as f:
+        for i in range(n_frames):
+            f.write(f'{n_atoms}\nEnergy={-rng.random() * 100:.10f} Lattice="10 0 0 0 10 0 0 0 10" '
+                    f'Virial="{" ".join("%.10f" % v for v in rng.normal(size=9))}" Config_type="bench{i}" '
+                    f'Properties=species:S:1:pos:R:3:forces:R:3 Weight=1.0 Pbc="T T T"\n')
+            for x, y, z, fx, fy, fz in np.c_[rng.random((n_atoms, 3)) * 10, rng.normal(size=(n_atoms, 3))]:
+                f.write(f"Ga\t{x:.10f}\t{y:.10f}\t{z:.10f}\t{fx:.10f}\t{fy:.10f}\t{fz:.10f}\n")
+
+
+def disk_usage(root):
+    return sum(os.path.getsize(os.path.join(r, f)) for r, _, files in os.walk(root) for f in files)
+
+
+def main(n_init=2000, n_add=200, n_iter=10, n_atoms=64):
+    """
+    python benchmark/bench_dataset_store.py [n_init] [n_add] [n_iter] [n_atoms]
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        make_xyz(f"{tmp}/init.xyz", n_init, n_atoms, rng)
+        for i in range(1, n_iter):
+            make_xyz(f"{tmp}/add_{i}.xyz", n_add, n_atoms, rng)
+        print(f"{n_iter} iterations: {n_init} initial + {n_add} per iteration, {n_atoms} atoms")
+
+        # 原流程: 每次迭代 cat 上一次的 train.xyz 和 to_add.xyz, 所有副本保留
+        legacy = f"{tmp}/legacy"
+        t0 = time.perf_counter()
+        for i in range(n_iter):
+            os.makedirs(f"{legacy}/iter_{i}")
+            src = f"{tmp}/init.xyz" if i == 0 else f"{legacy}/iter_{i - 1}/train.xyz {tmp}/add_{i}.xyz"
+            os.system(f"cat {src} > {legacy}/iter_{i}/train.xyz")
+        t_legacy = time.perf_counter() - t0
+
+        # 存储: 只追加新结构, 导出本次迭代的 train.xyz, 删除上一次的
+        store_dir = f"{tmp}/store"
+        store = DatasetStore(f"{store_dir}/dataset_store")
+        t0 = time.perf_counter()
+        for i in range(n_iter):
+            os.makedirs(f"{store_dir}/iter_{i}")
+            store.append_xyz(f"{tmp}/init.xyz" if i == 0 else f"{tmp}/add_{i}.xyz", i)
+            store.export_xyz(f"{store_dir}/iter_{i}/train.xyz")
+            if i > 0:
+                os.remove(f"{store_dir}/iter_{i - 1}/train.xyz")
+        t_store = time.perf_counter() - t0
+
+        print(f"{'':10s}{'build (s)':>12s}{'disk (MB)':>12s}")
+        print(f"{'legacy':10s}{t_legacy:12.3f}{disk_usage(legacy) / 1024 ** 2:12.1f}")
+        print(f"{'store':10s}{t_store:12.3f}{disk_usage(store_dir) / 1024 ** 2:12.1f}")
+
+        # 后续步骤读取全部结构
+        train = f"{store_dir}/iter_{n_iter - 1}/train.xyz"
+        t0 = time.perf_counter()
+        a = read(train, index=":")
+        t_read = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        b = store.read()
+        t_load = time.perf_counter() - t0
+        print(f"load {len(a)} frames: ase read {t_read:.3f} s, store {t_load:.3f} s")
+
+        assert len(a) == len(b) == n_init + (n_iter - 1) * n_add
+        for x, y in zip(a[::97], b[::97]):
+            assert np.allclose(x.positions, y.positions) and np.allclose(x.get_forces(), y.get_forces())
+            assert abs(x.info["Energy"] - y.get_potential_energy()) < 1e-9
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:5]]
+    main(*args)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_find_struc.py
+@Author ：RongYi
+@Date ：2025/7/4 16:40
+@E-mail ：2071914258@qq.com
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ase import Atoms
+from ase.io import read, write
+
+from auto_nep.utils.find_struc_from_dataset import StructureIndex, find_struc
+
+
+def make_frames(n_frames, n_atoms, rng):
+    frames = []
+    for _ in range(n_frames):
+        atoms = Atoms(rng.choice(["Ga", "N", "O"], n_atoms), positions=rng.random((n_atoms, 3)) * 10,
+                      cell=[10, 10, 10], pbc=True)
+        atoms.info["Energy"] = rng.normal()
+        frames.append(atoms)
+    return frames
+
+
+def legacy(train_xyz, dataset, precision=0):
+    """
+    原 find_struc: 每个结构从数据集开头线性查找
+    """
+    shifted_xyz = read(train_xyz, format='extxyz', index=':')
+    no_shifted_xyz = read(dataset, format='extxyz', index=':')
+    len1, len2 = len(shifted_xyz), len(no_shifted_xyz)
+    total_index, no_in1, no_in2 = [], [], []
+    for shifted_index in range(len1):
+        no_shifted_index = 0
+        pos1 = np.around(shifted_xyz[shifted_index].get_positions(), precision)
+        pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
+        while True:
+            if len(pos1) != len(pos2):
+                if no_shifted_index < len(no_shifted_xyz) - 1:
+                    no_shifted_index += 1
+                    pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
+                else:
+                    no_in2.append(shifted_index)
+                    break
+            else:
+                if (pos1 == pos2).all():
+                    with open("./index.txt", "a") as f:
+                        f.write(f"shifted_index: {shifted_index} -> no_shifted_index: {no_shifted_index}\n")
+                    total_index.append(no_shifted_index)
+                    break
+                else:
+                    if np.sum(pos1 == pos2) / pos1.size >= 0.99:
+                        total_index.append(no_shifted_index)
+                        break
+                    if no_shifted_index < len(no_shifted_xyz) - 1:
+                        no_shifted_index += 1
+                        pos2 = np.around(no_shifted_xyz[no_shifted_index].get_positions(), precision)
+                    else:
+                        no_in2.append(shifted_index)
+                        break
+    for i in range(len2):
+        if i not in total_index:
+            no_in1.append(i)
+    write('./find_no_shifted.xyz', [no_shifted_xyz[i] for i in total_index], format='extxyz')
+    write('./no_in1.xyz', [no_shifted_xyz[i] for i in no_in1], format='extxyz')
+    write('./no_in2.xyz', [shifted_xyz[i] for i in no_in2], format='extxyz')
+
+
+def run(func, cwd, *args):
+    os.makedirs(cwd)
+    here = os.getcwd()
+    os.chdir(cwd)
+    try:
+        t0 = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - t0
+    finally:
+        os.chdir(here)
+
+
+def main(n_dataset=5000, n_train=1000, n_atoms=64, precision=3):
+    """
+    python benchmark/bench_find_struc.py [n_dataset] [n_train] [n_atoms] [precision]
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        dataset = make_frames(n_dataset, n_atoms, rng)
+        write(f"{tmp}/dataset.xyz", dataset, format="extxyz")
+        # train: 打乱后的子集 (能量平移后重新写出) + 数据集中没有的结构
+        train = [dataset[i].copy() for i in rng.choice(n_dataset, n_train - n_train // 10, replace=False)]
+        train += make_frames(n_train // 10, n_atoms, rng)
+        for atoms in train:
+            atoms.info["energy"] = rng.normal()
+        write(f"{tmp}/train.xyz", train, format="extxyz")
+        print(f"dataset {n_dataset} frames, train {n_train} frames, {n_atoms} atoms")
+
+        t_legacy = run(legacy, f"{tmp}/legacy", f"{tmp}/train.xyz", f"{tmp}/dataset.xyz", precision)
+        t_index = run(find_struc, f"{tmp}/index", f"{tmp}/train.xyz", f"{tmp}/dataset.xyz", precision)
+        print(f"{'legacy':10s}{t_legacy:10.3f} s")
+        print(f"{'index':10s}{t_index:10.3f} s")
+        for name in ["index.txt", "find_no_shifted.xyz", "no_in1.xyz", "no_in2.xyz"]:
+            with open(f"{tmp}/legacy/{name}") as f, open(f"{tmp}/index/{name}") as g:
+                assert f.read() == g.read(), name
+
+        # 近似匹配: 一个坐标跨过取整边界, 偏差小于半个取整单位
+        atoms = dataset[7].copy()
+        unit = 10.0 ** -precision
+        atoms.positions[0, 0] = (np.floor(atoms.positions[0, 0] / unit) + 0.5) * unit + 0.1 * unit
+        dataset[7].positions[0, 0] = atoms.positions[0, 0] - 0.2 * unit
+        index = StructureIndex(dataset, precision)
+        # 一个坐标不同时至少 100 个坐标才满足 99% 相等
+        assert index.find(atoms) == ((7, False) if 3 * n_atoms >= 100 else (None, False))
+        atoms.positions += 2 * unit
+        assert index.find(atoms) == (None, False)
+
+        # 与原实现相同, 不限制偏差大小: 100 个原子中一个移动 2 Å, 299/300 的坐标相等
+        frames = make_frames(20, 100, rng)
+        atoms = frames[11].copy()
+        atoms.positions[3] += 2.0
+        index = StructureIndex(frames, precision)
+        assert index.find(atoms) == (11, False)
+        # 多个结构满足时取第一个
+        frames[5] = frames[11].copy()
+        frames[5].positions[3] -= 1.0
+        assert StructureIndex(frames, precision).find(atoms) == (5, False)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:5]]
+    main(*args)
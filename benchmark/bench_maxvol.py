@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_maxvol.py
+@Author ：RongYi
+@Date ：2025/6/22 09:41
+@E-mail ：2071914258@qq.com
+"""
+import sys
+import time
+
+import numpy as np
+from scipy.linalg import lu, solve_triangular
+
+from auto_nep.select.maxvol_cpu import maxvol
+from auto_nep.select.engines import ENGINES
+
+
+def legacy_maxvol(A, e, k):
+    n, r = A.shape
+    P, L, U = lu(A, check_finite=False)
+    I = P[:, :r].argmax(axis=0)
+    Q = solve_triangular(U, A.T, trans=1, check_finite=False)
+    B = solve_triangular(
+        L[:r, :], Q, trans=1, check_finite=False, unit_diagonal=True, lower=True
+    ).T
+    for iter in range(k):
+        i, j = np.divmod(np.abs(B).argmax(), r)
+        if np.abs(B[i, j]) <= e:
+            break
+        I[j] = i
+        bj = B[:, j]
+        bi = B[i, :].copy()
+        bi[j] -= 1.0
+        B -= np.outer(bj, bi / B[i, j])
+    return I
+
+
+def test_matrix(n, r, seed=0):
+    """
+    病态的 B projection 替代矩阵: 列尺度跨越几个数量级
+    """
+    rng = np.random.default_rng(seed)
+    A = rng.standard_normal((n, r)) * np.logspace(0, -3, r)
+    return A @ rng.standard_normal((r, r))
+
+
+def max_gamma(A, I):
+    inv = np.linalg.pinv(A[I], rcond=1e-8)
+    return np.abs(A @ inv).max()
+
+
+def main(n=100000, r=60, e=1.001, k=1000):
+    """
+    python benchmark/bench_maxvol.py [n] [r]
+    """
+    A = test_matrix(n, r)
+    print(f"A: ({n}, {r})")
+    print(f"{'kernel':16s}{'time(s)':>10s}{'max gamma':>12s}{'same rows':>12s}")
+
+    t0 = time.perf_counter()
+    I_ref = legacy_maxvol(A, e, k)
+    print(f"{'legacy':16s}{time.perf_counter() - t0:10.3f}{max_gamma(A, I_ref):12.4f}{'-':>12s}")
+
+    for dtype in (np.float64, np.float32):
+        t0 = time.perf_counter()
+        I = maxvol(A, e, k, dtype=dtype)
+        t = time.perf_counter() - t0
+        same = np.array_equal(np.sort(I), np.sort(I_ref))
+        print(f"{np.dtype(dtype).name:16s}{t:10.3f}{max_gamma(A, I):12.4f}{str(same):>12s}")
+
+    print()
+    print(f"{'engine':16s}{'iters':>10s}{'time(s)':>10s}{'max gamma':>12s}")
+    for name, engine in ENGINES.items():
+        stats = {}
+        t0 = time.perf_counter()
+        I = engine(A, e, k, stats=stats)
+        t = time.perf_counter() - t0
+        print(f"{name:16s}{stats['iters']:10d}{t:10.3f}{max_gamma(A, I):12.4f}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
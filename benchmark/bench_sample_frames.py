@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_sample_frames.py
+@Author ：RongYi
+@Date ：2025/6/29 16:40
+@E-mail ：2071914258@qq.com
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ase import Atoms
+from ase.io import read, write
+
+from auto_nep.utils.xyz_stream import count_frames, sample_frames
+
+
+def make_dump(path, n_frames, n_atoms, seed=0):
+    """
+    合成 extrapolation_dump.xyz
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        for _ in range(n_frames):
+            atoms = Atoms(f"C{n_atoms}", positions=rng.random((n_atoms, 3)) * 20, cell=[20, 20, 20], pbc=True)
+            atoms.arrays["gamma"] = rng.random(n_atoms) * 10
+            write(f, atoms, format="extxyz")
+
+
+def legacy(path, k):
+    extrapolation = read(path, index=":", format="extxyz")
+    if len(extrapolation) > k:
+        random.shuffle(extrapolation)
+        extrapolation = extrapolation[:k]
+        write(path, extrapolation, format="extxyz")
+    return len(extrapolation)
+
+
+def main(n_frames=2000, n_atoms=1000, k=20):
+    """
+    python benchmark/bench_sample_frames.py [n_frames] [n_atoms] [k]
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp, "dump.xyz")
+        make_dump(src, n_frames, n_atoms)
+        print(f"dump: {n_frames} frames x {n_atoms} atoms, {os.path.getsize(src) / 1024 ** 2:.1f} MB")
+
+        dst = os.path.join(tmp, "legacy.xyz")
+        shutil.copy(src, dst)
+        t0 = time.perf_counter()
+        legacy(dst, k)
+        print(f"{'legacy':10s}{time.perf_counter() - t0:10.3f} s")
+
+        dst = os.path.join(tmp, "stream.xyz")
+        shutil.copy(src, dst)
+        t0 = time.perf_counter()
+        count, kept = sample_frames(dst, k)
+        print(f"{'stream':10s}{time.perf_counter() - t0:10.3f} s")
+
+        # 选中的结构与原文件逐字节一致
+        assert count == n_frames and kept == k == count_frames(dst)
+        with open(src, "rb") as f:
+            original = f.read()
+        with open(dst, "rb") as f:
+            for line in f.read().split(b"Lattice")[1:]:
+                assert line in original
+        assert len(read(dst, index=":")) == k
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    main(*args)
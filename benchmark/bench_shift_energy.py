@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_shift_energy.py
+@Author ：RongYi
+@Date ：2025/7/4 10:20
+@E-mail ：2071914258@qq.com
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from ase.io import iread, read, write
+
+from auto_nep.shift import shift_energy
+from auto_nep.shift.shift_energy import SVD_A
+
+
+def make_xyz(path, n_frames, n_atoms, rng, symbols=("Ga", "N", "O")):
+    ref = {"Ga": -3.0, "N": -8.0, "O": -5.0, "H": -1.0}
+    with open(path, "w") as f:
+        for i in range(n_frames):
+            species = [symbols[j] for j in rng.integers(0, len(symbols), n_atoms)]
+            energy = sum(ref[s] for s in species) + rng.normal()
+            f.write(f'{n_atoms}\nEnergy={energy:.10f} Lattice="10 0 0 0 10 0 0 0 10" '
+                    f'Config_type="bench{i}" Properties=species:S:1:pos:R:3:forces:R:3 Pbc="T T T"\n')
+            for s, (x, y, z, fx, fy, fz) in zip(species, np.c_[rng.random((n_atoms, 3)) * 10,
+                                                               rng.normal(size=(n_atoms, 3))]):
+                f.write(f"{s}\t{x:.10f}\t{y:.10f}\t{z:.10f}\t{fx:.10f}\t{fy:.10f}\t{fz:.10f}\n")
+
+
+def legacy(xyz, filename):
+    """
+    原 shift_energy: 整体读取, 逐元素 count 组成矩阵, 完整 SVD
+    """
+    all_frames = read(xyz, index=":")
+    all_elements = sorted(set(s for a in all_frames for s in a.get_chemical_symbols()))
+    composition_matrix = np.zeros((len(all_frames), len(all_elements)))
+    energy_matrix = np.zeros((len(all_frames), 1))
+    for i in range(len(all_frames)):
+        for j in range(len(all_elements)):
+            composition_matrix[i][j] = all_frames[i].get_chemical_symbols().count(all_elements[j])
+        try:
+            energy_matrix[i][0] = all_frames[i].get_potential_energy()
+        except RuntimeError:
+            energy_matrix[i][0] = all_frames[i].info["Energy"]
+    if np.linalg.matrix_rank(composition_matrix) < len(all_elements):
+        import itertools
+        for i in itertools.combinations(range(len(all_elements)), 2):
+            additional_matrix = np.zeros(len(all_elements))
+            additional_matrix[i[0]] = 1
+            additional_matrix[i[1]] = -1
+            composition_matrix = np.r_[composition_matrix, [additional_matrix]]
+            energy_matrix = np.r_[energy_matrix, [np.zeros(1)]]
+    atomic_shifted_energy = SVD_A(composition_matrix, energy_matrix)
+    shifted_energy = (energy_matrix - np.matmul(composition_matrix, atomic_shifted_energy)).flatten()
+    for i in range(len(all_frames)):
+        try:
+            forces = all_frames[i].get_forces()
+            all_frames[i].new_array('forces', forces)
+        except:
+            pass
+        all_frames[i].calc = None
+        all_frames[i].info['energy'] = shifted_energy[i]
+    write(filename, all_frames)
+
+
+def measure(func, *args):
+    """
+    计时后再用 tracemalloc 单独跑一次统计内存峰值 (tracemalloc 本身很慢)
+    """
+    t0 = time.perf_counter()
+    func(*args)
+    t = time.perf_counter() - t0
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return t, peak / 1024 ** 2
+
+
+def compare(a, b):
+    for x, y in zip(iread(a, index=":"), iread(b, index=":")):
+        assert abs(x.get_potential_energy() - y.get_potential_energy()) < 1e-6
+        assert np.array_equal(x.positions, y.positions) and np.array_equal(x.get_forces(), y.get_forces())
+
+
+def main(n_frames=5000, n_atoms=32):
+    """
+    python benchmark/bench_shift_energy.py [n_frames] [n_atoms]
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        xyz = os.path.join(tmp, "no-shifted.xyz")
+        make_xyz(xyz, n_frames, n_atoms, rng)
+        print(f"xyz: {n_frames} frames x {n_atoms} atoms")
+
+        t_legacy, m_legacy = measure(legacy, xyz, f"{tmp}/legacy.xyz")
+        t_stream, m_stream = measure(shift_energy, xyz, f"{tmp}/stream.xyz")
+        print(f"{'':10s}{'time (s)':>12s}{'peak (MB)':>12s}")
+        print(f"{'legacy':10s}{t_legacy:12.3f}{m_legacy:12.1f}")
+        print(f"{'stream':10s}{t_stream:12.3f}{m_stream:12.1f}")
+        compare(f"{tmp}/legacy.xyz", f"{tmp}/stream.xyz")
+
+        # 欠定: 所有结构组成相同 (每个结构 1 个 H)
+        xyz = os.path.join(tmp, "single.xyz")
+        make_xyz(xyz, 50, n_atoms, rng, symbols=("Ga",))
+        with open(xyz) as f:
+            text = f.read()
+        with open(xyz, "w") as f:
+            f.write(text.replace('Pbc="T T T"\nGa\t', 'Pbc="T T T"\nH\t'))
+        legacy(xyz, f"{tmp}/legacy.xyz")
+        shift_energy(xyz, f"{tmp}/stream.xyz")
+        compare(f"{tmp}/legacy.xyz", f"{tmp}/stream.xyz")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
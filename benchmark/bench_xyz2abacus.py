@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project ：auto_nep
+@File ：bench_xyz2abacus.py
+@Author ：RongYi
+@Date ：2025/7/2 14:30
+@E-mail ：2071914258@qq.com
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ase import Atoms
+from ase.io import read, write
+
+from auto_nep.utils.convert import PPBasisLookup, write_stru_dataset
+
+
+def make_xyz(path, n_frames, n_atoms, seed=0):
+    rng = np.random.default_rng(seed)
+    symbols = ["Ga", "N", "O"]
+    with open(path, "w") as f:
+        for _ in range(n_frames):
+            atoms = Atoms([symbols[i] for i in rng.integers(0, 3, n_atoms)],
+                          positions=rng.random((n_atoms, 3)) * 10, cell=[10, 10, 10], pbc=True)
+            write(f, atoms, format="extxyz")
+
+
+def make_pp_basis(root):
+    pp_path, basis_path = os.path.join(root, "pp"), os.path.join(root, "basis")
+    os.makedirs(pp_path)
+    os.makedirs(basis_path)
+    for e in ["Ga", "N", "O"]:
+        open(os.path.join(pp_path, f"{e}_ONCV_PBE-1.0.upf"), "w").close()
+        open(os.path.join(basis_path, f"{e}_gga_7au_100Ry_2s2p1d.orb"), "w").close()
+    return pp_path, basis_path
+
+
+def legacy(xyz, out, pp, basis, n):
+    """
+    原 Abacus.xyz2abacus: 整体读取一次, 每个结构再按 index 从头读取
+    """
+    atoms = read(xyz, index=f":{n}")
+    for i in range(1, len(atoms) + 1):
+        single_struc = read(xyz, index=f'{i-1}')
+        os.makedirs(f'{out}/{i}', exist_ok=True)
+        single_struc.write(f'{out}/{i}/STRU', format='abacus', pp=pp, basis=basis)
+    return len(atoms)
+
+
+def main(n_frames=10000, n_atoms=64, n_jobs=4, n_legacy=200):
+    """
+    python benchmark/bench_xyz2abacus.py [n_frames] [n_atoms] [n_jobs] [n_legacy]
+    原实现是平方复杂度, 只在前 n_legacy 个结构上计时
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        xyz = os.path.join(tmp, "to_add.xyz")
+        make_xyz(xyz, n_frames, n_atoms)
+        pp_path, basis_path = make_pp_basis(tmp)
+        lookup = PPBasisLookup(pp_path, basis_path)
+        pp, basis = lookup.get(["Ga", "N", "O"])
+        print(f"xyz: {n_frames} frames x {n_atoms} atoms")
+
+        n = min(n_legacy, n_frames)
+        t0 = time.perf_counter()
+        legacy(xyz, os.path.join(tmp, "legacy"), pp, basis, n)
+        t = time.perf_counter() - t0
+        print(f"{'legacy':12s}{n:8d} frames {t:10.3f} s {n / t:10.0f} frames/s")
+
+        for jobs in sorted({1, n_jobs}):
+            out = os.path.join(tmp, f"stream_{jobs}")
+            t0 = time.perf_counter()
+            dirs, elements = write_stru_dataset(xyz, lambda i: f"{out}/{i}", lookup, jobs)
+            t = time.perf_counter() - t0
+            print(f"{'n_jobs=%d' % jobs:12s}{len(dirs):8d} frames {t:10.3f} s {len(dirs) / t:10.0f} frames/s")
+            assert len(dirs) == n_frames and elements == {"Ga", "N", "O"}
+
+        # 与原实现写出的 STRU 一致
+        for i in range(1, n + 1):
+            with open(f"{tmp}/legacy/{i}/STRU") as f, open(f"{tmp}/stream_1/{i}/STRU") as g:
+                assert f.read() == g.read()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:5]]
+    main(*args)
@@ -15,6 +15,9 @@ setup(
     author='Jack-RY',
     author_email='2071914258@qq.com',
     packages=find_packages(),
+    install_requires=[
+        'joblib',
+    ],
     entry_points={
         'console_scripts': [
             'auto-nep = auto_nep.cli.cli:main',